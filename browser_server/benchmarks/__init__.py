@@ -0,0 +1,9 @@
+"""Benchmarks of the browser server.
+
+Run from the browser_server directory, e.g.
+``python -m benchmarks.profiles``.
+
+Modules:
+    * profiles: Browser startup time and memory usage per driver profile
+    * protocol: Server throughput and client latency with fake browsers
+"""
@@ -0,0 +1,105 @@
+"""Measure browser startup time and memory usage of driver profiles.
+
+Each profile's browser is launched a number of times. For every launch
+the time `build()` takes and the resident set size of the driver's
+process tree (after optionally loading a page) are recorded. Results
+are printed as JSON. Memory is read from /proc, so it is only
+available on Linux.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+
+from driver_factories import PROFILES, FirefoxDriverFactory, ChromeDriverFactory
+from main import select_browser, FIREFOX
+from processes import rss
+
+
+def measure(factory, url=None, settle=2.0):
+    """Launch a browser once and measure it.
+
+    Parameters
+    ----------
+    factory : BaseDriverFactory
+    url : str or None
+        Page loaded before the memory usage is measured.
+    settle : float
+        Seconds to wait before measuring memory usage.
+
+    Returns
+    -------
+    dict
+        'startup' time in seconds and 'rss' in bytes.
+    """
+    start = time.perf_counter()
+    driver = factory.build()
+    startup = time.perf_counter() - start
+    try:
+        if url is not None:
+            driver.get(url)
+        time.sleep(settle)
+        memory = rss(driver.service.process.pid)
+    finally:
+        driver.quit()
+    return dict(startup=startup, rss=memory)
+
+
+def summarize(samples):
+    """Aggregate the measurements of a profile.
+
+    Parameters
+    ----------
+    samples : list of dict
+
+    Returns
+    -------
+    dict
+    """
+    summary = {}
+    for key in ("startup", "rss"):
+        values = [sample[key] for sample in samples]
+        summary[key] = dict(
+            mean=statistics.mean(values), min=min(values), max=max(values)
+        )
+    return summary
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--profile",
+        action="append",
+        choices=sorted(PROFILES),
+        help="Profile to measure. Can be used multiple times. All profiles"
+        " are measured by default.",
+    )
+    parser.add_argument("--runs", type=int, default=3, help="Launches per profile.")
+    parser.add_argument("--url", help="Page to load before measuring memory.")
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=2.0,
+        help="Seconds to wait before measuring memory.",
+    )
+    parser.add_argument("--firefox", action="store_true", help="Use Firefox.")
+    parser.add_argument("--chrome", action="store_true", help="Use Chrome.")
+    args = parser.parse_args(argv)
+
+    browser = select_browser(args.firefox, args.chrome)
+    factory_class = FirefoxDriverFactory if browser == FIREFOX else ChromeDriverFactory
+
+    results = {}
+    for profile in args.profile or sorted(PROFILES):
+        factory = factory_class(profile=profile)
+        samples = [measure(factory, args.url, args.settle) for _ in range(args.runs)]
+        results[profile] = summarize(samples)
+        print(f"{profile}: {json.dumps(results[profile])}", file=sys.stderr)
+
+    json.dump(dict(browser=browser, runs=args.runs, profiles=results), sys.stdout)
+    print()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,319 @@
+"""Measure the throughput and latency of the browser server protocol.
+
+A server with fake browsers (see `fakes`) is started on a temporary
+socket, or a local TCP port, and driven by a number of concurrent
+`BrowserClient` instances of the web app, each sending one request at a
+time with commands drawn from a weighted mix. The throughput and the
+latency percentiles seen by `BrowserClient.send`, overall and per
+command, are printed as JSON. The web app's dependencies (Django) have
+to be installed, its settings aren't needed.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import secrets
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from fakes import FakeDriverFactory
+from server import BrowserServer
+
+# The web app, whose client is measured
+WEB_APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../commonplayer")
+sys.path.insert(0, WEB_APP)
+from api.client import BrowserClient  # noqa: E402
+
+DEFAULT_MIX = "get_url=70,control=25,go_to=5"
+
+# Arguments of the benchmarked commands, chosen by request number
+VALUES = {
+    "get_url": lambda i: None,
+    "state": lambda i: None,
+    "control": lambda i: ("play", "pause")[i % 2],
+    "go_to": lambda i: f"https://www.youtube.com/watch?v={i % 10}",
+}
+
+
+def parse_mix(mix):
+    """Parse a command mix.
+
+    Parameters
+    ----------
+    mix : str
+        Comma separated ``command=weight`` pairs.
+
+    Returns
+    -------
+    dict
+        Weights by command.
+    """
+    weights = {}
+    for part in mix.split(","):
+        command, _, weight = part.partition("=")
+        command = command.strip()
+        if command not in VALUES:
+            raise ValueError(f"Unsupported command: {command}")
+        weights[command] = float(weight or 1)
+    return weights
+
+
+def percentiles(samples):
+    """Summarize latencies.
+
+    Parameters
+    ----------
+    samples : list of float
+        Latencies in seconds.
+
+    Returns
+    -------
+    dict
+    """
+    if not samples:
+        return dict(count=0)
+    ordered = sorted(samples)
+
+    def rank(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return dict(
+        count=len(ordered),
+        mean=sum(ordered) / len(ordered),
+        min=ordered[0],
+        p50=rank(0.5),
+        p90=rank(0.9),
+        p99=rank(0.99),
+        max=ordered[-1],
+    )
+
+
+def connect(address, session, secret=None):
+    """Open a client connection to the benchmarked server.
+
+    Parameters
+    ----------
+    address : str
+    session : str
+    secret : str or None
+
+    Returns
+    -------
+    BrowserClient
+    """
+    client = BrowserClient(address=address, session=session, secret=secret)
+    return client.__enter__()
+
+
+def run_client(client, weights, requests, seed, results):
+    """Send requests and record their latencies by command."""
+    rng = random.Random(seed)
+    commands, command_weights = list(weights), list(weights.values())
+    latencies = {command: [] for command in commands}
+    errors = superseded = 0
+    for i in range(requests):
+        command = rng.choices(commands, command_weights)[0]
+        start = time.perf_counter()
+        response = client.send(dict(command=command, value=VALUES[command](i)))
+        latencies[command].append(time.perf_counter() - start)
+        errors += not response.get("ok")
+        superseded += bool(response.get("superseded"))
+    results.append(dict(latencies=latencies, errors=errors, superseded=superseded))
+
+
+def benchmark(
+    clients=8,
+    requests=200,
+    sessions=1,
+    mix=DEFAULT_MIX,
+    latency=0.001,
+    load_time=0.05,
+    seed=0,
+    tcp=False,
+):
+    """Run the benchmark.
+
+    Parameters
+    ----------
+    clients : int
+        Number of concurrent clients.
+    requests : int
+        Requests sent by each client.
+    sessions : int
+        Number of browser sessions the clients are spread over.
+    mix : str
+        Command mix, see `parse_mix`.
+    latency : float
+        Seconds every fake WebDriver command takes.
+    load_time : float
+        Additional seconds a fake page load takes.
+    seed : int
+        Seed of the command choice.
+    tcp : bool
+        Connect over TCP, with the shared-secret handshake, instead of
+        the unix socket.
+
+    Returns
+    -------
+    dict
+    """
+    weights = parse_mix(mix)
+    directory = tempfile.mkdtemp()
+    address = os.path.join(directory, "browser.sock")
+    factory = FakeDriverFactory(latency=latency, load_time=load_time)
+    secret = None
+    if tcp:
+        secret = secrets.token_hex()
+        server = BrowserServer(
+            factory,
+            None,
+            max_sessions=sessions,
+            tcp_address=("127.0.0.1", 0),
+            secret=secret,
+        )
+        address = "tcp://{}:{}".format(*server.tcp_address)
+    else:
+        server = BrowserServer(factory, address, max_sessions=sessions)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+
+    connections = []
+    try:
+        for i in range(sessions):
+            setup = connect(address, f"session-{i}", secret)
+            setup.send(dict(command=BrowserServer.START))
+            url = VALUES[BrowserServer.GOTO](0)
+            setup.send(dict(command=BrowserServer.GOTO, value=url))
+            setup.__exit__(None, None, None)
+
+        connections = [
+            connect(address, f"session-{i % sessions}", secret) for i in range(clients)
+        ]
+        results = []
+        workers = [
+            threading.Thread(
+                target=run_client,
+                args=(connection, weights, requests, seed + i, results),
+            )
+            for i, connection in enumerate(connections)
+        ]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        for connection in connections:
+            connection.__exit__(None, None, None)
+        server.stop()
+        thread.join()
+        server.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    by_command = {command: [] for command in weights}
+    for result in results:
+        for command, samples in result["latencies"].items():
+            by_command[command].extend(samples)
+    total = sum(len(samples) for samples in by_command.values())
+    return dict(
+        config=dict(
+            clients=clients,
+            requests=requests,
+            sessions=sessions,
+            mix=weights,
+            latency=latency,
+            load_time=load_time,
+            seed=seed,
+            tcp=tcp,
+        ),
+        environment=dict(
+            python=platform.python_version(),
+            platform=platform.platform(),
+            time=time.time(),
+        ),
+        elapsed=elapsed,
+        requests=total,
+        throughput=total / elapsed,
+        errors=sum(result["errors"] for result in results),
+        superseded=sum(result["superseded"] for result in results),
+        latency=dict(
+            all=percentiles([s for samples in by_command.values() for s in samples]),
+            **{
+                command: percentiles(samples) for command, samples in by_command.items()
+            },
+        ),
+    )
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--clients", type=int, default=8, help="Number of concurrent clients."
+    )
+    parser.add_argument(
+        "--requests", type=int, default=200, help="Requests sent by each client."
+    )
+    parser.add_argument(
+        "--sessions",
+        type=int,
+        default=1,
+        help="Number of browser sessions the clients are spread over.",
+    )
+    parser.add_argument(
+        "--mix",
+        default=DEFAULT_MIX,
+        help="Comma separated command=weight pairs. Supported commands:"
+        f" {', '.join(VALUES)}.",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.001,
+        help="Seconds every fake WebDriver command takes.",
+    )
+    parser.add_argument(
+        "--load-time",
+        type=float,
+        default=0.05,
+        help="Additional seconds a fake page load takes.",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    parser.add_argument(
+        "--tcp",
+        action="store_true",
+        help="Connect over TCP instead of the unix socket.",
+    )
+    parser.add_argument("--output", help="File the JSON results are written to.")
+    args = parser.parse_args(argv)
+
+    results = benchmark(
+        clients=args.clients,
+        requests=args.requests,
+        sessions=args.sessions,
+        mix=args.mix,
+        latency=args.latency,
+        load_time=args.load_time,
+        seed=args.seed,
+        tcp=args.tcp,
+    )
+    print(
+        f"{results['throughput']:.1f} requests/s,"
+        f" p50 {results['latency']['all']['p50'] * 1000:.2f} ms,"
+        f" p99 {results['latency']['all']['p99'] * 1000:.2f} ms",
+        file=sys.stderr,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout)
+        print()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
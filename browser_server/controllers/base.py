@@ -1,14 +1,286 @@
-from abc import abstractmethod, ABC
+from abc import ABC
+
+from selenium.common.exceptions import (
+    NoSuchElementException,
+    StaleElementReferenceException,
+    TimeoutException,
+)
+from selenium.webdriver.support.ui import WebDriverWait
+
+# Defines mediaState, describing a media element, for the scripts below
+MEDIA_STATE = """
+const mediaState = (media) => ({
+    paused: media.paused,
+    ended: media.ended,
+    current_time: media.currentTime,
+    duration: isNaN(media.duration) ? null : media.duration,
+    volume: media.volume,
+    muted: media.muted,
+    rate: media.playbackRate,
+});
+"""
+
+# Performs arguments[0] (an action name) with the argument arguments[1] on
+# the page's first media element and returns the element's state, or null
+# if there is no media element.
+MEDIA_SCRIPT = (
+    MEDIA_STATE
+    + """
+const media = document.querySelector("video, audio");
+if (!media) return null;
+const [action, value] = arguments;
+// Blocked autoplay shows up as paused in the returned state
+const play = () => media.play().catch(() => {});
+switch (action) {
+    case "play": play(); break;
+    case "pause": media.pause(); break;
+    case "play_pause": media.paused ? play() : media.pause(); break;
+    case "seek": media.currentTime = value; break;
+    case "volume": media.volume = Math.min(Math.max(value, 0), 1); break;
+    case "rate": media.playbackRate = value; break;
+    case "mute": media.muted = value === null ? !media.muted : !!value; break;
+}
+return mediaState(media);
+"""
+)
+
+# Collects the state of the page and its player. arguments[0] maps the
+# names of player settings to [selector, attribute] pairs (see
+# `BaseController.toggles`).
+STATE_SCRIPT = (
+    MEDIA_STATE
+    + """
+const media = document.querySelector("video, audio");
+const toggles = {};
+for (const [name, [selector, attribute]] of Object.entries(arguments[0])) {
+    const element = document.querySelector(selector);
+    toggles[name] = element ? element.getAttribute(attribute) === "true" : null;
+}
+return {
+    url: location.href,
+    title: document.title,
+    media: media ? mediaState(media) : null,
+    toggles: toggles,
+};
+"""
+)
+
+# Whether the page's media element has enough data to start playing
+# (readyState HAVE_FUTURE_DATA, when canplay fires)
+MEDIA_READY_SCRIPT = """
+const media = document.querySelector("video, audio");
+return media !== null && media.readyState >= 3;
+"""
+
+# Looks up every selector of arguments[0] at once. Returns the found
+# elements and the names of the missing ones.
+ELEMENTS_SCRIPT = """
+const found = {};
+const missing = [];
+for (const [name, selector] of Object.entries(arguments[0])) {
+    const element = document.querySelector(selector);
+    if (element) {
+        found[name] = element;
+    } else {
+        missing.push(name);
+    }
+}
+return {found: found, missing: missing};
+"""
 
 
 class BaseController(ABC):
-    def __init__(self, driver):
+    """Media controller base class.
+
+    The page's media element is driven directly with one script per
+    action, independently of the site's player UI. Subclasses add site
+    specific actions to `actions`.
+
+    Elements named in `selectors` are looked up when first needed and
+    cached. A cached element that went stale is looked up again when
+    it's used, and the cache is cleared by `on_navigate`.
+
+    Parameters
+    ----------
+    driver : WebDriver
+    state : dict or None
+        State shared by the controllers of one browser, kept while the
+        browser runs. Lets controllers remember one time setup, e.g.
+        accepted cookie popups, across rebuilds.
+    """
+
+    PLAY = "play"
+    PAUSE = "pause"
+    PLAY_PAUSE = "play_pause"
+    SEEK = "seek"
+    VOLUME = "volume"
+    RATE = "rate"
+    MUTE = "mute"
+
+    # Element names mapped to CSS selectors
+    selectors = {}
+    # Names of on/off player settings mapped to the selector of an
+    # element and its attribute that is "true" when the setting is on
+    toggles = {}
+
+    def __init__(self, driver, state=None):
         self.driver = driver
+        self.state = {} if state is None else state
+        self._elements = {}
+
+        # Action names mapped to methods. Methods of actions that take a
+        # value accept it as their only argument.
+        self.actions = {
+            self.PLAY: self.play,
+            self.PAUSE: self.pause,
+            self.PLAY_PAUSE: self.toggle_play_pause,
+            self.SEEK: self.seek,
+            self.VOLUME: self.set_volume,
+            self.RATE: self.set_rate,
+            self.MUTE: self.mute,
+        }
+
+    def media(self, action, value=None):
+        """Perform an action on the page's media element.
+
+        Parameters
+        ----------
+        action : str
+            One of the actions handled by `MEDIA_SCRIPT`.
+        value
+            The action's argument.
+
+        Returns
+        -------
+        dict or None
+            The state of the media element after the action, None if the
+            page has no media element.
+        """
+        return self.driver.execute_script(MEDIA_SCRIPT, action, value)
 
-    @abstractmethod
     def play(self):
-        pass
+        return self.media(self.PLAY)
 
-    @abstractmethod
     def pause(self):
-        pass
+        return self.media(self.PAUSE)
+
+    def toggle_play_pause(self):
+        return self.media(self.PLAY_PAUSE)
+
+    def seek(self, position):
+        """Jump to a position given in seconds."""
+        return self.media(self.SEEK, float(position))
+
+    def set_volume(self, volume):
+        """Set the volume, between 0 and 1."""
+        return self.media(self.VOLUME, float(volume))
+
+    def set_rate(self, rate):
+        """Set the playback rate, 1 being normal speed."""
+        return self.media(self.RATE, float(rate))
+
+    def mute(self, muted=None):
+        """Mute or unmute the media, toggle if `muted` is None."""
+        return self.media(self.MUTE, muted)
+
+    # noinspection PyMethodMayBeStatic
+    def has_media(self, url):
+        """Whether the page at a url is expected to have a media element.
+        `wait_for_media` is pointless on other pages.
+
+        Parameters
+        ----------
+        url : str
+
+        Returns
+        -------
+        bool
+        """
+        return True
+
+    def wait_for_media(self, timeout):
+        """Wait until the page's media element can start playing.
+
+        Parameters
+        ----------
+        timeout : float
+            Seconds to wait at most.
+
+        Returns
+        -------
+        bool
+            Whether the media became ready in time.
+        """
+        try:
+            WebDriverWait(self.driver, timeout, poll_frequency=0.05).until(
+                lambda driver: driver.execute_script(MEDIA_READY_SCRIPT)
+            )
+        except TimeoutException:
+            return False
+        return True
+
+    def on_navigate(self, url):
+        """Called when the browser went to another page handled by the
+        same kind of controller. Forgets the cached elements.
+
+        Parameters
+        ----------
+        url : str
+        """
+        self._elements.clear()
+
+    def element(self, name):
+        """A page element by its name in `selectors`.
+
+        Parameters
+        ----------
+        name : str
+
+        Returns
+        -------
+        WebElement
+
+        Raises
+        ------
+        NoSuchElementException
+            If the page has no such element.
+        """
+        element = self._elements.get(name)
+        if element is None:
+            self.fetch_elements()
+            element = self._elements.get(name)
+            if element is None:
+                raise NoSuchElementException(f"Element not found: {name}")
+        return element
+
+    def fetch_elements(self):
+        """Look up all uncached elements in one round trip.
+
+        Returns
+        -------
+        list of str
+            Names of the elements missing from the page.
+        """
+        selectors = {
+            name: selector
+            for name, selector in self.selectors.items()
+            if name not in self._elements
+        }
+        if not selectors:
+            return []
+        result = self.driver.execute_script(ELEMENTS_SCRIPT, selectors)
+        self._elements.update(result["found"])
+        return result["missing"]
+
+    def click(self, name):
+        """Click an element, looking it up again if it went stale.
+
+        Parameters
+        ----------
+        name : str
+        """
+        try:
+            self.element(name).click()
+        except StaleElementReferenceException:
+            del self._elements[name]
+            self.element(name).click()
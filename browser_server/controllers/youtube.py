@@ -1,103 +1,142 @@
 from urllib.parse import urlparse
 
-from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
-from selenium.common.exceptions import TimeoutException
+from selenium.common.exceptions import TimeoutException, WebDriverException
 
 from .base import BaseController
 
+# Clicks the accept button of the cookie popup if it is shown, otherwise
+# watches the page and clicks it as soon as it appears. Returns whether
+# the popup was accepted right away.
+CONSENT_SCRIPT = """
+const accept = () => {
+    const popup = document.querySelector("ytd-consent-bump-v2-lightbox");
+    if (!popup) return false;
+    // FIXME: This is localised. Only works if browser is in english
+    const button = Array.from(popup.querySelectorAll("button")).find(
+        (b) => /^accept/i.test(b.getAttribute("aria-label") || b.textContent.trim())
+    );
+    if (!button) return false;
+    button.click();
+    return true;
+};
+if (accept()) return true;
+if (!window.__commonplayerConsent) {
+    window.__commonplayerConsent = new MutationObserver(() => {
+        if (accept()) {
+            window.__commonplayerConsent.disconnect();
+        }
+    });
+    window.__commonplayerConsent.observe(
+        document.documentElement, {childList: true, subtree: true}
+    );
+}
+return false;
+"""
+
+# Answers the consent prompt (with only the necessary cookies) before it
+# is shown on later page loads
+CONSENT_COOKIE = {"name": "SOCS", "value": "CAI", "domain": ".youtube.com"}
+
+
+# CSS selectors of the player components, by element name
+COMPONENTS = {
+    "play_button": ".ytp-play-button",
+    "next_button": ".ytp-next-button",
+    "captions_button": ".ytp-subtitles-button",
+    "autoplay_button": ".ytp-autonav-toggle-button",
+    "fullscreen_button": ".ytp-fullscreen-button",
+    "title": "#info h1.title",
+}
+
 
 # TODO: Docstrings
 class YoutubeController(BaseController):
 
-    PLAY_PAUSE = "play_pause"
+    selectors = COMPONENTS
+    toggles = {
+        "subtitles": (".ytp-subtitles-button", "aria-pressed"),
+        "autoplay": (".ytp-autonav-toggle-button", "aria-checked"),
+    }
+
     AUTOPLAY = "autoplay"
     FULLSCREEN = "fullscreen"
     SUBTITLES = "subtitles"
     HANDLE_COOKIE_POPUP = "cookie"
 
-    def __init__(self, driver):
-        super().__init__(driver)
-
-        # Element definition
-        self.play_button = None
-        self.next_button = None
-        self.autoplay_button = None
-        self.captions_button = None
-        self.fullscreen_button = None
-
-        self.actions = {
-            self.PLAY_PAUSE: self.toggle_play_pause,
-            self.AUTOPLAY: self.toggle_autoplay,
-            self.FULLSCREEN: self.toggle_fullscreen,
-            self.SUBTITLES: self.toggle_subtitles,
-            self.HANDLE_COOKIE_POPUP: self._handle_cookie_popup,
-        }
+    # Key of the controller state marking the consent as handled
+    CONSENT_HANDLED = "youtube_consent"
 
-        # Handle cookie popup
-        # Maybe should somehow keep info on whether popup was handled
-        try:
-            WebDriverWait(driver, timeout=10).until(self._handle_cookie_popup)
-        except TimeoutException:
-            pass
+    def __init__(self, driver, state=None):
+        super().__init__(driver, state)
 
-        if self._is_video():
-            WebDriverWait(driver, timeout=5).until(self._fetch_components)
+        self.missing_components = []
 
-    def play(self):
-        if self.play_button.get_attribute("title") == "Play (k)":
-            self.play_button.click()
+        self.actions.update(
+            {
+                self.AUTOPLAY: self.toggle_autoplay,
+                self.FULLSCREEN: self.toggle_fullscreen,
+                self.SUBTITLES: self.toggle_subtitles,
+                self.HANDLE_COOKIE_POPUP: self._handle_cookie_popup,
+            }
+        )
 
-    def pause(self):
-        if self.play_button.get_attribute("title") == "Pause (k)":
-            self.play_button.click()
+        # The popup is dealt with once per browser, without waiting for it
+        if not self.state.get(self.CONSENT_HANDLED):
+            self._seed_consent_cookie()
+            self._handle_cookie_popup()
+            self.state[self.CONSENT_HANDLED] = True
 
-    def toggle_play_pause(self):
-        self.play_button.click()
+        if self._is_video():
+            try:
+                WebDriverWait(driver, timeout=5, poll_frequency=0.1).until(
+                    self._fetch_components
+                )
+            except TimeoutException:
+                missing = ", ".join(self.missing_components)
+                raise TimeoutException(f"Player components not found: {missing}")
 
     def toggle_autoplay(self):
-        self.autoplay_button.click()
+        self.click("autoplay_button")
 
     def toggle_fullscreen(self):
-        self.fullscreen_button.click()
+        self.click("fullscreen_button")
 
     def toggle_subtitles(self):
-        self.captions_button.click()
+        self.click("captions_button")
 
     # _=None because wait.until passes the driver as an argument
     def _fetch_components(self, _=None):
+        """Look up the uncached player components in one round trip.
 
-        # Play
-        self.play_button = self.driver.find_element(By.CLASS_NAME, "ytp-play-button")
-        # Next
-        self.next_button = self.driver.find_element(By.CLASS_NAME, "ytp-next-button")
-        # Subtitles
-        self.captions_button = self.driver.find_element(
-            By.CLASS_NAME, "ytp-subtitles-button"
-        )
-        # Autoplay
-        self.autoplay_button = self.driver.find_element(
-            By.CLASS_NAME, "ytp-autonav-toggle-button"
-        )
+        Returns
+        -------
+        bool
+            Whether all components were found.
+        """
+        self.missing_components = self.fetch_elements()
+        return not self.missing_components
 
-        # Fullscreen
-        self.fullscreen_button = self.driver.find_element(
-            By.CLASS_NAME, "ytp-fullscreen-button"
-        )
+    def _handle_cookie_popup(self):
+        return bool(self.driver.execute_script(CONSENT_SCRIPT))
 
-        # Title
-        self.title = self.driver.find_element(By.CSS_SELECTOR, "#info h1.title")
-        return True
+    def _seed_consent_cookie(self):
+        try:
+            self.driver.add_cookie(CONSENT_COOKIE)
+        except WebDriverException:
+            # Not on a youtube.com page, the popup script still applies
+            pass
 
-    def _handle_cookie_popup(self, _=None):
-        popup = self.driver.find_element(By.TAG_NAME, "ytd-consent-bump-v2-lightbox")
-        # FIXME: This is localised. Only works if browser is in english
-        popup.find_element(By.LINK_TEXT, "A").click()
-        return True
+    def has_media(self, url):
+        """Whether the url is a video page, rather than e.g. the home
+        page, search results or a channel.
+        """
+        parsed = urlparse(url)
+        return parsed.netloc == "youtu.be" or parsed.path == "/watch"
 
     def _is_video(self):
-        return urlparse(self.driver.current_url).path == "/watch"
+        return self.has_media(self.driver.current_url)
 
     def _subtitles_available(self):
-        title = self.captions_button.get_attribute("title")
+        title = self.element("captions_button").get_attribute("title")
         return title == "Subtitles/closed captions unavailable"
@@ -1,16 +1,178 @@
 """Implementations of a common interface for browser setup in the form
 of driver factories.
+
+Factories can build browsers with a named profile (see `PROFILES`)
+trading features for lower memory and CPU usage. Given a profile
+directory, they prepare browser profiles with the extensions installed
+once and reuse them, with their cache and cookies, across launches.
+With a page load strategy other than `NORMAL`, navigation returns
+before the page's subresources are loaded.
+
+A running browser can be described (see `BaseDriverFactory.describe`)
+and attached to again by another process, so that restarting the
+server doesn't restart its browsers.
 """
 from abc import abstractmethod, ABC
+import copy
+import logging
+import os
+import signal
+import zipfile
 
 from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
 from selenium.webdriver.firefox.service import Service as FirefoxService
+from selenium.webdriver.firefox.options import Options as FirefoxOptions
 from selenium.webdriver.chrome.service import Service as ChromeService
 from selenium.webdriver.chrome.options import Options as ChromeOptions
 
+from profile_store import ProfileStore
+
+# Resource saving settings
+HEADLESS = "headless"  # No browser window
+NO_IMAGES = "no_images"  # Don't load images (media elements still play)
+FEW_PROCESSES = "few_processes"  # Limit the number of content processes
+QUIET = "quiet"  # No telemetry, background updates or speculative requests
+
+DEFAULT_PROFILE = "default"
+
+# Page load strategies: wait for the load event, for DOMContentLoaded, or
+# return right after the navigation started
+NORMAL = "normal"
+EAGER = "eager"
+NONE = "none"
+PAGE_LOAD_STRATEGIES = (NORMAL, EAGER, NONE)
+
+PROFILES = {
+    DEFAULT_PROFILE: (),
+    "headless": (HEADLESS,),
+    "light": (NO_IMAGES, FEW_PROCESSES, QUIET),
+    "headless-light": (HEADLESS, NO_IMAGES, FEW_PROCESSES, QUIET),
+}
+
+FIREFOX_PREFERENCES = {
+    NO_IMAGES: {"permissions.default.image": 2},
+    FEW_PROCESSES: {
+        "dom.ipc.processCount": 1,
+        "dom.ipc.processCount.webIsolated": 1,
+        "fission.autostart": False,
+        "browser.tabs.remote.separatePrivilegedContentProcess": False,
+    },
+    QUIET: {
+        "app.normandy.enabled": False,
+        "app.update.auto": False,
+        "browser.newtabpage.activity-stream.feeds.telemetry": False,
+        "browser.ping-centre.telemetry": False,
+        "browser.safebrowsing.downloads.remote.enabled": False,
+        "browser.safebrowsing.malware.enabled": False,
+        "browser.safebrowsing.phishing.enabled": False,
+        "datareporting.healthreport.uploadEnabled": False,
+        "datareporting.policy.dataSubmissionEnabled": False,
+        "extensions.update.enabled": False,
+        "network.dns.disablePrefetch": True,
+        "network.http.speculative-parallel-limit": 0,
+        "network.prefetch-next": False,
+        "toolkit.telemetry.enabled": False,
+        "toolkit.telemetry.unified": False,
+    },
+}
+
+CHROME_ARGUMENTS = {
+    HEADLESS: ["--headless"],
+    NO_IMAGES: ["--blink-settings=imagesEnabled=false"],
+    FEW_PROCESSES: ["--renderer-process-limit=1", "--process-per-site"],
+    QUIET: [
+        "--disable-background-networking",
+        "--disable-breakpad",
+        "--disable-client-side-phishing-detection",
+        "--disable-component-update",
+        "--disable-default-apps",
+        "--disable-domain-reliability",
+        "--disable-sync",
+        "--metrics-recording-only",
+        "--no-first-run",
+    ],
+}
+
+
+class AttachedDriver(webdriver.Remote):
+    """A webdriver controlling a browser session started by another
+    process.
+
+    Parameters
+    ----------
+    executor : str
+        Url of the driver service running the session.
+    session_id : str
+    options : ArgOptions
+        Options of the browser, selecting the protocol dialect.
+    capabilities : dict or None
+        The capabilities the session was created with.
+    service_pid : int or None
+        Id of the driver service process. It is terminated when the
+        driver quits, as it isn't a child of this process.
+    """
+
+    def __init__(
+        self, executor, session_id, options, capabilities=None, service_pid=None
+    ):
+        self._attach_to = session_id
+        self._attached_caps = capabilities or {}
+        self.service_pid = service_pid
+        super().__init__(command_executor=executor, options=options)
+
+    def start_session(self, capabilities, browser_profile=None):
+        """Take over the existing session instead of creating one."""
+        self.session_id = self._attach_to
+        self.caps = self._attached_caps
+
+    def quit(self):
+        """Quit the browser and stop its driver service."""
+        try:
+            super().quit()
+        finally:
+            if self.service_pid is not None:
+                try:
+                    os.kill(self.service_pid, signal.SIGTERM)
+                except OSError:
+                    pass
+
 
 class BaseDriverFactory(ABC):
-    """Driver factory base class."""
+    """Driver factory base class.
+
+    Parameters
+    ----------
+    profile : str
+        Name of the profile (a key of `PROFILES`) the browsers are built
+        with.
+    profile_dir : str or None
+        Directory in which prepared browser profiles are kept and reused.
+        Browsers start with a fresh temporary profile if None.
+    page_load_strategy : str
+        One of `PAGE_LOAD_STRATEGIES`.
+    """
+
+    def __init__(
+        self, profile=DEFAULT_PROFILE, profile_dir=None, page_load_strategy=NORMAL
+    ):
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown profile: {profile}")
+        if page_load_strategy not in PAGE_LOAD_STRATEGIES:
+            raise ValueError(f"Unknown page load strategy: {page_load_strategy}")
+        self.profile = profile
+        self.page_load_strategy = page_load_strategy
+        self.profile_store = ProfileStore(profile_dir) if profile_dir else None
+
+    @property
+    def settings(self):
+        """The resource saving settings of the factory's profile.
+
+        Returns
+        -------
+        tuple of str
+        """
+        return PROFILES[self.profile]
 
     @abstractmethod
     def add_extensions(self, *paths):
@@ -33,12 +195,103 @@ class BaseDriverFactory(ABC):
         """
         pass
 
+    # noinspection PyMethodMayBeStatic
+    def describe(self, driver):
+        """What another process needs to attach to a running browser.
+
+        Parameters
+        ----------
+        driver : WebDriver
+
+        Returns
+        -------
+        dict or None
+            JSON serializable description, None if the driver can't be
+            attached to.
+        """
+        url = getattr(getattr(driver, "command_executor", None), "_url", None)
+        if url is None or driver.session_id is None:
+            return None
+        pid = getattr(driver, "service_pid", None)
+        process = getattr(getattr(driver, "service", None), "process", None)
+        if process is not None:
+            pid = process.pid
+        return dict(
+            executor=url,
+            session_id=driver.session_id,
+            capabilities=driver.caps,
+            service_pid=pid,
+            profile=getattr(driver, "profile_path", None),
+        )
+
+    def attach(self, description):
+        """Take control of a running browser.
+
+        Parameters
+        ----------
+        description : dict
+            As returned by `describe`, possibly in another process.
+
+        Returns
+        -------
+        WebDriver
+
+        Raises
+        ------
+        WebDriverException
+            If the browser's session is gone.
+
+        Notes
+        -----
+        Uses the ``options`` of the concrete factory.
+        """
+        driver = AttachedDriver(
+            description["executor"],
+            description["session_id"],
+            self.options,
+            description.get("capabilities"),
+            description.get("service_pid"),
+        )
+        # A cheap command failing if the session doesn't exist anymore
+        driver.current_window_handle
+        profile = description.get("profile")
+        if profile is not None and self.profile_store is not None:
+            self.profile_store.claim(profile)
+            self.profile_store.bind(driver, profile)
+        return driver
+
+    # noinspection PyMethodMayBeStatic
+    def detach(self, driver):
+        """Let a browser outlive this process.
+
+        The driver service is normally stopped, and the browser with it,
+        when its process object is garbage collected or the process
+        exits.
+
+        Parameters
+        ----------
+        driver : WebDriver or None
+        """
+        service = getattr(driver, "service", None)
+        if getattr(service, "process", None) is not None:
+            logging.debug(f"Detaching from driver service {service.process.pid}")
+            service.process = None
+
 
 class FirefoxDriverFactory(BaseDriverFactory):
     """Driver factory for Firefox drivers."""
 
-    def __init__(self):
+    def __init__(
+        self, profile=DEFAULT_PROFILE, profile_dir=None, page_load_strategy=NORMAL
+    ):
+        super().__init__(profile, profile_dir, page_load_strategy)
         self.addons = []
+        self.options = FirefoxOptions()
+        self.options.page_load_strategy = page_load_strategy
+        self.options.headless = HEADLESS in self.settings
+        for setting in self.settings:
+            for name, value in FIREFOX_PREFERENCES.get(setting, {}).items():
+                self.options.set_preference(name, value)
 
     def build(self):
         """Create a Firefox webdriver.
@@ -48,11 +301,47 @@ class FirefoxDriverFactory(BaseDriverFactory):
         webdriver.Firefox
         """
         service = FirefoxService()
-        driver = webdriver.Firefox(service=service)
-        for addon in self.addons:
-            driver.install_addon(addon, True)
+        if self.profile_store is None:
+            driver = webdriver.Firefox(service=service, options=self.options)
+            for addon in self.addons:
+                driver.install_addon(addon, True)
+            return driver
+
+        path, manifest = self.profile_store.acquire(self.addons)
+        options = copy.deepcopy(self.options)
+        options.add_argument("-profile")
+        options.add_argument(path)
+        try:
+            driver = webdriver.Firefox(service=service, options=options)
+        except Exception:
+            self.profile_store.release(path)
+            raise
+        self.profile_store.bind(driver, path)
+
+        try:
+            if manifest is None:
+                self._prepare_profile(driver, path)
+            else:
+                for addon in manifest.get("temporary", []):
+                    driver.install_addon(addon, True)
+        except Exception:
+            driver.quit()
+            raise
         return driver
 
+    def _prepare_profile(self, driver, path):
+        """Install the addons into a new profile."""
+        temporary = []
+        for addon in self.addons:
+            try:
+                driver.install_addon(addon, False)
+            except WebDriverException:
+                # Unsigned addons can only be installed temporarily and
+                # have to be reinstalled on every launch
+                driver.install_addon(addon, True)
+                temporary.append(addon)
+        self.profile_store.mark_prepared(path, self.addons, temporary=temporary)
+
     def add_extensions(self, *paths):
         """Install a Firefox extension.
 
@@ -67,8 +356,16 @@ class FirefoxDriverFactory(BaseDriverFactory):
 class ChromeDriverFactory(BaseDriverFactory):
     """Driver factory for Chrome drivers."""
 
-    def __init__(self):
+    def __init__(
+        self, profile=DEFAULT_PROFILE, profile_dir=None, page_load_strategy=NORMAL
+    ):
+        super().__init__(profile, profile_dir, page_load_strategy)
+        self.extensions = []
         self.options = ChromeOptions()
+        self.options.page_load_strategy = page_load_strategy
+        for setting in self.settings:
+            for argument in CHROME_ARGUMENTS.get(setting, []):
+                self.options.add_argument(argument)
 
     def build(self):
         """Create a Chrome webdriver.
@@ -78,7 +375,44 @@ class ChromeDriverFactory(BaseDriverFactory):
         webdriver.Chrome
         """
         service = ChromeService()
-        return webdriver.Chrome(service=service, options=self.options)
+        options = copy.deepcopy(self.options)
+        if self.profile_store is None:
+            for extension in self.extensions:
+                options.add_extension(extension)
+            return webdriver.Chrome(service=service, options=options)
+
+        path, manifest = self.profile_store.acquire(self.extensions)
+        try:
+            if manifest is None:
+                unpacked = self._unpack_extensions(path)
+                self.profile_store.mark_prepared(
+                    path, self.extensions, unpacked=unpacked
+                )
+            else:
+                unpacked = manifest.get("unpacked", [])
+
+            options.add_argument(f"--user-data-dir={path}")
+            if unpacked:
+                options.add_argument(f"--load-extension={','.join(unpacked)}")
+            driver = webdriver.Chrome(service=service, options=options)
+        except Exception:
+            self.profile_store.release(path)
+            raise
+        self.profile_store.bind(driver, path)
+        return driver
+
+    def _unpack_extensions(self, path):
+        """Extract the extensions into a profile directory, so they can be
+        loaded without being encoded into the options on every launch.
+        """
+        unpacked = []
+        for i, extension in enumerate(self.extensions):
+            target = os.path.join(path, "unpacked-extensions", str(i))
+            # A .crx file is a zip archive behind a header zipfile skips
+            with zipfile.ZipFile(extension) as archive:
+                archive.extractall(target)
+            unpacked.append(target)
+        return unpacked
 
     def add_extensions(self, *paths):
         """Install a Chrome extension.
@@ -88,5 +422,4 @@ class ChromeDriverFactory(BaseDriverFactory):
         paths : str
             Extension .crx file paths.
         """
-        for path in paths:
-            self.options.add_extension(path)
+        self.extensions.extend(paths)
@@ -0,0 +1,102 @@
+"""Player events collected from the page and pushed to subscribers.
+
+Listeners injected into the page record media events in a buffer on
+the page's window. The buffer is drained with a single script
+execution per poll, shared by all subscribers, and the events are
+pushed to the subscribed connections.
+"""
+import itertools
+
+URL = "url"
+PLAY = "play"
+PAUSE = "pause"
+ENDED = "ended"
+TIME_UPDATE = "timeupdate"
+
+EVENT_TYPES = (URL, PLAY, PAUSE, ENDED, TIME_UPDATE)
+
+# Installs the listeners if they are missing (e.g. after a page load),
+# then returns and clears the buffered events. arguments[0] is the
+# minimal interval between time updates in seconds.
+POLL_SCRIPT = """
+const interval = arguments[0] * 1000;
+let state = window.__commonplayer;
+if (!state) {
+    state = window.__commonplayer = {events: [], lastUpdate: 0, interval: interval};
+    const push = (type, video) => {
+        if (state.events.length >= 1000) state.events.shift();
+        state.events.push({
+            type: type,
+            time: video.currentTime,
+            duration: video.duration,
+            at: Date.now(),
+        });
+    };
+    // Media events don't bubble, but can be captured on the document
+    for (const type of ["play", "pause", "ended"]) {
+        document.addEventListener(type, (e) => push(type, e.target), true);
+    }
+    document.addEventListener("timeupdate", (e) => {
+        const now = Date.now();
+        if (now - state.lastUpdate >= state.interval) {
+            state.lastUpdate = now;
+            push("timeupdate", e.target);
+        }
+    }, true);
+}
+state.interval = interval;
+return {url: window.location.href, events: state.events.splice(0)};
+"""
+
+
+class Subscription:
+    """A connection's subscription to player events.
+
+    Parameters
+    ----------
+    conn : Connection
+        The subscribed connection.
+    message : dict
+        The subscribe request. Events are sent with its id.
+    session : str
+        Name of the session whose player is observed.
+    interval : float
+        Minimal number of seconds between two time updates.
+    types : list of str or None
+        Event types to be sent. All types are sent if None.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, conn, message, session, interval=1.0, types=None):
+        self.id = next(self._ids)
+        self.conn = conn
+        self.message = message
+        self.session = session
+        self.interval = interval
+        self.types = set(types or EVENT_TYPES)
+        self._last_update = None
+
+    def wants(self, event):
+        """Whether an event should be sent to the subscriber.
+
+        Time updates are throttled to the subscription's interval.
+
+        Parameters
+        ----------
+        event : dict
+
+        Returns
+        -------
+        bool
+        """
+        if event.get("type") not in self.types:
+            return False
+        if event["type"] == TIME_UPDATE:
+            at = event.get("at", 0) / 1000
+            if self._last_update is not None and at - self._last_update < (
+                self.interval
+            ):
+                return False
+            self._last_update = at
+        return True
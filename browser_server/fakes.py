@@ -0,0 +1,487 @@
+"""In-memory stand-ins for browsers.
+
+`FakeDriverFactory` plugs into `BrowserServer` in place of a real
+driver factory. Its drivers keep pages, tabs and media elements in
+memory and understand the scripts the server and the controllers
+execute, so the server can be exercised and measured without a
+browser. Every remote command goes through `FakeDriver.execute`, which
+waits for the configured latency, like a WebDriver HTTP round trip, and
+runs one command at a time, like geckodriver and chromedriver do for a
+session.
+"""
+import itertools
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+
+from selenium.common.exceptions import (
+    NoSuchElementException,
+    NoSuchWindowException,
+    StaleElementReferenceException,
+    WebDriverException,
+)
+
+from controllers.base import (
+    ELEMENTS_SCRIPT,
+    MEDIA_READY_SCRIPT,
+    MEDIA_SCRIPT,
+    STATE_SCRIPT,
+)
+from controllers.youtube import COMPONENTS, CONSENT_SCRIPT
+from driver_factories import BaseDriverFactory, DEFAULT_PROFILE
+import events
+import tabs
+
+
+class FakeMedia:
+    """State of a page's media element.
+
+    Parameters
+    ----------
+    duration : float
+    """
+
+    def __init__(self, duration):
+        self.paused = True
+        self.ended = False
+        self.current_time = 0.0
+        self.duration = duration
+        self.volume = 1.0
+        self.muted = False
+        self.rate = 1.0
+        # Blocks playback, see `tabs.SUPPRESS_SCRIPT`
+        self.suppressed = False
+
+    def play(self):
+        if not self.suppressed:
+            self.paused = False
+            self.ended = False
+
+    def state(self):
+        """The state in the form returned by the media scripts."""
+        return dict(
+            paused=self.paused,
+            ended=self.ended,
+            current_time=self.current_time,
+            duration=self.duration,
+            volume=self.volume,
+            muted=self.muted,
+            rate=self.rate,
+        )
+
+
+class FakePage:
+    """A page loaded in a tab.
+
+    Parameters
+    ----------
+    url : str
+    media : FakeMedia or None
+    """
+
+    def __init__(self, url, media=None):
+        self.url = url
+        self.title = urlparse(url).netloc or url
+        self.media = media
+        # Events waiting to be collected by `events.POLL_SCRIPT`
+        self.events = []
+
+
+class FakeElement:
+    """A page element that can be clicked.
+
+    Once `stale`, e.g. after `FakeDriver.invalidate`, using the element
+    raises `StaleElementReferenceException` as for an element removed
+    from the page.
+
+    Parameters
+    ----------
+    driver : FakeDriver
+    selector : str
+    """
+
+    def __init__(self, driver, selector):
+        self.driver = driver
+        self.selector = selector
+        self.clicks = 0
+        self.stale = False
+
+    def click(self):
+        self.driver.execute("clickElement", dict(element=self))
+
+    def get_attribute(self, name):
+        return self.driver.execute("getElementAttribute", dict(element=self, name=name))
+
+
+class FakeSwitchTo:
+    """Window switching of a `FakeDriver`."""
+
+    def __init__(self, driver):
+        self._driver = driver
+
+    def window(self, handle):
+        self._driver.execute("switchToWindow", dict(handle=handle))
+
+    def new_window(self, type_hint=None):
+        self._driver.execute("newWindow", dict(type_hint=type_hint))
+
+
+class FakeDriver:
+    """A browser simulated in memory.
+
+    Parameters
+    ----------
+    latency : float
+        Seconds every remote command takes.
+    load_time : float
+        Additional seconds loading a page takes.
+    media_duration : float or None
+        Duration of the media element every page has. Pages have no
+        media if None.
+    elements : iterable of str
+        CSS selectors of the elements present on every page.
+    """
+
+    def __init__(self, latency=0.0, load_time=0.0, media_duration=60.0, elements=()):
+        self.latency = latency
+        self.load_time = load_time
+        self.media_duration = media_duration
+        self.elements = set(elements)
+        self.switch_to = FakeSwitchTo(self)
+        self.service = None
+        self.session_id = uuid.uuid4().hex
+        self.cookies = []
+        self.quit_called = False
+        # Number of executions of each remote command
+        self.calls = {}
+        # Elements handed out by lookups, in order
+        self.found_elements = []
+        self._lock = threading.Lock()
+
+        self._handles = (f"window-{i}" for i in itertools.count())
+        first = next(self._handles)
+        self.windows = {first: FakePage("about:blank")}
+        self.current_window_handle = first
+
+        self._commands = {
+            "get": self._get,
+            "getCurrentUrl": lambda: self.page.url,
+            "getTitle": lambda: self.page.title,
+            "executeScript": self._execute_script,
+            "findElement": self._find_element,
+            "clickElement": self._click,
+            "getElementAttribute": self._get_element_attribute,
+            "addCookie": lambda cookie: self.cookies.append(cookie),
+            "switchToWindow": self._switch_to_window,
+            "newWindow": self._new_window,
+            "closeWindow": self._close_window,
+            "installAddon": lambda path: None,
+            "quit": self._quit,
+        }
+        self._scripts = {
+            MEDIA_SCRIPT: self._media_script,
+            STATE_SCRIPT: self._state_script,
+            MEDIA_READY_SCRIPT: lambda: self.page.media is not None,
+            ELEMENTS_SCRIPT: self._elements_script,
+            CONSENT_SCRIPT: lambda: False,
+            events.POLL_SCRIPT: self._poll_script,
+            tabs.SUPPRESS_SCRIPT: self._suppress_script,
+            tabs.RESUME_SCRIPT: self._resume_script,
+        }
+
+    @property
+    def page(self):
+        """The page of the current tab."""
+        try:
+            return self.windows[self.current_window_handle]
+        except KeyError:
+            raise NoSuchWindowException("The current window was closed")
+
+    def execute(self, driver_command, params=None):
+        """Run a remote command after the configured latency.
+
+        Parameters
+        ----------
+        driver_command : str
+        params : dict or None
+            The command's keyword arguments.
+        """
+        with self._lock:
+            if self.quit_called:
+                raise WebDriverException("The browser was quit")
+            self.calls[driver_command] = self.calls.get(driver_command, 0) + 1
+            if self.latency:
+                time.sleep(self.latency)
+            return self._commands[driver_command](**(params or {}))
+
+    def get(self, url):
+        self.execute("get", dict(url=url))
+
+    @property
+    def current_url(self):
+        return self.execute("getCurrentUrl")
+
+    @property
+    def title(self):
+        return self.execute("getTitle")
+
+    @property
+    def window_handles(self):
+        return list(self.windows)
+
+    def execute_script(self, script, *args):
+        return self.execute("executeScript", dict(script=script, args=args))
+
+    def find_element(self, by, value):
+        return self.execute("findElement", dict(by=by, value=value))
+
+    def add_cookie(self, cookie):
+        self.execute("addCookie", dict(cookie=cookie))
+
+    def install_addon(self, path, temporary=False):
+        self.execute("installAddon", dict(path=path))
+
+    def close(self):
+        self.execute("closeWindow")
+
+    def quit(self):
+        self.execute("quit")
+
+    def invalidate(self, *selectors):
+        """Make the elements found for some selectors stale, as if the
+        page rendered them again. Not a remote command.
+
+        Parameters
+        ----------
+        selectors : str
+        """
+        for element in self.found_elements:
+            if element.selector in selectors:
+                element.stale = True
+
+    def end_media(self):
+        """Make the media of the current page play to its end, as
+        observed by the page's listeners. Not a remote command.
+        """
+        media = self.page.media
+        media.current_time = media.duration
+        media.paused = True
+        media.ended = True
+        self.page.events.append(
+            dict(type=events.ENDED, time=media.current_time, duration=media.duration)
+        )
+
+    def _get(self, url):
+        if self.load_time:
+            time.sleep(self.load_time)
+        media = None
+        if self.media_duration is not None:
+            media = FakeMedia(self.media_duration)
+        self.windows[self.current_window_handle] = FakePage(url, media)
+
+    def _execute_script(self, script, args):
+        handler = self._scripts.get(script)
+        if handler is None:
+            return None
+        return handler(*args)
+
+    def _find_element(self, by, value):
+        if value not in self.elements:
+            raise NoSuchElementException(f"No element matches {value}")
+        return self._found(value)
+
+    def _found(self, selector):
+        element = FakeElement(self, selector)
+        self.found_elements.append(element)
+        return element
+
+    # noinspection PyMethodMayBeStatic
+    def _click(self, element):
+        if element.stale:
+            raise StaleElementReferenceException(f"{element.selector} is stale")
+        element.clicks += 1
+
+    # noinspection PyMethodMayBeStatic
+    def _get_element_attribute(self, element, name):
+        if element.stale:
+            raise StaleElementReferenceException(f"{element.selector} is stale")
+        return None
+
+    def _switch_to_window(self, handle):
+        if handle not in self.windows:
+            raise NoSuchWindowException(f"No window {handle}")
+        self.current_window_handle = handle
+
+    def _new_window(self, type_hint):
+        handle = next(self._handles)
+        self.windows[handle] = FakePage("about:blank")
+        self.current_window_handle = handle
+
+    def _close_window(self):
+        del self.windows[self.current_window_handle]
+
+    def _quit(self):
+        self.quit_called = True
+        self.windows.clear()
+
+    def _media_script(self, action, value):
+        media = self.page.media
+        if media is None:
+            return None
+        if action == "play" or (action == "play_pause" and media.paused):
+            media.play()
+        elif action in ("pause", "play_pause"):
+            media.paused = True
+        elif action == "seek":
+            media.current_time = value
+        elif action == "volume":
+            media.volume = min(max(value, 0), 1)
+        elif action == "rate":
+            media.rate = value
+        elif action == "mute":
+            media.muted = not media.muted if value is None else bool(value)
+        return media.state()
+
+    def _state_script(self, toggles):
+        page = self.page
+        return dict(
+            url=page.url,
+            title=page.title,
+            media=page.media.state() if page.media is not None else None,
+            toggles={name: None for name in toggles},
+        )
+
+    def _elements_script(self, selectors):
+        found, missing = {}, []
+        for name, selector in selectors.items():
+            if selector in self.elements:
+                found[name] = self._found(selector)
+            else:
+                missing.append(name)
+        return dict(found=found, missing=missing)
+
+    def _poll_script(self, interval):
+        page = self.page
+        collected, page.events = page.events, []
+        return dict(url=page.url, events=collected)
+
+    def _suppress_script(self):
+        media = self.page.media
+        if media is not None:
+            media.suppressed = True
+            media.paused = True
+            media.muted = True
+
+    def _resume_script(self):
+        media = self.page.media
+        if media is not None:
+            media.suppressed = False
+            media.muted = False
+            media.play()
+
+
+class FakeDriverFactory(BaseDriverFactory):
+    """Driver factory building `FakeDriver` instances.
+
+    Parameters
+    ----------
+    latency : float
+        Seconds every remote command takes.
+    load_time : float
+        Additional seconds loading a page takes.
+    startup_time : float
+        Seconds `build` takes.
+    media_duration : float or None
+        Duration of the media element of every page. Pages have no
+        media if None.
+    elements : iterable of str
+        CSS selectors of the elements present on every page. By default
+        the YouTube player components.
+    profile : str
+
+    Drivers built by a factory can be attached to by it again, as if
+    another server process took them over.
+    """
+
+    def __init__(
+        self,
+        latency=0.0,
+        load_time=0.0,
+        startup_time=0.0,
+        media_duration=60.0,
+        elements=tuple(COMPONENTS.values()),
+        profile=DEFAULT_PROFILE,
+    ):
+        super().__init__(profile)
+        self.latency = latency
+        self.load_time = load_time
+        self.startup_time = startup_time
+        self.media_duration = media_duration
+        self.elements = tuple(elements)
+        self.extensions = []
+        # Every driver built, in order
+        self.drivers = []
+
+    def add_extensions(self, *paths):
+        """Record extension paths. They have no effect.
+
+        Parameters
+        ----------
+        paths : str
+        """
+        self.extensions.extend(paths)
+
+    def build(self):
+        """Create a fake driver.
+
+        Returns
+        -------
+        FakeDriver
+        """
+        if self.startup_time:
+            time.sleep(self.startup_time)
+        driver = FakeDriver(
+            latency=self.latency,
+            load_time=self.load_time,
+            media_duration=self.media_duration,
+            elements=self.elements,
+        )
+        self.drivers.append(driver)
+        return driver
+
+    def describe(self, driver):
+        """Identify a driver built by the factory.
+
+        Parameters
+        ----------
+        driver : FakeDriver
+
+        Returns
+        -------
+        dict
+        """
+        return dict(session_id=driver.session_id)
+
+    def attach(self, description):
+        """Find a running driver built by the factory.
+
+        Parameters
+        ----------
+        description : dict
+            As returned by `describe`.
+
+        Returns
+        -------
+        FakeDriver
+        """
+        for driver in self.drivers:
+            if driver.session_id == description["session_id"]:
+                # A cheap command failing if the browser was quit
+                driver.execute("getCurrentUrl")
+                return driver
+        raise WebDriverException(f"No session {description['session_id']}")
+
+    def detach(self, driver):
+        """Nothing to do, fake drivers don't have processes."""
+        pass
@@ -0,0 +1,146 @@
+"""Handing running browsers over to a new server process.
+
+A server given a state file keeps in it, for every session, what is
+needed to attach to its browser (see `BaseDriverFactory.describe`) and
+to resume the session: the current page, the background tabs and the
+playback queue. When the server is stopped for a restart, it leaves its
+browsers running, and the next server process attaches to them instead
+of launching new ones, so playback isn't interrupted.
+
+The server using the browsers holds an exclusive lock (see `acquire`)
+on a lock file next to the state file, which also holds its process id.
+The lock is released by the system when the process exits, however it
+exits, so a stale id left by a crashed server is never trusted. A new
+process can take over from a running one with `take_over`, which makes
+the old process detach from its browsers and exit.
+"""
+import fcntl
+import json
+import logging
+import os
+import signal
+import time
+
+
+def save(path, sessions):
+    """Write the state file.
+
+    The file is replaced atomically, so a reader never sees a partial
+    state.
+
+    Parameters
+    ----------
+    path : str
+    sessions : dict
+        Descriptions of the sessions by name.
+    """
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(dict(sessions=sessions), f)
+    os.replace(temporary, path)
+
+
+def load(path):
+    """Read the state file.
+
+    Parameters
+    ----------
+    path : str
+
+    Returns
+    -------
+    dict
+        Descriptions of the sessions by name, empty if there is no file
+        or it can't be read.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f).get("sessions", {})
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError, AttributeError):
+        logging.exception(f"Ignoring unreadable state file {path}")
+        return {}
+
+
+def acquire(path):
+    """Lock the browsers of a state file for the current process.
+
+    Parameters
+    ----------
+    path : str
+        The state file.
+
+    Returns
+    -------
+    file or None
+        The locked lock file, to be kept open while the browsers are
+        used. Closing it releases the lock. None if another process
+        holds the lock.
+    """
+    lock = open(f"{path}.lock", "a+")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return None
+    lock.truncate(0)
+    lock.write(str(os.getpid()))
+    lock.flush()
+    return lock
+
+
+def owner(path):
+    """Id of the process holding the lock of a state file.
+
+    Parameters
+    ----------
+    path : str
+        The state file.
+
+    Returns
+    -------
+    int or None
+        None if no process holds the lock.
+    """
+    lock = acquire(path)
+    if lock is not None:
+        lock.close()
+        return None
+    try:
+        with open(f"{path}.lock") as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        # The owner hasn't written its id yet
+        return None
+
+
+def take_over(path, timeout=30.0):
+    """Make the server holding the lock of a state file hand its
+    browsers over and exit.
+
+    Parameters
+    ----------
+    path : str
+    timeout : float
+        Seconds to wait for the server to release the lock.
+
+    Raises
+    ------
+    TimeoutError
+        If the lock is still held after ``timeout``.
+    """
+    pid = owner(path)
+    if pid is None:
+        return
+    logging.info(f"Taking over the browsers of process {pid}")
+    os.kill(pid, signal.SIGTERM)
+    deadline = time.monotonic() + timeout
+    while True:
+        lock = acquire(path)
+        if lock is not None:
+            lock.close()
+            return
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Process {pid} didn't exit in {timeout} seconds")
+        time.sleep(0.01)
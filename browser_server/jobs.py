@@ -0,0 +1,107 @@
+"""Bookkeeping for commands executed in the background."""
+import itertools
+from collections import OrderedDict
+
+
+class Job:
+    """A command executed asynchronously on behalf of a client.
+
+    Parameters
+    ----------
+    job_id : int
+    command : str
+        Name of the executed command.
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+
+    def __init__(self, job_id, command):
+        self.id = job_id
+        self.command = command
+        self.status = self.PENDING
+        self.result = None
+        # Callbacks notified with the job once it is done
+        self.waiters = []
+
+    @property
+    def done(self):
+        """Whether the command has finished."""
+        return self.status == self.DONE
+
+    def finish(self, result):
+        """Store the command's response and notify the waiters.
+
+        Parameters
+        ----------
+        result : dict
+            The command's response.
+        """
+        self.result = result
+        self.status = self.DONE
+        waiters, self.waiters = self.waiters, []
+        for waiter in waiters:
+            waiter(self)
+
+    def describe(self):
+        """Job status in a form that can be sent to a client.
+
+        Returns
+        -------
+        dict
+        """
+        data = dict(ok=True, job=self.id, status=self.status, done=self.done)
+        if self.done:
+            data["result"] = self.result
+        return data
+
+
+class JobRegistry:
+    """Collection of jobs retaining a bounded number of finished ones.
+
+    Parameters
+    ----------
+    max_finished : int
+        Number of finished jobs kept for clients to collect. The oldest
+        are forgotten first.
+    """
+
+    def __init__(self, max_finished=256):
+        self.max_finished = max_finished
+        self.jobs = OrderedDict()
+        self._ids = itertools.count(1)
+
+    def create(self, command):
+        """Register a new job.
+
+        Parameters
+        ----------
+        command : str
+
+        Returns
+        -------
+        Job
+        """
+        job = Job(next(self._ids), command)
+        self.jobs[job.id] = job
+        self._evict()
+        return job
+
+    def get(self, job_id):
+        """Find a job by id.
+
+        Parameters
+        ----------
+        job_id : int
+
+        Returns
+        -------
+        Job or None
+        """
+        return self.jobs.get(job_id)
+
+    def _evict(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.done]
+        for job_id in finished[: max(len(finished) - self.max_finished, 0)]:
+            del self.jobs[job_id]
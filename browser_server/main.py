@@ -1,15 +1,73 @@
-from contextlib import closing
 from shutil import which
 import argparse
+import os
+import signal
 import sys
 
 from server import BrowserServer
-from driver_factories import FirefoxDriverFactory, ChromeDriverFactory
+from driver_factories import (
+    FirefoxDriverFactory,
+    ChromeDriverFactory,
+    PROFILES,
+    DEFAULT_PROFILE,
+    PAGE_LOAD_STRATEGIES,
+    EAGER,
+)
+import handover
+import transport
+
+SECRET_VARIABLE = "BROWSER_SERVER_SECRET"
 
 FIREFOX = "F"
 CHROME = "C"
 
 
+def select_browser(firefox=False, chrome=False):
+    """Choose the browser to use based on the available executables.
+
+    Parameters
+    ----------
+    firefox : bool
+        Prefer Firefox.
+    chrome : bool
+        Prefer Chrome.
+
+    Returns
+    -------
+    str
+        FIREFOX or CHROME.
+    """
+    firefox_available = bool(which("geckodriver")) and bool(which("firefox"))
+    chrome_available = (
+        bool(which("chromium")) or bool(which("chromium-browser"))
+    ) and bool(which("chromedriver"))
+
+    if firefox_available and (firefox or not chrome):
+        return FIREFOX
+    elif chrome_available:
+        return CHROME
+    raise FileNotFoundError("Browser or driver executables not in path")
+
+
+def read_secret(path=None):
+    """Get the shared secret of TCP clients.
+
+    Parameters
+    ----------
+    path : str or None
+        File containing the secret. The BROWSER_SERVER_SECRET
+        environment variable is used if None.
+
+    Returns
+    -------
+    str or None
+    """
+    if path is None:
+        return os.environ.get(SECRET_VARIABLE) or None
+    with open(path) as f:
+        return f.read().strip() or None
+
+
 def main(argv):
 
     parser = argparse.ArgumentParser()
@@ -25,6 +83,124 @@ def main(argv):
         default="/tmp/browser.sock",
         help="Path to the unix socket the server will bind" " to.",
     )
+    parser.add_argument(
+        "--tcp",
+        metavar="HOST:PORT",
+        type=transport.parse_address,
+        help="Also listen on a TCP address, for clients on other machines."
+        " Clients must know the shared secret.",
+    )
+    parser.add_argument(
+        "--secret-file",
+        help="File containing the shared secret of TCP clients. Defaults to"
+        f" the {SECRET_VARIABLE} environment variable.",
+    )
+    parser.add_argument(
+        "--event-interval",
+        type=float,
+        default=0.5,
+        help="Seconds between collections of player events pushed to subscribers.",
+    )
+    parser.add_argument(
+        "--max-sessions",
+        type=int,
+        default=4,
+        help="Maximal number of independent browser sessions. The spare browser"
+        " of --prewarm comes on top of them.",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=sorted(PROFILES),
+        default=DEFAULT_PROFILE,
+        help="Browser profile. 'headless' runs without a window, 'light'"
+        " disables images, extra content processes, telemetry and background"
+        " networking.",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        help="Directory in which browser profiles with installed addons,"
+        " cache and cookies are kept and reused across launches. A fresh"
+        " profile is used for every launch if omitted.",
+    )
+    parser.add_argument(
+        "--page-load-strategy",
+        choices=PAGE_LOAD_STRATEGIES,
+        default=EAGER,
+        help="When navigation returns: after the page and all its resources"
+        " loaded ('normal'), after the document was parsed ('eager') or right"
+        " away ('none').",
+    )
+    parser.add_argument(
+        "--media-timeout",
+        type=float,
+        default=10.0,
+        help="Seconds go_to waits for the media of the page to become"
+        " playable. Use 0 to not wait.",
+    )
+    parser.add_argument(
+        "--prefetch-tabs",
+        type=int,
+        default=2,
+        help="Maximal number of background tabs per session holding pages"
+        " loaded ahead of time by the prefetch command.",
+    )
+    parser.add_argument(
+        "--warm-tabs",
+        type=int,
+        default=0,
+        help="Maximal number of recently played pages per session kept paused"
+        " in background tabs, so that returning to them doesn't reload them.",
+    )
+    parser.add_argument(
+        "--tab-memory",
+        type=float,
+        help="Memory budget of a browser in MiB. While it is exceeded, the"
+        " least recently played background tab is closed. Only --warm-tabs"
+        " limits the tabs if omitted.",
+    )
+    parser.add_argument(
+        "--stats-file",
+        help="JSON file the latency metrics are periodically written to.",
+    )
+    parser.add_argument(
+        "--stats-interval",
+        type=float,
+        default=60.0,
+        help="Seconds between writes of the metrics file.",
+    )
+    parser.add_argument(
+        "--command-timeout",
+        type=float,
+        help="Default number of seconds a command may take before the client"
+        " gets a timeout error. No deadline if omitted.",
+    )
+    parser.add_argument(
+        "--hang-timeout",
+        type=float,
+        default=5.0,
+        help="Seconds a started command may run past its deadline before its"
+        " browser is considered hung, killed and rebuilt.",
+    )
+    parser.add_argument(
+        "--state-file",
+        help="JSON file recording how to reattach to the browsers. On"
+        " SIGTERM the server exits leaving its browsers running, and the next"
+        " server started with the same file resumes them. The driver services"
+        " must not be killed with the server, e.g. use KillMode=process with"
+        " systemd.",
+    )
+    parser.add_argument(
+        "--take-over",
+        action="store_true",
+        help="Make the server running with the same --state-file hand its"
+        " browsers over and exit before binding the sockets.",
+    )
+    parser.add_argument(
+        "--prewarm",
+        action="store_true",
+        help="Launch a browser in the background at startup and after"
+        " each exit so that start returns immediately.",
+    )
 
     browser_flag_descriptions = (
         "Flags determining which browser to use."
@@ -45,29 +221,59 @@ def main(argv):
 
     args = parser.parse_args(argv)
 
-    # Browser selection
-    firefox_available = bool(which("geckodriver")) and bool(which("firefox"))
-    chrome_available = (
-        bool(which("chromium")) or bool(which("chromium-browser"))
-    ) and bool(which("chromedriver"))
-
-    if firefox_available and (args.firefox or not args.chrome):
-        browser = FIREFOX
-    elif chrome_available:
-        browser = CHROME
-    else:
-        raise FileNotFoundError("Browser or driver executables not in path")
+    secret = read_secret(args.secret_file)
+    if args.tcp is not None and secret is None:
+        parser.error(f"--tcp requires --secret-file or {SECRET_VARIABLE}")
+    if args.take_over and args.state_file is None:
+        parser.error("--take-over requires --state-file")
 
-    driver_factory = (
-        FirefoxDriverFactory() if browser == FIREFOX else ChromeDriverFactory()
+    browser = select_browser(args.firefox, args.chrome)
+    factory_class = FirefoxDriverFactory if browser == FIREFOX else ChromeDriverFactory
+    driver_factory = factory_class(
+        profile=args.profile,
+        profile_dir=args.profile_dir,
+        page_load_strategy=args.page_load_strategy,
     )
 
     # addon installation
     addons = args.addon or []
     driver_factory.add_extensions(*addons)
 
-    with closing(BrowserServer(driver_factory, address=args.bind)) as server:
+    if args.take_over:
+        handover.take_over(args.state_file)
+
+    server = BrowserServer(
+        driver_factory,
+        address=args.bind,
+        event_interval=args.event_interval,
+        prewarm=args.prewarm,
+        max_sessions=args.max_sessions,
+        stats_file=args.stats_file,
+        stats_interval=args.stats_interval,
+        command_timeout=args.command_timeout,
+        hang_timeout=args.hang_timeout,
+        media_timeout=args.media_timeout or None,
+        prefetch_tabs=args.prefetch_tabs,
+        warm_tabs=args.warm_tabs,
+        tab_memory_budget=(
+            int(args.tab_memory * 2**20) if args.tab_memory is not None else None
+        ),
+        tcp_address=args.tcp,
+        secret=secret,
+        state_file=args.state_file,
+    )
+    # SIGTERM stops the server for a restart, its browsers are handed over
+    terminated = []
+
+    def on_terminate(signum, frame):
+        terminated.append(signum)
+        server.stop()
+
+    signal.signal(signal.SIGTERM, on_terminate)
+    try:
         server.run()
+    finally:
+        server.close(detach=bool(terminated))
 
 
 if __name__ == "__main__":
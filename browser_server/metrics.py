@@ -0,0 +1,193 @@
+"""Latency metrics of the browser server.
+
+Durations are recorded in named histograms with fixed bucket bounds.
+Names are dotted, with the kind of the measured operation first:
+
+- ``command.<name>``: execution of a command
+- ``queue.<name>``: time a command waited for its session's thread
+- ``protocol.decode``: decoding received data into messages
+- ``driver.startup``: launching a browser
+- ``driver.<command>``: a WebDriver remote command, e.g. ``driver.get``
+  or ``driver.findElement``
+- ``controller.init``: construction of a media controller
+- ``media.ready``: waiting for the media to become playable after a
+  navigation
+- ``timeout.<name>``: a command that overran its deadline
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds of the histogram buckets in seconds
+BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+class Histogram:
+    """Count, sum, extremes and bucketed distribution of durations."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, seconds):
+        """Record a duration.
+
+        Parameters
+        ----------
+        seconds : float
+        """
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def quantile(self, q):
+        """Estimate a quantile as the upper bound of its bucket.
+
+        Parameters
+        ----------
+        q : float
+            Between 0 and 1.
+
+        Returns
+        -------
+        float or None
+            None if nothing was recorded.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        """The histogram's state in a JSON serializable form.
+
+        Returns
+        -------
+        dict
+        """
+        buckets = {str(bound): count for bound, count in zip(BUCKETS, self.counts)}
+        buckets["+Inf"] = self.counts[-1]
+        return dict(
+            count=self.count,
+            total=self.total,
+            mean=self.total / self.count if self.count else None,
+            min=self.min,
+            max=self.max,
+            p50=self.quantile(0.5),
+            p90=self.quantile(0.9),
+            p99=self.quantile(0.99),
+            buckets=buckets,
+        )
+
+
+class Metrics:
+    """Thread safe collection of named histograms."""
+
+    def __init__(self):
+        self.started = time.time()
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        """Record a duration.
+
+        Parameters
+        ----------
+        name : str
+        seconds : float
+        """
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        """Record the duration of a block of code.
+
+        Parameters
+        ----------
+        name : str
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def instrument(self, driver):
+        """Record the duration of every remote command of a driver.
+
+        Parameters
+        ----------
+        driver : WebDriver
+        """
+        execute = driver.execute
+
+        def timed_execute(driver_command, *args, **kwargs):
+            with self.timer(f"driver.{driver_command}"):
+                return execute(driver_command, *args, **kwargs)
+
+        driver.execute = timed_execute
+
+    def reset(self):
+        """Forget all recorded durations."""
+        with self._lock:
+            self._histograms = {}
+            self.started = time.time()
+
+    def snapshot(self):
+        """The state of all histograms in a JSON serializable form.
+
+        Returns
+        -------
+        dict
+        """
+        with self._lock:
+            histograms = {
+                name: histogram.snapshot()
+                for name, histogram in sorted(self._histograms.items())
+            }
+        return dict(since=self.started, histograms=histograms)
+
+    def dump(self, path):
+        """Write a snapshot to a JSON file, replacing it atomically.
+
+        Parameters
+        ----------
+        path : str
+        """
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(temporary, path)
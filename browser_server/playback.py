@@ -0,0 +1,153 @@
+"""Server-side playback queues.
+
+A session can be given a list of urls to play one after another. The
+server moves to the next url by itself when the media of the current
+one ends (see `events.ENDED`), so clients don't have to watch the
+player.
+"""
+
+# Queue command actions
+GET = "get"  # Report the queue
+REPLACE = "replace"  # Set the urls and the position to start playing at
+NEXT = "next"
+PREVIOUS = "previous"
+JUMP = "jump"  # Play the url at a given position
+
+ACTIONS = (GET, REPLACE, NEXT, PREVIOUS, JUMP)
+
+
+def check_position(position):
+    """Reject a queue position that isn't an integer.
+
+    Parameters
+    ----------
+    position : object
+
+    Raises
+    ------
+    TypeError
+        If the position isn't an int, or is a bool.
+    """
+    if not isinstance(position, int) or isinstance(position, bool):
+        raise TypeError(f"Queue position must be an integer: {position!r}")
+
+
+class PlaybackQueue:
+    """Urls to be played in order, with a cursor on the current one."""
+
+    def __init__(self):
+        self.urls = []
+        self.position = None
+
+    @property
+    def active(self):
+        """Whether the queue is playing, i.e. the cursor is on a url."""
+        return self.position is not None
+
+    @property
+    def current(self):
+        """The url under the cursor, None if the queue isn't playing."""
+        if self.position is None:
+            return None
+        return self.urls[self.position]
+
+    def replace(self, urls, position=0):
+        """Replace the urls and move the cursor.
+
+        Parameters
+        ----------
+        urls : list of str
+        position : int
+            Index of the url to be played first.
+
+        Returns
+        -------
+        str or None
+            The url to be played, None if there are no urls.
+
+        Raises
+        ------
+        TypeError
+            If the urls aren't a list of strings or the position isn't
+            an integer.
+        IndexError
+            If the position is out of range.
+        """
+        if not isinstance(urls, list) or not all(isinstance(u, str) for u in urls):
+            raise TypeError("Queue urls must be a list of strings")
+        check_position(position)
+        urls = list(urls)
+        if urls and not 0 <= position < len(urls):
+            raise IndexError(f"Queue position out of range: {position}")
+        self.urls = urls
+        self.position = position if urls else None
+        return self.current
+
+    def jump(self, position):
+        """Move the cursor to a given index.
+
+        Parameters
+        ----------
+        position : int
+
+        Returns
+        -------
+        str
+            The url to be played.
+
+        Raises
+        ------
+        TypeError
+            If the position isn't an integer.
+        IndexError
+            If the position is out of range.
+        """
+        check_position(position)
+        if not 0 <= position < len(self.urls):
+            raise IndexError(f"Queue position out of range: {position}")
+        self.position = position
+        return self.current
+
+    def next(self):
+        """Move the cursor to the next url. Past the last url the queue
+        stops playing.
+
+        Returns
+        -------
+        str or None
+            The url to be played, None at the end of the queue.
+        """
+        if self.position is None:
+            return None
+        if self.position + 1 >= len(self.urls):
+            self.position = None
+            return None
+        self.position += 1
+        return self.current
+
+    def previous(self):
+        """Move the cursor to the previous url, if there is one.
+
+        Returns
+        -------
+        str or None
+            The url to be played, None if the cursor is on the first url
+            or the queue isn't playing.
+        """
+        if not self.position:
+            return None
+        self.position -= 1
+        return self.current
+
+    def stop(self):
+        """Stop playing, keeping the urls."""
+        self.position = None
+
+    def describe(self):
+        """The queue in a form that can be sent to a client.
+
+        Returns
+        -------
+        dict
+        """
+        return dict(urls=list(self.urls), position=self.position)
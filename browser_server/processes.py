@@ -0,0 +1,82 @@
+"""Helpers for inspecting and terminating browser processes.
+
+Process trees are read from /proc, so they are only available on
+Linux. Elsewhere only the root process is known.
+"""
+import logging
+import os
+import signal
+
+
+def process_tree(pid):
+    """Find the ids of a process and all of its descendants.
+
+    Parameters
+    ----------
+    pid : int
+
+    Returns
+    -------
+    list of int
+        The root process first, followed by its descendants.
+    """
+    if not os.path.isdir("/proc"):
+        return [pid]
+
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces, fields follow ')'
+                parent = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, []))
+    return tree
+
+
+def rss(pid):
+    """Resident set size of a process tree in bytes.
+
+    Parameters
+    ----------
+    pid : int
+        Id of the tree's root process.
+
+    Returns
+    -------
+    int
+    """
+    total = 0
+    for process in process_tree(pid):
+        try:
+            with open(f"/proc/{process}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total
+
+
+def kill_tree(pid):
+    """Forcibly terminate a process and all of its descendants.
+
+    Parameters
+    ----------
+    pid : int
+    """
+    for process in process_tree(pid):
+        try:
+            os.kill(process, signal.SIGKILL)
+        except OSError:
+            logging.debug(f"Process {process} could not be killed")
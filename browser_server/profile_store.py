@@ -0,0 +1,149 @@
+"""Reusable browser profile directories.
+
+Launching a browser with a fresh profile means installing every
+extension again and starting with an empty cache and cookie jar. A
+`ProfileStore` keeps prepared profiles on disk and hands them out to
+the driver factories. A browser locks its profile while running, so
+every concurrently running browser gets its own numbered directory.
+The directories are reused across launches and rebuilt only when the
+set of extensions changes.
+"""
+import hashlib
+import itertools
+import json
+import logging
+import os
+import shutil
+import threading
+
+
+class ProfileStore:
+    """Numbered profile directories under a common base directory.
+
+    Parameters
+    ----------
+    path : str
+        The base directory.
+    """
+
+    MANIFEST = ".commonplayer-profile.json"
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self._in_use = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(extensions):
+        """Identify a set of extension files by their paths and contents.
+
+        Parameters
+        ----------
+        extensions : list of str
+            Extension file paths.
+
+        Returns
+        -------
+        str
+        """
+        digest = hashlib.sha256()
+        for path in sorted(extensions):
+            digest.update(os.path.abspath(path).encode())
+            with open(path, "rb") as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+        return digest.hexdigest()
+
+    def acquire(self, extensions):
+        """Reserve a profile directory for a browser.
+
+        Parameters
+        ----------
+        extensions : list of str
+            The extensions the browser will use. A directory prepared
+            for a different set is emptied.
+
+        Returns
+        -------
+        path : str
+            The reserved directory.
+        manifest : dict or None
+            Details stored by `mark_prepared`, or None if the directory
+            has to be prepared.
+        """
+        fingerprint = self.fingerprint(extensions)
+        with self._lock:
+            for slot in itertools.count():
+                path = os.path.join(self.path, str(slot))
+                if path not in self._in_use:
+                    self._in_use.add(path)
+                    break
+
+        manifest = self._read_manifest(path)
+        if manifest is None or manifest.get("fingerprint") != fingerprint:
+            logging.debug(f"Preparing browser profile {path}")
+            shutil.rmtree(path, ignore_errors=True)
+            os.makedirs(path)
+            return path, None
+        return path, manifest
+
+    def mark_prepared(self, path, extensions, **details):
+        """Record that a directory is prepared for a set of extensions.
+
+        Parameters
+        ----------
+        path : str
+        extensions : list of str
+        details
+            Stored in the manifest returned by `acquire`.
+        """
+        manifest = dict(details, fingerprint=self.fingerprint(extensions))
+        with open(os.path.join(path, self.MANIFEST), "w") as f:
+            json.dump(manifest, f)
+
+    def claim(self, path):
+        """Mark a directory as in use by a browser started elsewhere, e.g.
+        by a previous server process.
+
+        Parameters
+        ----------
+        path : str
+        """
+        with self._lock:
+            self._in_use.add(path)
+
+    def release(self, path):
+        """Make a directory available to other browsers.
+
+        Parameters
+        ----------
+        path : str
+        """
+        with self._lock:
+            self._in_use.discard(path)
+
+    def bind(self, driver, path):
+        """Release a directory when the driver using it quits. The
+        directory is recorded as the driver's ``profile_path``.
+
+        Parameters
+        ----------
+        driver : WebDriver
+        path : str
+        """
+        driver.profile_path = path
+        quit_driver = driver.quit
+
+        def quit_and_release():
+            try:
+                quit_driver()
+            finally:
+                self.release(path)
+
+        driver.quit = quit_and_release
+
+    def _read_manifest(self, path):
+        try:
+            with open(os.path.join(path, self.MANIFEST)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
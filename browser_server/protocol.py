@@ -0,0 +1,85 @@
+"""Wire protocol of the browser server.
+
+Every message is a UTF-8 encoded JSON object preceded by its length in
+bytes, packed as a 4-byte big-endian unsigned integer. Requests may
+carry an ``id`` member which is echoed in the matching response, so
+a single connection can have many commands in flight and receive the
+replies in any order.
+"""
+import json
+import struct
+
+HEADER = struct.Struct("!I")
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+
+class ProtocolError(Exception):
+    """Raised when a peer sends data that does not follow the protocol."""
+
+    pass
+
+
+def encode(message):
+    """Serialize and frame a message.
+
+    Parameters
+    ----------
+    message : dict
+
+    Returns
+    -------
+    bytes
+    """
+    payload = json.dumps(message).encode()
+    return HEADER.pack(len(payload)) + payload
+
+
+class FrameDecoder:
+    """Incremental decoder turning a byte stream into messages.
+
+    Parameters
+    ----------
+    max_size : int
+        Size limit of a message in bytes. Can be changed between feeds.
+    """
+
+    def __init__(self, max_size=MAX_MESSAGE_SIZE):
+        self.buffer = bytearray()
+        self.max_size = max_size
+
+    def feed(self, data):
+        """Consume received bytes.
+
+        Parameters
+        ----------
+        data : bytes
+
+        Returns
+        -------
+        list of dict
+            Messages completed by the data, in the order they were sent.
+
+        Raises
+        ------
+        ProtocolError
+            If a frame is too large or does not contain a JSON object.
+        """
+        self.buffer += data
+        messages = []
+        while len(self.buffer) >= HEADER.size:
+            (size,) = HEADER.unpack_from(self.buffer)
+            if size > self.max_size:
+                raise ProtocolError(f"Message of {size} bytes exceeds size limit")
+            end = HEADER.size + size
+            if len(self.buffer) < end:
+                break
+            payload = bytes(self.buffer[HEADER.size : end])
+            del self.buffer[:end]
+            try:
+                message = json.loads(payload.decode())
+            except ValueError:
+                raise ProtocolError("Malformed message")
+            if not isinstance(message, dict):
+                raise ProtocolError("Message is not a JSON object")
+            messages.append(message)
+        return messages
@@ -1,171 +1,1391 @@
+import heapq
+import itertools
+import math
 import os
+import queue
 import socket
-import json
+import selectors
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import logging
-from urllib.parse import urlparse
 
-from controllers.youtube import YoutubeController
+from jobs import JobRegistry
+from metrics import Metrics
+from session import Session, DEFAULT_SESSION, URGENT, NAVIGATION, NORMAL
+import events
+import handover
+import playback
+import protocol
+import transport
+
+
+class Connection:
+    """State of a single client connection.
+
+    Parameters
+    ----------
+    sock : socket.socket
+        The connected, non-blocking client socket.
+    address : str or tuple
+        The peer address.
+    challenge : str or None
+        Nonce the peer has to sign with the shared secret before its
+        commands are accepted (see `transport`). The connection is
+        trusted if None.
+    """
+
+    def __init__(self, sock, address, challenge=None):
+        self.socket = sock
+        self.address = address
+        self.decoder = protocol.FrameDecoder()
+        self.outgoing = bytearray()
+        self.close_when_flushed = False
+        self.closed = False
+        self.challenge = challenge
+        if challenge is not None:
+            self.decoder.max_size = transport.HANDSHAKE_SIZE
+
+    @property
+    def authenticated(self):
+        """Whether commands from the connection are accepted."""
+        return self.challenge is None
+
+    def fileno(self):
+        """The underlying socket's file descriptor."""
+        return self.socket.fileno()
+
+
+class Task:
+    """A command waiting for or undergoing execution by a session.
+
+    Parameters
+    ----------
+    conn : Connection
+        The connection the command was received from.
+    message : dict
+        The received message.
+    session : Session
+        The session executing the command.
+    job : Job or None
+        The job tracking the command if it runs asynchronously.
+    action : callable or None
+        Function executed instead of the message's command. Used for
+        work the server schedules itself.
+    callback : callable or None
+        Called on the event loop with the response instead of replying
+        to the connection.
+    priority : str
+        Scheduling priority of the task (see `session`). Set from the
+        command when the task is submitted unless ``action`` is given.
+    """
+
+    def __init__(
+        self,
+        conn,
+        message,
+        session,
+        job=None,
+        action=None,
+        callback=None,
+        priority=NORMAL,
+    ):
+        self.conn = conn
+        self.message = message
+        self.session = session
+        self.job = job
+        self.action = action
+        self.callback = callback
+        self.priority = priority
+        self.response = None
+        self.received = time.monotonic()
+        self.started = False
+        self.finished = False
+        self.timed_out = False
+        self.deadline_timer = None
+
+    @property
+    def command(self):
+        """The command's name."""
+        return self.message.get("command")
+
+    @property
+    def value(self):
+        """The command's argument."""
+        return self.message.get("value")
+
+
+def is_duration(value):
+    """Whether a value received from a client is a valid number of
+    seconds, i.e. a positive finite number.
+
+    Parameters
+    ----------
+    value
+
+    Returns
+    -------
+    bool
+    """
+    return (
+        isinstance(value, (int, float))
+        and not isinstance(value, bool)
+        and math.isfinite(value)
+        and value > 0
+    )
 
 
 # FIXME: The server still seems to quit incorrectly
 class BrowserServer:
+    """Server multiplexing client connections onto a pool of webdrivers.
+
+    Client sockets are served by a selector loop, so accepting, reading
+    and replying never block on another client. Commands that use a
+    webdriver carry a ``session`` id (``"default"`` if omitted) and are
+    executed one at a time by that session's thread; sessions run in
+    parallel. A session is created by its first command and released
+    when its browser is closed. Messages are framed as described in
+    `protocol`; a request's ``id`` is echoed in its response.
+
+    A driver command sent with ``"async": true`` is answered at once
+    with a job id. The ``job`` command polls the job or waits for it
+    to finish, without holding up the driver thread.
+
+    A command may carry a ``timeout`` in seconds (``command_timeout``
+    by default). If it isn't done in time the client gets a timeout
+    error. A command that started running and is still running
+    ``hang_timeout`` seconds after its deadline is considered hung: its
+    browser is killed and replaced before the session's next command.
+    WebDriver runs one command at a time per browser, so a busy browser
+    can't be told apart from a hung one by asking it; the kill is
+    unconditional after ``timeout + hang_timeout``. Commands that timed
+    out while queued are dropped without affecting the browser.
+
+    Player controls and state reads overtake navigations waiting in their
+    session's queue, and a navigation supersedes the ones still queued,
+    which are answered with ``"superseded": true`` without running.
+
+    Latency metrics (see `metrics`) are reported by the ``stats``
+    command and optionally written to a file periodically.
+
+    The ``queue`` command gives a session a list of urls to play (see
+    `playback`). Their player events are then watched even without
+    subscribers, and the session moves on to the next url when the
+    media ends. Navigating elsewhere with ``go_to`` stops the queue.
+
+    The ``subscribe`` command keeps pushing player events (see
+    `events`) to the connection until ``unsubscribe`` is sent or the
+    connection is closed.
+
+    Besides the unix socket, the server can listen on a TCP address for
+    clients on other machines. These have to pass the shared-secret
+    handshake described in `transport` first.
+
+    With a ``state_file``, the server records how to attach to its
+    browsers (see `handover`). A server closed with ``detach=True``
+    leaves them running, and the next server started with the same
+    file resumes their sessions instead of launching new browsers.
+
+    Parameters
+    ----------
+    driver_factory : BaseDriverFactory
+        Factory used to build the webdriver.
+    address : str or None
+        Path to the unix socket the server will bind to. No unix socket
+        is opened if None.
+    event_interval : float
+        Seconds between two collections of player events while there
+        are subscribers.
+    prewarm : bool
+        Build a spare browser in the background when the server starts
+        and after each ``exit``, so that ``start`` only has to hand it
+        over.
+    max_sessions : int
+        Maximal number of sessions, and thus of browsers in use. The
+        spare browser of ``prewarm`` isn't counted, so up to
+        ``max_sessions + 1`` browsers may be running.
+    stats_file : str or None
+        Path of a JSON file the metrics are written to periodically.
+    stats_interval : float
+        Seconds between two writes of the metrics file.
+    command_timeout : float or None
+        Default number of seconds a command may take. Commands have no
+        deadline if None.
+    hang_timeout : float
+        Seconds a started command may run past its deadline before its
+        browser is considered hung and killed.
+    media_timeout : float or None
+        Seconds ``go_to`` waits for the media of the page to become
+        playable. The response's ``ready`` tells whether it did. No
+        waiting if None.
+    prefetch_tabs : int
+        Maximal number of background tabs per session loaded by the
+        ``prefetch`` command. A ``go_to`` to a prefetched url switches
+        to its tab instead of loading the page.
+    warm_tabs : int
+        Maximal number of recently left media pages per session kept
+        paused and muted in background tabs. Going back to one of them
+        switches to its tab and resumes playback.
+    tab_memory_budget : int or None
+        Bytes a session's browser may use before its least recently left
+        tab is closed.
+    tcp_address : tuple of (str, int) or None
+        Host and port of the TCP socket the server will bind to. No TCP
+        socket is opened if None.
+    secret : str or None
+        Shared secret TCP clients have to prove they know. Required if
+        ``tcp_address`` is given.
+    state_file : str or None
+        Path of the JSON file the sessions' browsers are recorded in.
+    """
 
     START = "start"  # Initiate the webdriver
     EXIT = "exit"  # Close the webdriver
     GOTO = "go_to"  # Go to a given url
     GET = "get_url"  # Return the current url
     CONTROL = "control"  # Send command to media controller
+    BATCH = "batch"  # Run a list of commands
+    JOB = "job"  # Poll or wait for an asynchronous command
+    SUBSCRIBE = "subscribe"  # Receive player events
+    UNSUBSCRIBE = "unsubscribe"  # Stop receiving player events
+    STATUS = "status"  # Report the state of the browsers
+    STATS = "stats"  # Report latency metrics
+    PREFETCH = "prefetch"  # Load a url in a background tab
+    STATE = "state"  # Report the state of the page and player
+    QUEUE = "queue"  # Manage the playback queue
 
-    domain_controllers = {
-        "www.youtube.com": YoutubeController,
-        "youtu.be": YoutubeController,
-    }
-
-    def __init__(self, driver_factory, address):
+    def __init__(
+        self,
+        driver_factory,
+        address,
+        event_interval=0.5,
+        prewarm=False,
+        max_sessions=4,
+        stats_file=None,
+        stats_interval=60.0,
+        command_timeout=None,
+        hang_timeout=5.0,
+        media_timeout=None,
+        prefetch_tabs=2,
+        warm_tabs=0,
+        tab_memory_budget=None,
+        tcp_address=None,
+        secret=None,
+        state_file=None,
+    ):
+        if address is None and tcp_address is None:
+            raise ValueError("Neither a unix socket nor a TCP address is given")
+        if tcp_address is not None and not secret:
+            raise ValueError("A TCP listener requires a shared secret")
+        self.secret = secret
+        # Lock on the browsers of the state file, held while running
+        self._state_lock = None
+        if state_file is not None:
+            self._state_lock = handover.acquire(state_file)
+            if self._state_lock is None:
+                pid = handover.owner(state_file)
+                raise RuntimeError(f"The browsers are in use by process {pid}")
 
-        try:
-            os.remove(address)
-        except OSError:
-            if os.path.exists(address):
-                raise
+        # Listening sockets, mapped to whether their clients must
+        # authenticate
+        self.listeners = {}
+        if address is not None:
+            try:
+                os.remove(address)
+            except OSError:
+                if os.path.exists(address):
+                    raise
 
-        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        self.socket.bind(address)
-        self.socket.listen(1)
+            unix_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            unix_socket.bind(address)
+            unix_socket.listen()
+            unix_socket.setblocking(False)
+            self.listeners[unix_socket] = False
+        if tcp_address is not None:
+            self.listeners[transport.listen(tcp_address)] = True
 
         self.driver_factory = driver_factory
 
-        self.driver = None
-        self.controller = None
+        self.sessions = {}
+        self.max_sessions = max_sessions
+
+        self.prewarm = prewarm
+        self._warm_up_executor = ThreadPoolExecutor(1, thread_name_prefix="warm-up")
+        self._spare = None  # Future of a driver built in the background
+        self._spare_lock = threading.Lock()
 
         self.connections = []
 
+        self.handlers = {
+            self.START: self._start,
+            self.EXIT: self._exit,
+            self.GET: self._get_url,
+            self.GOTO: self._go_to,
+            self.CONTROL: self._control,
+            self.BATCH: self._batch,
+            self.PREFETCH: self._prefetch,
+            self.STATE: self._state,
+            self.QUEUE: self._queue,
+        }
+        # Scheduling priorities of commands, NORMAL if not listed
+        self.priorities = {
+            self.CONTROL: URGENT,
+            self.GET: URGENT,
+            self.STATE: URGENT,
+            self.GOTO: NAVIGATION,
+        }
+        # Commands answered by the event loop without the driver
+        self.loop_handlers = {
+            self.JOB: self._job,
+            self.SUBSCRIBE: self._subscribe,
+            self.UNSUBSCRIBE: self._unsubscribe,
+            self.STATUS: self._status,
+            self.STATS: self._stats,
+        }
+        self.jobs = JobRegistry()
+
+        self.command_timeout = command_timeout
+        self.hang_timeout = hang_timeout
+        self.media_timeout = media_timeout
+        self.prefetch_tabs = prefetch_tabs
+        self.warm_tabs = warm_tabs
+        self.tab_memory_budget = tab_memory_budget
+
+        self.metrics = Metrics()
+        self.stats_file = stats_file
+        self.stats_interval = stats_interval
+
+        self.event_interval = event_interval
+        self.subscriptions = {}
+        self._event_polls = set()  # Sessions with a scheduled poll
+
+        self.selector = selectors.DefaultSelector()
+        for listener in self.listeners:
+            self.selector.register(listener, selectors.EVENT_READ)
+
+        # Session threads signal finished commands through this pair
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self.selector.register(self._wakeup_recv, selectors.EVENT_READ)
+
+        self.completed = queue.Queue()
+        self.running = False
+
+        self._timers = []
+        self._timer_ids = itertools.count()
+
+        self.state_file = state_file
+        self._saved_state = None
+
     def run(self):
         """Run the main loop."""
-        conn, address = self.await_connection()
-        while True:
-            data = conn.recv(1024).decode()
+        self.running = True
+        if self.state_file is not None:
+            self.restore()
+        if self.prewarm:
+            self.warm_up()
+        if self.stats_file is not None:
+            self.call_later(self.stats_interval, self._dump_stats)
+
+        while self.running:
+            for key, mask in self.selector.select(self._run_timers()):
+                if key.fileobj in self.listeners:
+                    self.accept(key.fileobj)
+                elif key.fileobj is self._wakeup_recv:
+                    self._drain_wakeup()
+                    self._dispatch_completed()
+                else:
+                    self._service(key.data, mask)
+
+    def stop(self):
+        """Make the main loop return. Safe to call from any thread."""
+        self.running = False
+        self._wakeup()
+
+    def call_later(self, delay, callback):
+        """Schedule a callback on the event loop.
+
+        Parameters
+        ----------
+        delay : float
+            Delay in seconds.
+        callback : callable
+            Called without arguments.
+
+        Returns
+        -------
+        list
+            Timer handle that can be passed to `cancel_timer`.
+        """
+        timer = [time.monotonic() + delay, next(self._timer_ids), callback]
+        heapq.heappush(self._timers, timer)
+        return timer
+
+    # noinspection PyMethodMayBeStatic
+    def cancel_timer(self, timer):
+        """Cancel a timer scheduled with `call_later`."""
+        timer[2] = None
+
+    def _run_timers(self):
+        """Run due timers.
+
+        Returns
+        -------
+        float or None
+            Seconds until the next timer is due, None if there are none.
+        """
+        while self._timers:
+            deadline, _, callback = self._timers[0]
+            delay = deadline - time.monotonic()
+            if callback is not None and delay > 0:
+                return delay
+            heapq.heappop(self._timers)
+            if callback is not None:
+                callback()
+        return None
+
+    @property
+    def tcp_address(self):
+        """Host and port the TCP socket is bound to, None without one."""
+        for listener, authenticate in self.listeners.items():
+            if authenticate:
+                return listener.getsockname()[:2]
+        return None
+
+    def accept(self, listener):
+        """Accept a pending connection.
+
+        Parameters
+        ----------
+        listener : socket.socket
+            The listening socket with the pending connection.
+        """
+        try:
+            sock, address = listener.accept()
+        except (BlockingIOError, ConnectionAbortedError):
+            return
+        sock.setblocking(False)
+        challenge = None
+        if self.listeners[listener]:
+            transport.configure(sock)
+            challenge = transport.challenge()
+        conn = Connection(sock, address, challenge)
+        self.connections.append(conn)
+        self.selector.register(conn, selectors.EVENT_READ, conn)
+        logging.debug(f"{address} connected")
+        if challenge is not None:
+            self.send(conn, dict(challenge=challenge))
+            self.call_later(transport.AUTH_TIMEOUT, lambda: self._auth_timeout(conn))
+
+    def _authenticate(self, conn, message):
+        """Check the handshake message of a TCP connection."""
+        if transport.verify(self.secret, conn.challenge, message.get("auth")):
+            conn.challenge = None
+            conn.decoder.max_size = protocol.MAX_MESSAGE_SIZE
+            logging.debug(f"{conn.address} authenticated")
+            self.reply(conn, message, dict(ok=True))
+        else:
+            logging.warning(f"Authentication of {conn.address} failed")
+            conn.close_when_flushed = True
+            self.reply(conn, message, dict(ok=False, error="Authentication failed"))
+
+    def _auth_timeout(self, conn):
+        if not conn.closed and not conn.authenticated:
+            logging.warning(f"{conn.address} didn't authenticate in time")
+            self.disconnect(conn)
+
+    def _service(self, conn, mask):
+        """Handle a readiness event of a client connection."""
+        if mask & selectors.EVENT_READ:
+            self._read(conn)
+        if mask & selectors.EVENT_WRITE and not conn.closed:
+            self._flush(conn)
+
+    def _read(self, conn):
+        try:
+            data = conn.socket.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+
+        if not data:
+            self.disconnect(conn)
+            return
+
+        try:
+            with self.metrics.timer("protocol.decode"):
+                messages = conn.decoder.feed(data)
+        except protocol.ProtocolError as e:
+            # The stream can't be resynchronized, so drop the client
+            logging.warning(f"{e} from {conn.address}")
+            conn.close_when_flushed = True
+            self.send(conn, dict(ok=False, error=str(e)))
+            return
 
-            if not data:
-                conn, address = self.await_connection()
+        for parsed in messages:
+            if not conn.authenticated:
+                # Nothing is accepted after a failed attempt
+                if not conn.close_when_flushed:
+                    self._authenticate(conn, parsed)
                 continue
+            logging.debug(
+                f"Command: {parsed.get('command')}; Value: {parsed.get('value')}"
+                f" from {conn.address}"
+            )
+            self.receive(conn, parsed)
 
-            parsed = json.loads(data)
-            command = parsed.get("command")
-            value = parsed.get("value")
-            logging.debug(f"Command: {command}; Value: {value} from {address}")
-
-            # TODO: Command encapsulation
-            if command == self.START:
-                self.init_driver()
-                self.send(conn)
-
-            elif command == self.EXIT:
-                self.close_browser()
-                self.send(conn)
-                conn.close()
-                self.connections.remove(conn)
-                conn, address = self.await_connection()
-
-            elif command == self.GET:
-                url = self.current_url
-                data = dict(url=url, ok=True)
-                if url is None:
-                    data["ok"] = False
-                self.send(conn, data)
-
-            elif command == self.GOTO:
-                self.go_to_url(value)
-                self.send(conn)
-
-            elif command == self.CONTROL:
-                self.control_player(value)
-                self.send(conn)
-
-        conn.close()
-
-    def init_driver(self):
-        """Initialize the browser."""
-        if self.driver is not None:
-            logging.warning(
-                "Init driver called, but driver was already" " initialized."
+    def receive(self, conn, message):
+        """Answer or queue a received message.
+
+        Parameters
+        ----------
+        conn : Connection
+        message : dict
+        """
+        command = message.get("command")
+        if not isinstance(command, str):
+            self.reply(conn, message, dict(ok=False, error="Command must be a string"))
+            return
+        loop_handler = self.loop_handlers.get(command)
+        if loop_handler is not None:
+            try:
+                loop_handler(conn, message)
+            except Exception as e:
+                # An error must not bring down the loop serving everyone
+                logging.exception(f"Command {command} failed")
+                self.reply(conn, message, dict(ok=False, error=str(e)))
+            return
+
+        timeout = message.get("timeout")
+        if timeout is not None and not is_duration(timeout):
+            error = "Timeout must be a positive number of seconds"
+            self.reply(conn, message, dict(ok=False, error=error))
+            return
+
+        name = message.get("session", DEFAULT_SESSION)
+        if not isinstance(name, str):
+            error = "Session must be a string"
+            self.reply(conn, message, dict(ok=False, error=error))
+            return
+
+        session = self.get_session(name)
+        if session is None:
+            error = f"Session limit of {self.max_sessions} reached"
+            self.reply(conn, message, dict(ok=False, error=error))
+        elif message.get("async"):
+            job = self.jobs.create(message.get("command"))
+            self.submit(Task(conn, message, session, job))
+            self.reply(conn, message, dict(ok=True, job=job.id))
+        else:
+            self.submit(Task(conn, message, session))
+
+    def submit(self, task):
+        """Queue a task on its session and watch its deadline.
+
+        Parameters
+        ----------
+        task : Task
+        """
+        if task.action is None:
+            task.priority = self.priorities.get(task.command, NORMAL)
+        timeout = task.message.get("timeout", self.command_timeout)
+        if timeout is not None:
+            task.deadline_timer = self.call_later(
+                timeout, lambda: self._on_deadline(task)
             )
+        for superseded in task.session.submit(task):
+            self._supersede(superseded)
+
+    def _supersede(self, task):
+        """Answer a queued navigation dropped in favour of a newer one."""
+        if task.deadline_timer is not None:
+            self.cancel_timer(task.deadline_timer)
+        if task.timed_out:
             return
-        self.driver = self.driver_factory.build()
+        response = dict(ok=True, superseded=True)
+        if task.job is not None:
+            task.job.finish(response)
+        else:
+            self.reply(task.conn, task.message, response)
+
+    def _on_deadline(self, task):
+        """Answer an overdue command and watch its browser."""
+        task.timed_out = True
+        elapsed = time.monotonic() - task.received
+        self.metrics.observe(f"timeout.{self._metric_name(task.command)}", elapsed)
+        response = dict(ok=False, error="Command timed out", timeout=True)
+        if task.job is not None:
+            task.job.finish(response)
+        else:
+            self.reply(task.conn, task.message, response)
+        if task.started:
+            self._watch(task)
+
+    def _watch(self, task):
+        """Kill the browser of an overdue command unless the command
+        finishes within `hang_timeout`.
+        """
+        session = task.session
+        driver = session.driver
+        if driver is None or session.watched:
+            return
+        session.watched = True
+
+        def check():
+            session.watched = False
+            if not task.finished and session.driver is driver:
+                session.kill_browser()
+
+        self.call_later(self.hang_timeout, check)
+
+    def get_session(self, name, create=True):
+        """Find a session, creating it if necessary.
+
+        Parameters
+        ----------
+        name : str
+        create : bool
+            Create the session if it doesn't exist.
+
+        Returns
+        -------
+        Session or None
+            None if the session doesn't exist and can't be created.
+        """
+        session = self.sessions.get(name)
+        if session is None and create and len(self.sessions) < self.max_sessions:
+            session = Session(
+                name,
+                self._execute,
+                self._complete,
+                self.metrics,
+                media_timeout=self.media_timeout,
+                prefetch_tabs=self.prefetch_tabs,
+                warm_tabs=self.warm_tabs,
+                tab_memory_budget=self.tab_memory_budget,
+            )
+            self.sessions[name] = session
+        return session
+
+    def _release_session(self, session):
+        """Remove a session that has no browser and no queued tasks."""
+        if session.pending == 0 and session.driver is None:
+            session.stop(wait=False)
+            del self.sessions[session.name]
+
+    def reply(self, conn, message, response):
+        """Send the response to a message.
+
+        Parameters
+        ----------
+        conn : Connection
+        message : dict
+            The message being answered. Its id is copied to the
+            response.
+        response : dict
+        """
+        if "id" in message:
+            response["id"] = message["id"]
+        if response.pop("close", False):
+            conn.close_when_flushed = True
+        if not conn.closed:
+            self.send(conn, response)
+
+    def _execute(self, task):
+        """Run a task on its session's thread."""
+        if task.timed_out:
+            # The client was already told the command timed out
+            return dict(ok=False, error="Command timed out", timeout=True)
+        task.started = True
+        if task.job is not None:
+            task.job.status = task.job.RUNNING
+        if task.session.needs_rebuild:
+            self._rebuild(task.session)
+        if task.action is None:
+            waited = time.monotonic() - task.received
+            self.metrics.observe(f"queue.{self._metric_name(task.command)}", waited)
+            return self.handle_command(task.session, task.command, task.value)
+        try:
+            return task.action()
+        except Exception as e:
+            logging.exception("Server task failed")
+            return dict(ok=False, error=str(e))
+
+    def _rebuild(self, session):
+        """Replace a session's killed browser."""
+        session.discard_browser()
+        try:
+            session.driver = self._build_driver()
+        except Exception:
+            logging.exception(f"Rebuilding the browser of {session.name} failed")
+
+    def _complete(self, task):
+        """Hand a finished task over to the event loop."""
+        task.finished = True
+        if self.state_file is not None:
+            self._record(task.session)
+        self.completed.put(task)
+        self._wakeup()
+
+    def handle_command(self, session, command, value=None):
+        """Execute a command.
+
+        Parameters
+        ----------
+        session : Session
+            The session the command is executed in.
+        command : str
+        value
+            The command's argument.
+
+        Returns
+        -------
+        dict
+            The response to be sent to the client.
+        """
+        handler = self.handlers.get(command)
+        if handler is None:
+            return dict(ok=False, error=f"Unknown command: {command}")
+        try:
+            with self.metrics.timer(f"command.{command}"):
+                return handler(session, value) or dict(ok=True)
+        except Exception as e:
+            logging.exception(f"Command {command} failed")
+            return dict(ok=False, error=str(e))
 
-    def close(self):
-        """Close the browser."""
+    def _metric_name(self, command):
+        """Name under which the metrics of a command are recorded.
 
-        self.close_browser()
-        for conn in self.connections:
-            conn.close()
-        self.socket.shutdown(socket.SHUT_RDWR)
-        self.socket.close()
+        Commands without a handler are grouped under ``unknown``, so that
+        clients can't add a metric per garbage name.
+        """
+        return command if command in self.handlers else "unknown"
 
-    def close_browser(self):
-        if self.driver is not None:
-            self.driver.quit()
-            self.driver = None
+    def _start(self, session, _):
+        self.init_driver(session)
+
+    def _exit(self, session, _):
+        session.close_browser()
+        if self.prewarm:
+            self.warm_up()
+        return dict(ok=True, close=True)
 
     # noinspection PyMethodMayBeStatic
-    def send(self, conn, data=None):
-        """Send data to socket.
+    def _get_url(self, session, _):
+        url = session.current_url
+        return dict(url=url, ok=url is not None)
+
+    # noinspection PyMethodMayBeStatic
+    def _go_to(self, session, url):
+        ready = session.go_to_url(url)
+        if ready is not None:
+            return dict(ok=True, ready=ready)
+
+    # noinspection PyMethodMayBeStatic
+    def _state(self, session, _):
+        return dict(ok=True, **session.player_state())
+
+    def _queue(self, session, value):
+        """Change or report the session's playback queue.
 
         Parameters
         ----------
-        conn : socket.socket
-        data : dict
-            Data to be sent. If set to None (default) {'ok':True} is
-            sent.
+        value : dict or None
+            ``action`` - one of `playback.ACTIONS`, ``get`` by default;
+            ``urls`` and ``position`` for ``replace``; ``position`` for
+            ``jump``.
+
+        Returns
+        -------
+        dict
+            The queue under ``queue``. If the action moved to another
+            url, the browser went to it and ``ready`` is included as for
+            ``go_to``.
         """
+        value = value or {}
+        if not isinstance(value, dict):
+            return dict(ok=False, error="Value must be an object")
+        action = value.get("action", playback.GET)
+        playback_queue = session.playback
+        try:
+            if action == playback.GET:
+                return dict(ok=True, queue=playback_queue.describe())
+            elif action == playback.REPLACE:
+                url = playback_queue.replace(
+                    value.get("urls", []), value.get("position", 0)
+                )
+            elif action == playback.JUMP:
+                url = playback_queue.jump(value.get("position"))
+            elif action == playback.NEXT:
+                url = playback_queue.next()
+            elif action == playback.PREVIOUS:
+                url = playback_queue.previous()
+            else:
+                return dict(ok=False, error=f"Unknown queue action: {action}")
+        except (TypeError, IndexError) as e:
+            # Invalid urls or position, the queue is left unchanged
+            return dict(ok=False, error=str(e))
 
-        if data is None:
-            data = dict(ok=True)
-        conn.send(json.dumps(data).encode())
+        response = dict(ok=True)
+        if url is not None:
+            response = self._go_to(session, url) or response
+        response["queue"] = playback_queue.describe()
+        return response
+
+    def _advance_queue(self, session):
+        """Play the next url of a session's queue if its media ended."""
+        if session.page_url != session.playback.current:
+            # The client navigated away from the queue, which it left
+            session.playback.stop()
+            return dict(ok=True, advanced=False)
+        media = session.player_state().get("media")
+        if media is None or not media.get("ended"):
+            # E.g. the media was restarted since the event was recorded
+            return dict(ok=True, advanced=False)
+        response = self._queue(session, dict(action=playback.NEXT))
+        response["advanced"] = True
+        return response
 
-    # TODO: Play after page loads
-    def go_to_url(self, url):
-        """Go to a given url.
+    # noinspection PyMethodMayBeStatic
+    def _prefetch(self, session, url):
+        session.prefetch(url)
+
+    # noinspection PyMethodMayBeStatic
+    def _control(self, session, value):
+        """Perform a controller action. The value is either the action's
+        name or {'action': ..., 'value': ...} for actions taking an
+        argument. The response holds the state of the media element
+        under ``media`` if the action reports it.
+        """
+        if isinstance(value, dict):
+            media = session.control_player(value.get("action"), value.get("value"))
+        else:
+            media = session.control_player(value)
+        if isinstance(media, dict):
+            return dict(ok=True, media=media)
+
+    def _batch(self, session, value):
+        """Run a list of commands in order.
 
         Parameters
         ----------
-        url : str
+        value : dict
+            ``commands`` - list of {'command': ..., 'value': ...} dicts;
+            ``stop_on_error`` - if true, commands following a failed one
+            are skipped.
+
+        Returns
+        -------
+        dict
+            ``results`` holds the response of each executed command with
+            its execution time in seconds under ``time``. ``ok`` is false
+            if any command failed.
         """
-        if self.driver is not None:
-            self.driver.get(url)
+        value = value or {}
+        if not isinstance(value, dict):
+            return dict(ok=False, error="Value must be an object")
+        commands = value.get("commands", [])
+        if not isinstance(commands, list) or not all(
+            isinstance(step, dict) for step in commands
+        ):
+            return dict(ok=False, error="Commands must be a list of objects")
+        stop_on_error = value.get("stop_on_error", False)
 
-        controller_class = self.domain_controllers.get(urlparse(url).netloc)
-        if controller_class is None:
-            self.controller = None
-        elif not isinstance(self.controller, controller_class):
-            self.controller = controller_class(self.driver)
+        response = dict(ok=True, results=[])
+        for step in commands:
+            command = step.get("command")
+            start = time.perf_counter()
+            if command == self.BATCH:
+                result = dict(ok=False, error="Batches can't be nested")
+            else:
+                result = self.handle_command(session, command, step.get("value"))
+            result["time"] = time.perf_counter() - start
 
-    @property
-    def current_url(self):
-        """The url the browser is currently on.
+            if result.pop("close", False):
+                response["close"] = True
+            response["results"].append(result)
+            if not result.get("ok"):
+                response["ok"] = False
+                if stop_on_error:
+                    break
+        return response
+
+    def _wakeup(self):
+        try:
+            self._wakeup_send.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_recv.recv(1024):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def _dispatch_completed(self):
+        """Deliver the results of commands finished by the sessions."""
+        while True:
+            try:
+                task = self.completed.get_nowait()
+            except queue.Empty:
+                if self.state_file is not None:
+                    self._save_state()
+                return
+            task.session.pending -= 1
+            if self.sessions.get(task.session.name) is task.session:
+                self._release_session(task.session)
+
+            if task.deadline_timer is not None:
+                self.cancel_timer(task.deadline_timer)
+            if task.timed_out:
+                # The client already got a timeout error
+                continue
+            if task.callback is not None:
+                task.callback(task.response)
+            elif task.job is not None:
+                # The connection that started the job stays open
+                task.response.pop("close", None)
+                task.job.finish(task.response)
+            else:
+                self.reply(task.conn, task.message, task.response)
+            # E.g. a playback queue was started
+            self._schedule_event_poll(task.session.name)
+
+    def _job(self, conn, message):
+        """Report on or wait for a job.
+
+        The message's value holds the job ``id`` and optionally a
+        ``timeout`` in seconds. With a timeout the reply is delayed
+        until the job finishes or the timeout expires.
+        """
+        value = message.get("value") or {}
+        if not isinstance(value, dict):
+            error = "Value must be an object with the job id"
+            self.reply(conn, message, dict(ok=False, error=error))
+            return
+        timeout = value.get("timeout") or 0
+        if timeout and not is_duration(timeout):
+            error = "Timeout must be a positive number of seconds"
+            self.reply(conn, message, dict(ok=False, error=error))
+            return
+        job = self.jobs.get(value.get("id"))
+        if job is None:
+            self.reply(conn, message, dict(ok=False, error="Unknown job"))
+            return
+
+        if job.done or not timeout:
+            self.reply(conn, message, job.describe())
+            return
+
+        def on_done(finished):
+            self.cancel_timer(timer)
+            self.reply(conn, message, finished.describe())
+
+        def on_timeout():
+            job.waiters.remove(on_done)
+            self.reply(conn, message, job.describe())
+
+        timer = self.call_later(timeout, on_timeout)
+        job.waiters.append(on_done)
+
+    def _status(self, conn, message):
+        """Report which browsers are running and whether a spare one is
+        warming up. ``running`` refers to the message's session.
+        """
+        session = self.sessions.get(message.get("session", DEFAULT_SESSION))
+        spare = self._spare
+        response = dict(
+            ok=True,
+            running=session is not None and session.driver is not None,
+            sessions={
+                name: dict(running=s.driver is not None)
+                for name, s in self.sessions.items()
+            },
+            max_sessions=self.max_sessions,
+            warming=spare is not None and not spare.done(),
+            spare_ready=(
+                spare is not None and spare.done() and spare.exception() is None
+            ),
+        )
+        self.reply(conn, message, response)
+
+    def _stats(self, conn, message):
+        """Report the latency metrics. If the value holds a true
+        ``reset``, the metrics are cleared after being reported.
+        """
+        response = dict(ok=True, **self.metrics.snapshot())
+        if (message.get("value") or {}).get("reset"):
+            self.metrics.reset()
+        self.reply(conn, message, response)
+
+    def _dump_stats(self):
+        try:
+            self.metrics.dump(self.stats_file)
+        except OSError:
+            logging.exception("Writing the metrics file failed")
+        self.call_later(self.stats_interval, self._dump_stats)
+
+    def _subscribe(self, conn, message):
+        """Start pushing player events to a connection.
+
+        The message's value may hold the minimal ``interval`` between
+        time updates in seconds and a list of event ``types``. Events
+        are sent as {'subscription': ..., 'event': ...} messages with
+        the request's id.
+        """
+        value = message.get("value") or {}
+        if not isinstance(value, dict):
+            error = "Value must be an object"
+            self.reply(conn, message, dict(ok=False, error=error))
+            return
+        interval = value.get("interval", 1.0)
+        if not is_duration(interval):
+            error = "Interval must be a positive number of seconds"
+            self.reply(conn, message, dict(ok=False, error=error))
+            return
+        types = value.get("types")
+        if types is not None and not (
+            isinstance(types, list) and all(isinstance(t, str) for t in types)
+        ):
+            error = "Types must be a list of event types"
+            self.reply(conn, message, dict(ok=False, error=error))
+            return
+        if not isinstance(message.get("session", DEFAULT_SESSION), str):
+            error = "Session must be a string"
+            self.reply(conn, message, dict(ok=False, error=error))
+            return
+        unknown = set(types or ()) - set(events.EVENT_TYPES)
+        if unknown:
+            error = f"Unknown event types: {', '.join(sorted(unknown))}"
+            self.reply(conn, message, dict(ok=False, error=error))
+            return
+
+        subscription = events.Subscription(
+            conn,
+            message,
+            session=message.get("session", DEFAULT_SESSION),
+            interval=interval,
+            types=types,
+        )
+        self.subscriptions[subscription.id] = subscription
+        self.reply(conn, message, dict(ok=True, subscription=subscription.id))
+        self._schedule_event_poll(subscription.session)
+
+    def _unsubscribe(self, conn, message):
+        """End a subscription. The value is the subscription id."""
+        subscription = self.subscriptions.get(message.get("value"))
+        if subscription is None or subscription.conn is not conn:
+            self.reply(conn, message, dict(ok=False, error="Unknown subscription"))
+            return
+        del self.subscriptions[subscription.id]
+        # Lets the subscriber know no more events will follow
+        self.reply(
+            conn, subscription.message, dict(subscription=subscription.id, ended=True)
+        )
+        self.reply(conn, message, dict(ok=True))
+
+    def _subscribers(self, session_name):
+        return [s for s in self.subscriptions.values() if s.session == session_name]
+
+    def _wants_events(self, session_name):
+        """Whether player events of a session have to be collected."""
+        if self._subscribers(session_name):
+            return True
+        session = self.sessions.get(session_name)
+        return (
+            session is not None
+            and session.driver is not None
+            and session.playback.active
+        )
+
+    def _schedule_event_poll(self, session_name):
+        if self._wants_events(session_name) and session_name not in self._event_polls:
+            self._event_polls.add(session_name)
+            self.call_later(
+                self.event_interval, lambda: self._queue_event_poll(session_name)
+            )
+
+    def _queue_event_poll(self, session_name):
+        session = self.get_session(session_name, create=False)
+        if not self._wants_events(session_name):
+            self._event_polls.discard(session_name)
+            return
+        if session is None:
+            # Nothing to observe until the session is started
+            self._publish_events(session_name, dict(ok=True, events=[]))
+            return
+
+        intervals = [s.interval for s in self._subscribers(session_name)]
+        interval = min(intervals, default=1.0)
+        task = Task(
+            None,
+            {},
+            session,
+            action=lambda: self.poll_events(session, interval),
+            callback=lambda response: self._publish_events(session_name, response),
+            priority=URGENT,
+        )
+        session.submit(task)
+
+    # noinspection PyMethodMayBeStatic
+    def poll_events(self, session, interval=1.0):
+        """Collect the player events that occurred since the last poll.
+
+        Parameters
+        ----------
+        session : Session
+        interval : float
+            Minimal number of seconds between two recorded time updates.
 
         Returns
         -------
-        str
+        dict
+            Response with the list of events under 'events'.
         """
-        if self.driver is not None:
-            return self.driver.current_url
-        return None
+        if session.driver is None:
+            return dict(ok=True, events=[])
+
+        page = session.driver.execute_script(events.POLL_SCRIPT, interval) or {}
+        collected = []
+        url = page.get("url")
+        if url != session.last_event_url:
+            session.last_event_url = url
+            collected.append(dict(type=events.URL, url=url))
+        collected.extend(page.get("events", []))
+        return dict(ok=True, events=collected)
+
+    def _publish_events(self, session_name, response):
+        """Push polled events to the session's subscribers and advance
+        its playback queue when the media ended.
+        """
+        self._event_polls.discard(session_name)
+        ended = False
+        for event in response.get("events", []):
+            ended = ended or event.get("type") == events.ENDED
+            for subscription in self._subscribers(session_name):
+                if subscription.wants(event):
+                    self.reply(
+                        subscription.conn,
+                        subscription.message,
+                        dict(subscription=subscription.id, event=event),
+                    )
 
-    def control_player(self, action):
-        """Perform a media controller action.
+        session = self.sessions.get(session_name)
+        if ended and session is not None and session.playback.active:
+            # Submitted before the next poll, which waits behind it
+            session.submit(
+                Task(
+                    None,
+                    {},
+                    session,
+                    action=lambda: self._advance_queue(session),
+                    callback=lambda response: self._on_advanced(session, response),
+                )
+            )
+        self._schedule_event_poll(session_name)
+
+    # noinspection PyMethodMayBeStatic
+    def _on_advanced(self, session, response):
+        if not response.get("ok"):
+            logging.warning(
+                f"Advancing the queue of {session.name} failed:"
+                f" {response.get('error')}"
+            )
+
+    def init_driver(self, session):
+        """Initialize a session's browser.
+
+        A spare browser built by `warm_up` is used if there is one,
+        waiting for it to finish starting if necessary.
 
         Parameters
         ----------
-        action : str
+        session : Session
+        """
+        if session.driver is not None:
+            logging.warning(
+                "Init driver called, but driver was already" " initialized."
+            )
+            return
+        with self._spare_lock:
+            spare, self._spare = self._spare, None
+        if spare is not None:
+            try:
+                session.driver = spare.result()
+                return
+            except Exception:
+                logging.exception("Browser warm-up failed")
+        session.driver = self._build_driver()
+
+    def _build_driver(self):
+        """Launch an instrumented browser."""
+        with self.metrics.timer("driver.startup"):
+            driver = self.driver_factory.build()
+        self.metrics.instrument(driver)
+        return driver
 
+    def warm_up(self):
+        """Start building a spare browser in the background."""
+        with self._spare_lock:
+            if self._spare is None:
+                logging.debug("Warming up a browser")
+                self._spare = self._warm_up_executor.submit(self._build_driver)
+
+    def _discard_spare(self):
+        with self._spare_lock:
+            spare, self._spare = self._spare, None
+        if spare is not None and not spare.cancel():
+            try:
+                spare.result().quit()
+            except Exception:
+                logging.exception("Browser warm-up failed")
+
+    def _record(self, session):
+        """Describe a session for the state file. Called on the
+        session's thread, after each of its tasks.
         """
-        # TODO: This should be a controller method
-        if action in self.controller.actions:
-            self.controller.actions[action]()
+        description = None
+        if session.driver is not None:
+            description = self.driver_factory.describe(session.driver)
+        if description is None:
+            session.handover = None
+        else:
+            session.handover = dict(session.snapshot(), driver=description)
 
-    def await_connection(self):
-        conn, address = self.socket.accept()
-        self.connections.append(conn)
-        logging.debug(f"{address} connected")
-        return conn, address
+    def _save_state(self, force=False):
+        """Write the state file if the sessions changed."""
+        state = {
+            name: session.handover
+            for name, session in self.sessions.items()
+            if session.handover is not None
+        }
+        if force or state != self._saved_state:
+            try:
+                handover.save(self.state_file, state)
+            except OSError:
+                logging.exception("Writing the state file failed")
+            self._saved_state = state
+
+    def restore(self):
+        """Attach to the browsers recorded in the state file, e.g. by a
+        previous server process, and resume their sessions.
+        """
+        saved = handover.load(self.state_file)
+        for name, description in saved.items():
+            try:
+                driver = self.driver_factory.attach(description["driver"])
+            except Exception as e:
+                logging.warning(f"Couldn't attach to the browser of {name}: {e}")
+                continue
+            session = self.get_session(name)
+            if session is None:
+                logging.warning(f"Session limit reached, closing the browser of {name}")
+                driver.quit()
+                continue
+            self.metrics.instrument(driver)
+            try:
+                session.resume(driver, description)
+            except Exception:
+                logging.exception(f"Resuming session {name} failed")
+            session.handover = description
+            logging.info(f"Resumed session {name} at {session.page_url}")
+            self._schedule_event_poll(name)
+        self._save_state(force=True)
+
+    def close(self, detach=False):
+        """Close the browsers.
+
+        Parameters
+        ----------
+        detach : bool
+            Leave the browsers running to be resumed by another server
+            process (see `handover`), instead of quitting them. Requires
+            a ``state_file``.
+        """
+
+        self.running = False
+        for session in self.sessions.values():
+            session.stop()
+        # Descriptions of the sessions left running
+        detached = {}
+        for name, session in self.sessions.items():
+            if detach and self.state_file is not None and session.handover:
+                self.driver_factory.detach(session.driver)
+                session.driver = None
+                detached[name] = session.handover
+            else:
+                session.close_browser()
+        self.sessions.clear()
+        if self.state_file is not None:
+            try:
+                handover.save(self.state_file, detached)
+            except OSError:
+                logging.exception("Writing the state file failed")
+            self._state_lock.close()
+        self._discard_spare()
+        self._warm_up_executor.shutdown()
+        if self.stats_file is not None:
+            self.metrics.dump(self.stats_file)
+        for conn in list(self.connections):
+            self.disconnect(conn)
+        self.selector.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
+        for listener in self.listeners:
+            listener.close()
+
+    def disconnect(self, conn):
+        """Close a client connection.
+
+        Parameters
+        ----------
+        conn : Connection
+        """
+        if conn.closed:
+            return
+        conn.closed = True
+        for subscription in list(self.subscriptions.values()):
+            if subscription.conn is conn:
+                del self.subscriptions[subscription.id]
+        self.selector.unregister(conn)
+        conn.socket.close()
+        self.connections.remove(conn)
+        logging.debug(f"{conn.address} disconnected")
+
+    def send(self, conn, data=None):
+        """Queue data to be sent to a client.
+
+        Parameters
+        ----------
+        conn : Connection
+        data : dict
+            Data to be sent. If set to None (default) {'ok':True} is
+            sent.
+        """
+
+        if data is None:
+            data = dict(ok=True)
+        conn.outgoing += protocol.encode(data)
+        self._flush(conn)
+
+    def _flush(self, conn):
+        """Write as much buffered output as the socket accepts."""
+        try:
+            sent = conn.socket.send(conn.outgoing)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self.disconnect(conn)
+            return
+        del conn.outgoing[:sent]
+
+        if conn.outgoing:
+            mask = selectors.EVENT_READ | selectors.EVENT_WRITE
+        elif conn.close_when_flushed:
+            self.disconnect(conn)
+            return
+        else:
+            mask = selectors.EVENT_READ
+        self.selector.modify(conn, mask, conn)
@@ -0,0 +1,450 @@
+"""Browser sessions managed by the browser server."""
+import collections
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+
+from controllers.base import STATE_SCRIPT
+from controllers.youtube import YoutubeController
+from playback import PlaybackQueue
+from tabs import TabPool
+import processes
+import tabs
+
+DEFAULT_SESSION = "default"
+
+# Scheduling priorities of tasks
+URGENT = "urgent"  # Cheap player controls and reads
+NAVIGATION = "navigation"  # Page loads, superseded by later ones
+NORMAL = "normal"  # Everything else, runs in submission order
+
+
+class Session:
+    """A browser with its media controller, driven by a dedicated thread.
+
+    Commands of a session are executed one at a time, mostly in the
+    order they were submitted. An `URGENT` task overtakes the
+    `NAVIGATION` tasks queued in front of it, but no other task. A
+    queued navigation is dropped when a newer one is submitted, unless a
+    `NORMAL` task is queued in between. Different sessions execute their
+    commands in parallel.
+
+    Parameters
+    ----------
+    name : str
+        The session id used by clients.
+    execute : callable
+        Called on the session's thread with each submitted task. The
+        return value is stored as the task's response.
+    on_complete : callable
+        Called on the session's thread with each finished task.
+    metrics : Metrics or None
+        Records the duration of controller construction.
+    media_timeout : float or None
+        Seconds `go_to_url` waits for the media of a page with a
+        controller to become playable. No waiting if None.
+    prefetch_tabs : int
+        Maximal number of background tabs opened by `prefetch`.
+    warm_tabs : int
+        Maximal number of recently left media pages kept open in
+        background tabs, so that `go_to_url` can return to them.
+    tab_memory_budget : int or None
+        Bytes the browser's processes may use before the least recently
+        left tab is closed. Only the number of tabs is limited if None.
+    """
+
+    domain_controllers = {
+        "www.youtube.com": YoutubeController,
+        "youtu.be": YoutubeController,
+    }
+
+    def __init__(
+        self,
+        name,
+        execute,
+        on_complete,
+        metrics=None,
+        media_timeout=None,
+        prefetch_tabs=2,
+        warm_tabs=0,
+        tab_memory_budget=None,
+    ):
+        self.name = name
+        self.metrics = metrics
+        self.media_timeout = media_timeout
+        self.driver = None
+        self.controller = None
+        # Shared by the controllers of the current browser
+        self.controller_state = {}
+        # Background tabs of the current browser opened by prefetch
+        self.prefetched = TabPool(prefetch_tabs)
+        # Background tabs of recently left media pages
+        self.warm = TabPool(warm_tabs)
+        self.tab_memory_budget = tab_memory_budget
+        # The url last passed to go_to_url, the key of its tab
+        self.page_url = None
+        self.playback = PlaybackQueue()
+        # What the state file records about the session, see `handover`
+        self.handover = None
+
+        # Tasks submitted and not yet delivered. Only used by the event
+        # loop.
+        self.pending = 0
+        self.last_event_url = None
+        # Set when a hung browser was killed and has to be replaced
+        self.needs_rebuild = False
+        # Set while an overdue command is watched by the server
+        self.watched = False
+
+        self._execute = execute
+        self._on_complete = on_complete
+        self._tasks = collections.deque()
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._work, name=f"session-{name}", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, task):
+        """Queue a task for execution on the session's thread.
+
+        Parameters
+        ----------
+        task : Task
+            Its ``priority`` attribute is one of `URGENT`, `NAVIGATION`
+            and `NORMAL`.
+
+        Returns
+        -------
+        list of Task
+            Queued navigations superseded by the task. They won't be
+            executed.
+        """
+        superseded = []
+        with self._condition:
+            if task.priority == NAVIGATION:
+                superseded = self._coalesce()
+            self._tasks.append(task)
+            self._condition.notify()
+        self.pending += 1 - len(superseded)
+        return superseded
+
+    def _coalesce(self):
+        """Remove the navigations queued after the last normal task."""
+        superseded = []
+        kept = []
+        while self._tasks and self._tasks[-1].priority != NORMAL:
+            task = self._tasks.pop()
+            (superseded if task.priority == NAVIGATION else kept).append(task)
+        self._tasks.extend(reversed(kept))
+        superseded.reverse()
+        return superseded
+
+    def _next_task(self):
+        """Take the task to be executed next from the queue."""
+        for i, task in enumerate(self._tasks):
+            if task.priority == URGENT:
+                del self._tasks[i]
+                return task
+            if task.priority != NAVIGATION:
+                break
+        return self._tasks.popleft()
+
+    def stop(self, wait=True):
+        """Stop the session's thread once the queued tasks are done.
+
+        Parameters
+        ----------
+        wait : bool
+            Wait for the thread to finish.
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if wait:
+            self._thread.join()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._tasks and not self._stopping:
+                    self._condition.wait()
+                if not self._tasks:
+                    return
+                task = self._next_task()
+            task.response = self._execute(task)
+            self._on_complete(task)
+
+    def close_browser(self):
+        """Quit the webdriver if it is running."""
+        if self.driver is not None:
+            self.driver.quit()
+            self.driver = None
+            self.controller = None
+            self.controller_state = {}
+            self.prefetched.clear()
+            self.warm.clear()
+            self.page_url = None
+            self.last_event_url = None
+
+    def kill_browser(self):
+        """Forcibly terminate a browser that stopped responding.
+
+        Commands blocked on the browser fail. The session's next task
+        replaces the browser (see `needs_rebuild`). Safe to call from
+        any thread.
+        """
+        pid = self._browser_pid()
+        if pid is None:
+            return
+        logging.error(f"Killing unresponsive browser of session {self.name}")
+        self.needs_rebuild = True
+        processes.kill_tree(pid)
+
+    def _browser_pid(self):
+        """Id of the root process of the browser, None if unknown."""
+        service = getattr(self.driver, "service", None)
+        process = getattr(service, "process", None)
+        # Browsers attached to after a restart aren't our children
+        return getattr(process, "pid", getattr(self.driver, "service_pid", None))
+
+    def discard_browser(self):
+        """Forget a killed browser, releasing what can be released."""
+        try:
+            self.close_browser()
+        except Exception:
+            logging.debug("Quitting a killed browser failed", exc_info=True)
+        finally:
+            self.driver = None
+            self.controller = None
+            self.controller_state = {}
+            self.prefetched.clear()
+            self.warm.clear()
+            self.page_url = None
+            self.last_event_url = None
+            self.needs_rebuild = False
+
+    # TODO: Play after page loads
+    def go_to_url(self, url):
+        """Go to a given url.
+
+        If the url was prefetched or recently left, the browser switches
+        to its tab and its media resumes playing. A media page being
+        left is kept in a background tab if `warm_tabs` allows it,
+        otherwise it is replaced.
+
+        Parameters
+        ----------
+        url : str
+
+        Returns
+        -------
+        bool or None
+            Whether the page's media became playable within
+            `media_timeout`, None if there was nothing to wait for.
+        """
+        if self.driver is not None:
+            self._open(url)
+        self._update_controller(url)
+
+        if (
+            self.controller is None
+            or self.media_timeout is None
+            or not self.controller.has_media(url)
+        ):
+            return None
+        start = time.perf_counter()
+        ready = self.controller.wait_for_media(self.media_timeout)
+        if self.metrics is not None:
+            self.metrics.observe("media.ready", time.perf_counter() - start)
+        return ready
+
+    def _update_controller(self, url):
+        """Set up the controller of the page at a url."""
+        controller_class = self.domain_controllers.get(urlparse(url).netloc)
+        if controller_class is None:
+            self.controller = None
+        elif not isinstance(self.controller, controller_class):
+            start = time.perf_counter()
+            self.controller = controller_class(self.driver, self.controller_state)
+            if self.metrics is not None:
+                self.metrics.observe("controller.init", time.perf_counter() - start)
+        else:
+            self.controller.on_navigate(url)
+
+    def snapshot(self):
+        """The state needed to resume the session with the same browser
+        in another process, see `resume`.
+
+        Returns
+        -------
+        dict
+        """
+        return dict(
+            page_url=self.page_url,
+            controller_state=dict(self.controller_state),
+            prefetched=self.prefetched.items(),
+            warm=self.warm.items(),
+            queue=self.playback.describe(),
+        )
+
+    def resume(self, driver, snapshot):
+        """Take over a running browser left by another process.
+
+        Parameters
+        ----------
+        driver : WebDriver
+            Attached to the browser.
+        snapshot : dict
+            As returned by `snapshot` in the other process.
+        """
+        self.driver = driver
+        self.controller_state = dict(snapshot.get("controller_state", {}))
+        # Tabs beyond the capacities of this process are closed
+        evicted = []
+        for url, handle in snapshot.get("prefetched", []):
+            evicted += self.prefetched.add(url, handle)
+        for url, handle in snapshot.get("warm", []):
+            evicted += self.warm.add(url, handle)
+        self._close_tabs(evicted)
+        queue = snapshot.get("queue", {})
+        if queue.get("position") is not None:
+            self.playback.replace(queue["urls"], queue["position"])
+        self.page_url = snapshot.get("page_url")
+        if self.page_url is not None:
+            self._update_controller(self.page_url)
+
+    def _open(self, url):
+        """Show a url, switching to a background tab if it has one."""
+        handle = self.prefetched.take(url) or self.warm.take(url)
+        keep = (
+            self.warm.capacity > 0
+            and self.controller is not None
+            and self.page_url not in (None, url)
+        )
+        evicted = []
+        if keep:
+            self.driver.execute_script(tabs.SUPPRESS_SCRIPT)
+            evicted = self.warm.add(self.page_url, self.driver.current_window_handle)
+            if handle is None:
+                self.driver.switch_to.new_window("tab")
+                self.driver.get(url)
+        elif handle is None:
+            self.driver.get(url)
+        else:
+            self.driver.close()
+
+        if handle is not None:
+            self.driver.switch_to.window(handle)
+            self.driver.execute_script(tabs.RESUME_SCRIPT)
+        self.page_url = url
+
+        if keep:
+            pid = self._browser_pid()
+            over_budget = (
+                self.tab_memory_budget is not None
+                and pid is not None
+                and processes.rss(pid) > self.tab_memory_budget
+            )
+            # Memory is only freed once the tab's process is gone, so a
+            # single tab is closed per navigation
+            if over_budget and len(self.warm):
+                evicted.append(self.warm.pop_oldest())
+            self._close_tabs(evicted)
+
+    def _close_tabs(self, handles):
+        """Close background tabs, returning to the current one."""
+        if not handles:
+            return
+        current = self.driver.current_window_handle
+        for handle in handles:
+            self.driver.switch_to.window(handle)
+            self.driver.close()
+        self.driver.switch_to.window(current)
+
+    def prefetch(self, url):
+        """Load a url in a background tab with its media suppressed, so
+        that `go_to_url` can switch to it.
+
+        Parameters
+        ----------
+        url : str
+        """
+        if (
+            self.driver is None
+            or self.prefetched.capacity < 1
+            or url in self.prefetched
+        ):
+            return
+        current = self.driver.current_window_handle
+        self.driver.switch_to.new_window("tab")
+        try:
+            self.driver.get(url)
+            self.driver.execute_script(tabs.SUPPRESS_SCRIPT)
+        except Exception:
+            self.driver.close()
+            raise
+        else:
+            self._close_tabs(
+                self.prefetched.add(url, self.driver.current_window_handle)
+            )
+        finally:
+            self.driver.switch_to.window(current)
+
+    @property
+    def current_url(self):
+        """The url the browser is currently on.
+
+        Returns
+        -------
+        str
+        """
+        if self.driver is not None:
+            return self.driver.current_url
+        return None
+
+    def player_state(self):
+        """Collect the state of the page and its player in one script.
+
+        Returns
+        -------
+        dict
+            ``running`` tells whether the browser is running. If it is,
+            ``url``, the page's ``title``, the ``media`` element's state
+            (None without one) and the controller's ``toggles`` (e.g.
+            subtitles, None if unknown) follow.
+        """
+        if self.driver is None:
+            return dict(running=False)
+        toggles = self.controller.toggles if self.controller is not None else {}
+        state = self.driver.execute_script(STATE_SCRIPT, toggles)
+        return dict(running=True, **state)
+
+    def control_player(self, action, value=None):
+        """Perform a media controller action.
+
+        Parameters
+        ----------
+        action : str
+        value
+            The action's argument, e.g. the position to seek to. Actions
+            that take an optional argument are called without one if
+            None.
+
+        Returns
+        -------
+        dict or None
+            The state of the media element if the action reports it.
+
+        Raises
+        ------
+        ValueError
+            If the controller has no such action.
+        """
+        # TODO: This should be a controller method
+        handler = self.controller.actions.get(action)
+        if handler is None:
+            raise ValueError(f"Unknown controller action: {action}")
+        return handler() if value is None else handler(value)
@@ -0,0 +1,139 @@
+"""Browser tabs kept open in the background.
+
+A page can be loaded ahead of time, or kept after it was left, in a
+background tab whose media is held paused and muted. Navigating to the
+page later only has to switch to the tab and resume playback, instead
+of loading the page from scratch.
+"""
+from collections import OrderedDict
+
+# Keeps the page's media paused and muted, including media that starts
+# playing later, e.g. by autoplay
+SUPPRESS_SCRIPT = """
+if (!window.__commonplayerSuppress) {
+    window.__commonplayerSuppress = (e) => {
+        e.target.muted = true;
+        e.target.pause();
+    };
+    // Media events don't bubble, but can be captured on the document
+    document.addEventListener("play", window.__commonplayerSuppress, true);
+}
+for (const media of document.querySelectorAll("video, audio")) {
+    media.muted = true;
+    media.pause();
+}
+"""
+
+# Undoes SUPPRESS_SCRIPT and starts playing the page's media
+RESUME_SCRIPT = """
+if (window.__commonplayerSuppress) {
+    document.removeEventListener("play", window.__commonplayerSuppress, true);
+    delete window.__commonplayerSuppress;
+}
+const media = document.querySelector("video, audio");
+if (media) {
+    media.muted = false;
+    media.play().catch(() => {});
+}
+"""
+
+
+class TabPool:
+    """Window handles of background tabs by the url loaded in them.
+
+    Only does the bookkeeping; opening, switching to and closing the
+    tabs is up to the owner of the driver.
+
+    Parameters
+    ----------
+    capacity : int
+        Maximal number of tabs. Adding a tab to a full pool evicts the
+        one added or used longest ago.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._tabs = OrderedDict()
+
+    def __contains__(self, url):
+        return url in self._tabs
+
+    def __len__(self):
+        return len(self._tabs)
+
+    @property
+    def urls(self):
+        """The urls of the pooled tabs, least recently used first."""
+        return list(self._tabs)
+
+    def items(self):
+        """The pooled tabs, least recently used first.
+
+        Returns
+        -------
+        list of [str, str]
+            Urls and window handles. Adding them to an empty pool in
+            order restores the pool.
+        """
+        return [[url, handle] for url, handle in self._tabs.items()]
+
+    def add(self, url, handle):
+        """Put a tab into the pool.
+
+        Parameters
+        ----------
+        url : str
+        handle : str
+            The tab's window handle.
+
+        Returns
+        -------
+        list of str
+            Handles of the tabs evicted to make room. They have to be
+            closed by the caller.
+        """
+        evicted = []
+        if url in self._tabs:
+            evicted.append(self._tabs.pop(url))
+        self._tabs[url] = handle
+        while len(self._tabs) > self.capacity:
+            evicted.append(self._tabs.popitem(last=False)[1])
+        return evicted
+
+    def take(self, url):
+        """Remove the tab of a url from the pool.
+
+        Parameters
+        ----------
+        url : str
+
+        Returns
+        -------
+        str or None
+            The tab's window handle, None if the url has no tab.
+        """
+        return self._tabs.pop(url, None)
+
+    def pop_oldest(self):
+        """Remove the tab added or used longest ago from the pool.
+
+        Returns
+        -------
+        str or None
+            The tab's window handle, None if the pool is empty.
+        """
+        if not self._tabs:
+            return None
+        return self._tabs.popitem(last=False)[1]
+
+    def clear(self):
+        """Forget all tabs.
+
+        Returns
+        -------
+        list of str
+            Handles of the forgotten tabs.
+        """
+        handles = list(self._tabs.values())
+        self._tabs.clear()
+        return handles
@@ -0,0 +1,108 @@
+"""Tests of the reusable browser profile directories."""
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import zipfile
+from unittest import mock
+
+from driver_factories import ChromeDriverFactory
+from profile_store import ProfileStore
+
+
+class ProfileStoreTests(unittest.TestCase):
+    """Tests of `ProfileStore` on a temporary directory."""
+
+    # docstr-coverage:inherited
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.store = ProfileStore(os.path.join(self.directory, "profiles"))
+        self.extension = os.path.join(self.directory, "extension.xpi")
+        with open(self.extension, "wb") as f:
+            f.write(b"extension")
+
+    def test_concurrent_browsers_get_distinct_slots(self):
+        """Browsers acquiring profiles at the same time never share one."""
+        paths = []
+        barrier = threading.Barrier(8)
+
+        def acquire():
+            barrier.wait()
+            paths.append(self.store.acquire([self.extension])[0])
+
+        threads = [threading.Thread(target=acquire) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(paths)), 8)
+        self.assertTrue(all(os.path.isdir(path) for path in paths))
+
+    def test_released_slot_is_reused(self):
+        """A released directory is handed out again."""
+        first, _ = self.store.acquire([])
+        second, _ = self.store.acquire([])
+        self.store.release(first)
+        self.assertEqual(self.store.acquire([])[0], first)
+        self.assertNotEqual(first, second)
+
+    def test_prepared_profile_is_reused(self):
+        """A directory prepared for the same extensions keeps its files."""
+        path, manifest = self.store.acquire([self.extension])
+        self.assertIsNone(manifest)
+        cache = os.path.join(path, "cache")
+        open(cache, "w").close()
+        self.store.mark_prepared(path, [self.extension], temporary=["a.xpi"])
+        self.store.release(path)
+
+        path, manifest = self.store.acquire([self.extension])
+        self.assertEqual(manifest["temporary"], ["a.xpi"])
+        self.assertTrue(os.path.exists(cache))
+
+    def test_profile_is_rebuilt_when_extensions_change(self):
+        """A directory prepared for other extensions is emptied."""
+        path, _ = self.store.acquire([self.extension])
+        cache = os.path.join(path, "cache")
+        open(cache, "w").close()
+        self.store.mark_prepared(path, [self.extension])
+        self.store.release(path)
+        with open(self.extension, "wb") as f:
+            f.write(b"updated extension")
+
+        rebuilt, manifest = self.store.acquire([self.extension])
+        self.assertEqual(rebuilt, path)
+        self.assertIsNone(manifest)
+        self.assertFalse(os.path.exists(cache))
+
+    def test_quit_releases_profile(self):
+        """Quitting a bound driver releases its directory, even if quitting
+        fails.
+        """
+        path, _ = self.store.acquire([])
+        driver = mock.Mock()
+        driver.quit.side_effect = RuntimeError("Browser gone")
+        self.store.bind(driver, path)
+        self.assertEqual(driver.profile_path, path)
+
+        with self.assertRaises(RuntimeError):
+            driver.quit()
+        self.assertEqual(self.store.acquire([])[0], path)
+
+    def test_failed_unpacking_releases_profile(self):
+        """A Chrome profile whose extensions can't be unpacked is released
+        without launching the browser.
+        """
+        factory = ChromeDriverFactory(profile_dir=self.store.path)
+        factory.add_extensions(self.extension)
+        with mock.patch("driver_factories.webdriver.Chrome") as chrome:
+            with self.assertRaises(zipfile.BadZipFile):
+                factory.build()
+        chrome.assert_not_called()
+        path, _ = factory.profile_store.acquire([self.extension])
+        self.assertEqual(path, os.path.join(self.store.path, "0"))
+
+
+if __name__ == "__main__":
+    unittest.main()
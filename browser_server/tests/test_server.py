@@ -0,0 +1,732 @@
+"""Tests of the browser server, run against fake browsers.
+
+Run from the browser_server directory with ``python -m unittest``.
+"""
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from controllers.youtube import COMPONENTS
+from fakes import FakeDriverFactory
+from server import BrowserServer
+import events
+import handover
+import protocol
+import transport
+
+WATCH_URL = "https://www.youtube.com/watch?v=test"
+OTHER_URL = "https://www.youtube.com/watch?v=other"
+THIRD_URL = "https://example.com/x"
+
+
+class ServerTestCase(unittest.TestCase):
+    """Runs a browser server with fake browsers on a temporary socket."""
+
+    factory_options = {}
+    server_options = {}
+
+    # docstr-coverage:inherited
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.address = os.path.join(self.directory, "browser.sock")
+        self.factory = FakeDriverFactory(**self.factory_options)
+        self.server = BrowserServer(self.factory, self.address, **self.server_options)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.thread.start()
+        self.open_connection()
+        self.ids = iter(range(1, 1000))
+
+    def open_connection(self):
+        """Connect to the server's unix socket."""
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(5)
+        self.socket.connect(self.address)
+        self.decoder = protocol.FrameDecoder()
+        self.received = []
+
+    # docstr-coverage:inherited
+    def tearDown(self):
+        self.socket.close()
+        self.server.stop()
+        self.thread.join(5)
+        self.server.close()
+        shutil.rmtree(self.directory)
+
+    def submit(self, command, value=None, **options):
+        """Send a request and return its id."""
+        request_id = next(self.ids)
+        message = dict(options, command=command, value=value, id=request_id)
+        self.socket.sendall(protocol.encode(message))
+        return request_id
+
+    def receive(self, request_id=None):
+        """Wait for the response to a request, or for any message."""
+        while True:
+            for message in self.received:
+                if request_id is None or message.get("id") == request_id:
+                    self.received.remove(message)
+                    return message
+            data = self.socket.recv(65536)
+            if not data:
+                raise ConnectionError("The server closed the connection")
+            self.received.extend(self.decoder.feed(data))
+
+    def send(self, command, value=None, **options):
+        """Send a request and wait for its response."""
+        return self.receive(self.submit(command, value, **options))
+
+
+class CommandTests(ServerTestCase):
+    """Tests of the commands executed by a session."""
+
+    def test_start_and_go_to(self):
+        """go_to navigates the browser started by start."""
+        self.assertTrue(self.send("start")["ok"])
+        self.assertTrue(self.send("go_to", WATCH_URL)["ok"])
+        response = self.send("get_url")
+        self.assertEqual(response["url"], WATCH_URL)
+        self.assertEqual(len(self.factory.drivers), 1)
+
+    def test_control_reports_media_state(self):
+        """Media actions return the state of the media element."""
+        self.send("start")
+        self.send("go_to", WATCH_URL)
+        response = self.send("control", dict(action="seek", value=12.5))
+        self.assertEqual(response["media"]["current_time"], 12.5)
+        response = self.send("control", "play")
+        self.assertFalse(response["media"]["paused"])
+
+    def test_unknown_control_action(self):
+        """An action the controller doesn't have is answered with an error."""
+        self.send("start")
+        self.send("go_to", WATCH_URL)
+        response = self.send("control", "dance")
+        self.assertFalse(response["ok"])
+        self.assertIn("dance", response["error"])
+
+    def test_state(self):
+        """state reports the url and the media element in one response."""
+        self.send("start")
+        self.send("go_to", WATCH_URL)
+        response = self.send("state")
+        self.assertTrue(response["running"])
+        self.assertEqual(response["url"], WATCH_URL)
+        self.assertIn("subtitles", response["toggles"])
+        self.assertEqual(response["media"]["duration"], 60.0)
+
+    def test_state_without_browser(self):
+        """state reports a session without a browser as not running."""
+        self.assertFalse(self.send("state")["running"])
+
+    def test_unknown_command(self):
+        """Unknown commands get an error response."""
+        response = self.send("unknown")
+        self.assertFalse(response["ok"])
+
+    def test_go_to_prefetched_url(self):
+        """go_to switches to the tab of a prefetched url and resumes it."""
+        self.send("start")
+        self.send("go_to", WATCH_URL)
+        driver = self.factory.drivers[0]
+        first = driver.current_window_handle
+        self.send("prefetch", OTHER_URL)
+        self.assertEqual(driver.current_window_handle, first)
+        (background,) = set(driver.windows) - {first}
+        self.assertTrue(driver.windows[background].media.suppressed)
+
+        self.send("go_to", OTHER_URL)
+        self.assertEqual(driver.calls["get"], 2)
+        self.assertEqual(list(driver.windows), [background])
+        self.assertEqual(driver.current_window_handle, background)
+        media = driver.page.media
+        self.assertFalse(media.suppressed or media.muted or media.paused)
+
+    def test_invalid_session(self):
+        """A session id that isn't a string is rejected."""
+        self.assertFalse(self.send("get_url", session=["a"])["ok"])
+        self.assertFalse(self.send("subscribe", session=["a"])["ok"])
+        self.assertEqual(self.server.subscriptions, {})
+        self.assertTrue(self.send("status")["ok"])
+
+    def test_unknown_commands_share_metrics(self):
+        """Commands without a handler are recorded under a single name."""
+        for command in ("nonsense", "garbage", ["list"], None):
+            self.assertFalse(self.send(command)["ok"])
+        self.send("get_url")
+        histograms = self.send("stats")["histograms"]
+        self.assertEqual(histograms["queue.unknown"]["count"], 2)
+        self.assertIn("queue.get_url", histograms)
+        self.assertFalse(any("nonsense" in name for name in histograms))
+
+    def test_invalid_batches(self):
+        """Batches without a list of commands get a clear error."""
+        self.assertEqual(self.send("batch")["results"], [])
+        for value in (5, dict(commands="start"), dict(commands=["start"])):
+            response = self.send("batch", value)
+            self.assertFalse(response["ok"])
+            self.assertIn("must be", response["error"])
+
+    def test_invalid_job_requests(self):
+        """Malformed job requests get an error and the server keeps going."""
+        job = self.send("start", **{"async": True})["job"]
+        for value in (5, dict(id=job, timeout="x"), dict(id=[job])):
+            self.assertFalse(self.send("job", value)["ok"])
+        self.assertTrue(self.send("status")["ok"])
+
+    def test_invalid_subscriptions(self):
+        """Malformed subscriptions are rejected."""
+        for value in ([1], dict(interval="1"), dict(interval=0), dict(types="url")):
+            self.assertFalse(self.send("subscribe", value)["ok"])
+        self.assertEqual(self.server.subscriptions, {})
+        self.assertTrue(self.send("status")["ok"])
+
+    def test_invalid_queue_changes(self):
+        """Queue changes with invalid urls or positions are rejected and
+        leave the queue unchanged.
+        """
+        self.send("start")
+        self.send("queue", dict(action="replace", urls=[WATCH_URL, OTHER_URL]))
+        for value in (
+            5,
+            dict(action="replace", urls="https://example.com"),
+            dict(action="replace", urls=[WATCH_URL, 5]),
+            dict(action="replace", urls=[WATCH_URL], position="0"),
+            dict(action="replace", urls=[WATCH_URL], position=True),
+            dict(action="jump", position=1.0),
+            dict(action="jump", position=True),
+            dict(action="jump", position=5),
+        ):
+            self.assertFalse(self.send("queue", value)["ok"])
+        queue = self.send("queue")["queue"]
+        self.assertEqual(queue["urls"], [WATCH_URL, OTHER_URL])
+        self.assertEqual(queue["position"], 0)
+
+    def test_queue_advances_when_media_ends(self):
+        """The playback queue moves on when the media ends."""
+        self.server.event_interval = 0.01
+        self.send("start")
+        response = self.send(
+            "queue", dict(action="replace", urls=[WATCH_URL, OTHER_URL])
+        )
+        self.assertEqual(response["queue"]["position"], 0)
+
+        driver = self.factory.drivers[0]
+        driver.end_media()
+        for _ in range(200):
+            if self.send("get_url")["url"] == OTHER_URL:
+                break
+        self.assertEqual(self.send("queue")["queue"]["position"], 1)
+
+    def test_queue_is_left_by_go_to(self):
+        """Media ending on a page outside the queue doesn't advance it."""
+        self.server.event_interval = 0.01
+        self.send("start")
+        self.send("queue", dict(action="replace", urls=[WATCH_URL, OTHER_URL]))
+        self.send("go_to", THIRD_URL)
+
+        self.factory.drivers[0].end_media()
+        for _ in range(200):
+            if self.send("queue")["queue"]["position"] != 0:
+                break
+            time.sleep(0.01)
+        self.assertIsNone(self.send("queue")["queue"]["position"])
+        self.assertEqual(self.send("get_url")["url"], THIRD_URL)
+
+
+class MediaWaitTests(ServerTestCase):
+    """Tests of go_to waiting for the media of the page."""
+
+    factory_options = dict(media_duration=None)
+    server_options = dict(media_timeout=1.0)
+
+    def test_watch_page_waits_for_media(self):
+        """go_to on a video page reports media that never became ready."""
+        self.send("start")
+        self.assertFalse(self.send("go_to", WATCH_URL)["ready"])
+
+    def test_page_without_media_isnt_waited_for(self):
+        """go_to on a YouTube page without video returns right away."""
+        self.send("start")
+        start = time.monotonic()
+        response = self.send("go_to", "https://www.youtube.com/results?search_query=x")
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertNotIn("ready", response)
+
+
+class SubscriptionTests(ServerTestCase):
+    """Tests of the player events pushed to subscribers."""
+
+    server_options = dict(event_interval=0.01)
+
+    def subscribe(self):
+        """Subscribe to the events of the default session.
+
+        Returns
+        -------
+        tuple of (int, str)
+            The id of the request, shared by the pushed messages, and
+            the subscription id.
+        """
+        request_id = self.submit("subscribe", dict(interval=0.01))
+        response = self.receive(request_id)
+        self.assertTrue(response["ok"])
+        return request_id, response["subscription"]
+
+    def next_event(self, request_id, event_type):
+        """Wait for the next pushed event of a type, skipping others."""
+        while True:
+            message = self.receive(request_id)
+            self.assertNotIn("ended", message)
+            if message["event"]["type"] == event_type:
+                return message["event"]
+
+    def test_events_are_delivered(self):
+        """A subscriber is told about navigation and the end of media."""
+        self.send("start")
+        request_id, _ = self.subscribe()
+        self.send("go_to", WATCH_URL)
+        self.assertEqual(self.next_event(request_id, events.URL)["url"], WATCH_URL)
+
+        self.factory.drivers[0].end_media()
+        ended = self.next_event(request_id, events.ENDED)
+        self.assertEqual(ended["time"], ended["duration"])
+
+    def test_unsubscribe_ends_subscription(self):
+        """Unsubscribing sends the end marker and stops the events."""
+        self.send("start")
+        request_id, subscription = self.subscribe()
+        self.assertTrue(self.send("unsubscribe", subscription)["ok"])
+        while True:
+            message = self.receive(request_id)
+            if "ended" in message:
+                break
+        self.assertEqual(
+            message, dict(subscription=subscription, ended=True, id=request_id)
+        )
+        self.assertEqual(self.server.subscriptions, {})
+        self.assertFalse(self.send("unsubscribe", subscription)["ok"])
+
+
+class ElementCacheTests(ServerTestCase):
+    """Tests of the player elements cached by a controller."""
+
+    # docstr-coverage:inherited
+    def setUp(self):
+        super().setUp()
+        self.send("start")
+        self.send("go_to", WATCH_URL)
+        self.driver = self.factory.drivers[0]
+        self.send("control", "autoplay")
+
+    def found(self, selector):
+        """The elements looked up for a selector, oldest first."""
+        return [e for e in self.driver.found_elements if e.selector == selector]
+
+    def test_only_stale_element_is_fetched_again(self):
+        """A stale element is looked up again, the others stay cached."""
+        autoplay = COMPONENTS["autoplay_button"]
+        fullscreen = COMPONENTS["fullscreen_button"]
+        self.driver.invalidate(autoplay)
+        looked_up = len(self.driver.found_elements)
+
+        self.assertTrue(self.send("control", "autoplay")["ok"])
+        self.assertEqual(
+            self.driver.found_elements[looked_up:], self.found(autoplay)[-1:]
+        )
+        self.assertEqual(self.found(autoplay)[-1].clicks, 1)
+        self.assertTrue(self.send("control", "fullscreen")["ok"])
+        self.assertEqual(len(self.driver.found_elements), looked_up + 1)
+        self.assertEqual(self.found(fullscreen)[-1].clicks, 1)
+
+    def test_navigation_clears_cache(self):
+        """Elements of the previous page aren't used on a new one."""
+        autoplay = COMPONENTS["autoplay_button"]
+        (previous,) = self.found(autoplay)
+        looked_up = len(self.driver.found_elements)
+        self.send("go_to", OTHER_URL)
+
+        self.assertTrue(self.send("control", "autoplay")["ok"])
+        self.assertEqual(previous.clicks, 1)
+        latest = self.found(autoplay)[-1]
+        self.assertIn(latest, self.driver.found_elements[looked_up:])
+        self.assertEqual(latest.clicks, 1)
+
+
+class WarmTabTests(ServerTestCase):
+    """Tests of keeping left media pages in background tabs."""
+
+    server_options = dict(warm_tabs=1)
+
+    def go_to(self, url):
+        """Navigate and return the window handle the page is shown in."""
+        self.send("go_to", url)
+        return self.factory.drivers[0].current_window_handle
+
+    def test_revisit_switches_to_warm_tab(self):
+        """Going back to a left page resumes its tab without reloading."""
+        self.send("start")
+        first = self.go_to(WATCH_URL)
+        second = self.go_to(OTHER_URL)
+        driver = self.factory.drivers[0]
+        self.assertTrue(driver.windows[first].media.suppressed)
+
+        self.assertEqual(self.go_to(WATCH_URL), first)
+        self.assertEqual(driver.calls["get"], 2)
+        self.assertEqual(set(driver.windows), {first, second})
+        self.assertTrue(driver.windows[second].media.suppressed)
+        media = driver.page.media
+        self.assertFalse(media.suppressed or media.muted or media.paused)
+
+    def test_least_recently_used_tab_is_closed(self):
+        """A full pool closes the tab left longest ago."""
+        self.send("start")
+        first = self.go_to(WATCH_URL)
+        second = self.go_to(OTHER_URL)
+        third = self.go_to(THIRD_URL)
+
+        driver = self.factory.drivers[0]
+        self.assertEqual(set(driver.windows), {second, third})
+        self.assertEqual(driver.windows[second].url, OTHER_URL)
+        self.assertNotIn(first, driver.windows)
+        self.assertEqual(driver.current_window_handle, third)
+
+
+class TabMemoryBudgetTests(ServerTestCase):
+    """Tests of closing warm tabs when the browser uses too much memory."""
+
+    server_options = dict(warm_tabs=2, tab_memory_budget=100)
+    go_to = WarmTabTests.go_to
+
+    # docstr-coverage:inherited
+    def setUp(self):
+        super().setUp()
+        self.rss = mock.patch("processes.rss", return_value=50).start()
+        self.addCleanup(mock.patch.stopall)
+        self.send("start")
+        self.driver = self.factory.drivers[0]
+        # Fake browsers have no process to measure
+        self.driver.service_pid = 1
+
+    def test_within_budget(self):
+        """Tabs are kept while the browser is within its budget."""
+        first = self.go_to(WATCH_URL)
+        second = self.go_to(OTHER_URL)
+        third = self.go_to(THIRD_URL)
+        self.rss.assert_called_with(1)
+        self.assertEqual(set(self.driver.windows), {first, second, third})
+
+    def test_over_budget(self):
+        """Over budget, a navigation closes the tab left longest ago."""
+        first = self.go_to(WATCH_URL)
+        second = self.go_to(OTHER_URL)
+        self.rss.return_value = 200
+        third = self.go_to(THIRD_URL)
+        self.assertEqual(set(self.driver.windows), {second, third})
+        self.assertNotIn(first, self.driver.windows)
+        self.assertEqual(self.driver.current_window_handle, third)
+
+
+class SchedulingTests(ServerTestCase):
+    """Tests of the order in which a session executes commands."""
+
+    factory_options = dict(load_time=0.2)
+
+    def test_control_overtakes_navigation(self):
+        """A control sent after queued navigations is answered first."""
+        self.send("start")
+        self.send("go_to", WATCH_URL)
+        first = self.submit("go_to", OTHER_URL)
+        time.sleep(0.05)  # Let the first navigation start
+        second = self.submit("go_to", WATCH_URL)
+        control = self.submit("control", "pause")
+
+        order = [self.receive()["id"] for _ in range(3)]
+        self.assertLess(order.index(control), order.index(second))
+        self.assertIn(first, order)
+
+    def test_navigations_are_coalesced(self):
+        """Queued navigations are superseded by a newer one."""
+        self.send("start")
+        running = self.submit("go_to", WATCH_URL)
+        time.sleep(0.05)
+        queued = self.submit("go_to", OTHER_URL)
+        latest = self.submit("go_to", WATCH_URL)
+
+        self.assertTrue(self.receive(queued)["superseded"])
+        self.assertNotIn("superseded", self.receive(running))
+        self.assertNotIn("superseded", self.receive(latest))
+        self.assertEqual(self.factory.drivers[0].calls["get"], 2)
+
+
+class SessionTests(ServerTestCase):
+    """Tests of independent sessions."""
+
+    factory_options = dict(load_time=0.5)
+    server_options = dict(max_sessions=2)
+
+    def test_sessions_run_in_parallel(self):
+        """Commands of different sessions don't wait for each other."""
+        self.send("start", session="a")
+        self.send("start", session="b")
+        start = time.monotonic()
+        first = self.submit("go_to", WATCH_URL, session="a")
+        second = self.submit("go_to", OTHER_URL, session="b")
+        self.assertTrue(self.receive(first)["ok"])
+        self.assertTrue(self.receive(second)["ok"])
+        self.assertLess(time.monotonic() - start, 0.9)
+        self.assertEqual(self.send("get_url", session="b")["url"], OTHER_URL)
+
+    def test_session_limit(self):
+        """Sessions beyond `max_sessions` are refused."""
+        self.send("start", session="a")
+        self.send("start", session="b")
+        response = self.send("start", session="c")
+        self.assertFalse(response["ok"])
+        self.assertIn("limit", response["error"])
+        self.assertEqual(len(self.factory.drivers), 2)
+
+    def test_exited_session_is_released(self):
+        """A session's slot is freed by ``exit``."""
+        self.send("start", session="a")
+        self.send("start", session="b")
+        self.send("exit", session="a")
+        self.assertNotIn("a", self.server.sessions)
+
+        self.socket.close()
+        self.open_connection()
+        self.assertTrue(self.send("start", session="c")["ok"])
+        self.assertEqual(set(self.server.sessions), {"b", "c"})
+
+
+class PrewarmTests(ServerTestCase):
+    """Tests of the spare browser built in the background."""
+
+    factory_options = dict(startup_time=0.3)
+    server_options = dict(prewarm=True)
+
+    def wait_for_spare(self):
+        """Wait until the spare browser is built and return the status."""
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            status = self.send("status")
+            if status["spare_ready"]:
+                return status
+            time.sleep(0.02)
+        self.fail("The spare browser wasn't built")
+
+    def test_spare_is_handed_over(self):
+        """``start`` takes the spare, and ``exit`` warms up a new one."""
+        status = self.send("status")
+        self.assertTrue(status["warming"])
+        self.assertFalse(status["spare_ready"])
+        status = self.wait_for_spare()
+        self.assertFalse(status["warming"])
+        self.assertEqual(len(self.factory.drivers), 1)
+
+        start = time.monotonic()
+        self.assertTrue(self.send("start")["ok"])
+        self.assertLess(time.monotonic() - start, 0.3)
+        status = self.send("status")
+        self.assertTrue(status["running"])
+        self.assertFalse(status["warming"] or status["spare_ready"])
+        self.assertEqual(len(self.factory.drivers), 1)
+
+        self.send("exit")
+        self.socket.close()
+        self.open_connection()
+        self.assertTrue(self.send("status")["warming"])
+        self.wait_for_spare()
+        self.assertEqual(len(self.factory.drivers), 2)
+        self.assertTrue(self.factory.drivers[0].quit_called)
+
+
+class DeadlineTests(ServerTestCase):
+    """Tests of command deadlines."""
+
+    factory_options = dict(load_time=0.5)
+    server_options = dict(hang_timeout=0.2)
+
+    def start_watched(self):
+        """Start a browser whose killing is recorded instead of done."""
+        self.send("start")
+        self.factory.drivers[0].service_pid = 1
+        kill_tree = mock.patch("processes.kill_tree").start()
+        self.addCleanup(mock.patch.stopall)
+        return kill_tree
+
+    def test_command_timeout(self):
+        """A command overrunning its timeout gets a timeout error."""
+        self.send("start")
+        response = self.send("go_to", WATCH_URL, timeout=0.05)
+        self.assertFalse(response["ok"])
+        self.assertTrue(response["timeout"])
+
+    def test_hung_command_kills_browser(self):
+        """A command still running hang_timeout after its deadline gets its
+        browser killed.
+        """
+        kill_tree = self.start_watched()
+        self.send("go_to", WATCH_URL, timeout=0.1)
+        time.sleep(0.4)
+        kill_tree.assert_called_once_with(1)
+
+    def test_slow_command_doesnt_kill_browser(self):
+        """A command finishing within hang_timeout past its deadline leaves
+        the browser alone.
+        """
+        kill_tree = self.start_watched()
+        self.assertTrue(self.send("go_to", WATCH_URL, timeout=0.4)["timeout"])
+        time.sleep(0.4)
+        kill_tree.assert_not_called()
+
+    def test_queued_timeout_doesnt_kill_browser(self):
+        """A command timing out behind a slow one doesn't make the busy
+        browser look hung.
+        """
+        kill_tree = self.start_watched()
+        running = self.submit("go_to", WATCH_URL)
+        time.sleep(0.05)
+        self.assertTrue(self.send("get_url", timeout=0.05)["timeout"])
+        self.assertTrue(self.receive(running)["ok"])
+        time.sleep(0.3)
+        kill_tree.assert_not_called()
+
+    def test_invalid_timeout(self):
+        """A timeout that isn't a positive number is rejected."""
+        for timeout in ("5", -1, True):
+            response = self.send("get_url", timeout=timeout)
+            self.assertFalse(response["ok"])
+        self.assertTrue(self.send("status")["ok"])
+
+    def test_timed_out_queued_command_is_skipped(self):
+        """A command that timed out while queued never runs."""
+        self.send("start")
+        running = self.submit("go_to", WATCH_URL)
+        time.sleep(0.05)
+        late = self.submit("go_to", OTHER_URL, timeout=0.1)
+        self.assertTrue(self.receive(late)["timeout"])
+        self.receive(running)
+        # Runs after the timed out command
+        self.send("start")
+
+        driver = self.factory.drivers[0]
+        self.assertEqual(driver.calls["get"], 1)
+        self.assertEqual(driver.page.url, WATCH_URL)
+
+
+class TcpTests(ServerTestCase):
+    """Tests of the TCP listener and its handshake."""
+
+    server_options = dict(tcp_address=("127.0.0.1", 0), secret="secret")
+
+    def connect(self):
+        """Open a TCP connection and return it with the challenge."""
+        sock = socket.create_connection(self.server.tcp_address, timeout=5)
+        self.addCleanup(sock.close)
+        decoder = protocol.FrameDecoder()
+        return sock, decoder, self.read(sock, decoder)["challenge"]
+
+    # noinspection PyMethodMayBeStatic
+    def read(self, sock, decoder):
+        """Wait for the next message on a connection."""
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                return None
+            messages = decoder.feed(data)
+            if messages:
+                return messages[0]
+
+    def test_authenticated_client(self):
+        """A client signing the challenge with the secret is served."""
+        sock, decoder, challenge = self.connect()
+        auth = transport.sign("secret", challenge)
+        sock.sendall(protocol.encode(dict(auth=auth, id=1)))
+        self.assertEqual(self.read(sock, decoder), dict(ok=True, id=1))
+        sock.sendall(protocol.encode(dict(command="status", id=2)))
+        self.assertTrue(self.read(sock, decoder)["ok"])
+
+    def test_wrong_secret(self):
+        """A client with the wrong secret is disconnected unserved."""
+        sock, decoder, challenge = self.connect()
+        auth = transport.sign("wrong", challenge)
+        command = dict(command="start", id=2)
+        sock.sendall(protocol.encode(dict(auth=auth, id=1)) + protocol.encode(command))
+        self.assertFalse(self.read(sock, decoder)["ok"])
+        self.assertIsNone(self.read(sock, decoder))
+        self.assertEqual(self.factory.drivers, [])
+
+    def test_tcp_requires_secret(self):
+        """A TCP listener can't be opened without a secret."""
+        with self.assertRaises(ValueError):
+            BrowserServer(self.factory, None, tcp_address=("127.0.0.1", 0))
+
+
+class HandoverTests(ServerTestCase):
+    """Tests of resuming sessions across server restarts."""
+
+    # docstr-coverage:inherited
+    def setUp(self):
+        state_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, state_directory)
+        self.state_file = os.path.join(state_directory, "state.json")
+        self.server_options = dict(state_file=self.state_file)
+        super().setUp()
+
+    def restart(self, detach):
+        """Replace the server by a new one using the same state file."""
+        self.socket.close()
+        self.server.stop()
+        self.thread.join(5)
+        self.server.close(detach=detach)
+
+        self.server = BrowserServer(self.factory, self.address, **self.server_options)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.thread.start()
+        self.open_connection()
+
+    def test_detached_browser_is_resumed(self):
+        """A browser left running by a server is taken over by the next."""
+        self.send("start")
+        self.send("go_to", WATCH_URL)
+        self.send("control", "play")
+
+        self.restart(detach=True)
+        state = self.send("state")
+        self.assertEqual(state["url"], WATCH_URL)
+        self.assertFalse(state["media"]["paused"])
+        self.assertTrue(self.send("control", "pause")["ok"])
+        self.assertEqual(len(self.factory.drivers), 1)
+        self.assertFalse(self.factory.drivers[0].quit_called)
+
+    def test_closed_browser_is_not_resumed(self):
+        """Browsers quit when the server closes without detaching."""
+        self.send("start")
+        self.send("go_to", WATCH_URL)
+
+        self.restart(detach=False)
+        self.assertTrue(self.factory.drivers[0].quit_called)
+        self.assertFalse(self.send("state")["running"])
+
+    def test_locked_browsers_are_refused(self):
+        """A second server can't use the browsers of a running one, but a
+        stale process id left by an exited server is ignored.
+        """
+        address = os.path.join(self.directory, "other.sock")
+        with self.assertRaisesRegex(RuntimeError, str(os.getpid())):
+            BrowserServer(self.factory, address, **self.server_options)
+        self.assertEqual(handover.owner(self.state_file), os.getpid())
+
+        stale = os.path.join(self.directory, "stale.json")
+        with open(f"{stale}.lock", "w") as f:
+            f.write("1")
+        self.assertIsNone(handover.owner(stale))
+
+
+if __name__ == "__main__":
+    unittest.main()
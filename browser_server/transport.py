@@ -0,0 +1,133 @@
+"""TCP transport of the browser server.
+
+Besides its unix socket, the server can listen on a TCP address so that
+clients on other machines can reach it. TCP clients have to prove that
+they know a shared secret before their commands are accepted: right
+after connecting, the server sends ``{"challenge": <hex nonce>}`` and
+the client has to answer with ``{"auth": <hex HMAC-SHA256 of the nonce
+keyed with the secret>}``. The server replies ``{"ok": true}`` and
+serves the connection, or sends an error and closes it.
+"""
+import hashlib
+import hmac
+import secrets
+import socket
+
+CHALLENGE_SIZE = 32  # Bytes of a challenge nonce
+HANDSHAKE_SIZE = 1024  # Maximal size of a message before authentication
+AUTH_TIMEOUT = 5.0  # Seconds a client has to authenticate
+
+# Keepalive probing of idle connections, so that peers which vanished
+# without closing their connection (e.g. a crashed host) are detected
+KEEPALIVE_IDLE = 30  # Seconds of idleness before the first probe
+KEEPALIVE_INTERVAL = 10  # Seconds between two probes
+KEEPALIVE_COUNT = 3  # Unanswered probes before the connection is dropped
+
+
+def parse_address(address):
+    """Split a TCP address into host and port.
+
+    Parameters
+    ----------
+    address : str
+        ``host:port``. IPv6 hosts have to be enclosed in brackets.
+
+    Returns
+    -------
+    tuple of (str, int)
+    """
+    host, separator, port = address.rpartition(":")
+    if not separator or not port.isdigit():
+        raise ValueError(f"Invalid TCP address: {address}")
+    return host.strip("[]"), int(port)
+
+
+def listen(address):
+    """Open a non-blocking TCP listening socket.
+
+    Parameters
+    ----------
+    address : tuple of (str, int)
+        Host and port to bind to.
+
+    Returns
+    -------
+    socket.socket
+    """
+    host, port = address
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen()
+    sock.setblocking(False)
+    return sock
+
+
+def configure(sock):
+    """Set the options of a connected TCP socket.
+
+    Nagle's algorithm is disabled, as messages are small and latency
+    matters more than the number of packets, and keepalive probes are
+    enabled where the platform supports tuning them.
+
+    Parameters
+    ----------
+    sock : socket.socket
+    """
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for option, value in (
+        ("TCP_KEEPIDLE", KEEPALIVE_IDLE),
+        ("TCP_KEEPINTVL", KEEPALIVE_INTERVAL),
+        ("TCP_KEEPCNT", KEEPALIVE_COUNT),
+    ):
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+
+def challenge():
+    """Create a random challenge nonce.
+
+    Returns
+    -------
+    str
+        The nonce, hex encoded.
+    """
+    return secrets.token_hex(CHALLENGE_SIZE)
+
+
+def sign(secret, nonce):
+    """Answer a challenge.
+
+    Parameters
+    ----------
+    secret : str
+        The shared secret.
+    nonce : str
+        The hex encoded challenge.
+
+    Returns
+    -------
+    str
+        The hex encoded HMAC-SHA256 of the nonce.
+    """
+    return hmac.new(secret.encode(), nonce.encode(), hashlib.sha256).hexdigest()
+
+
+def verify(secret, nonce, signature):
+    """Check the answer to a challenge in constant time.
+
+    Parameters
+    ----------
+    secret : str
+    nonce : str
+    signature : str
+
+    Returns
+    -------
+    bool
+    """
+    if not isinstance(signature, str):
+        return False
+    return hmac.compare_digest(sign(secret, nonce).encode(), signature.encode())
@@ -1,37 +1,129 @@
+import hashlib
+import hmac
+import itertools
 import socket
+import struct
 import json
+from collections import defaultdict, deque
 
 from django.conf import settings
 
 
 class BrowserClient:
-    """Client class for communication with a browser server."""
+    """Client class for communication with a browser server.
+
+    Messages are JSON objects prefixed with their length as a 4-byte
+    big-endian unsigned integer. Each request is tagged with an ``id``
+    that the server echoes in its response, so several requests can be
+    submitted before any response is read and responses may arrive in
+    any order.
+
+    A server on another machine is reached over TCP with an address of
+    the form ``tcp://host:port``. The client then answers the server's
+    challenge with an HMAC-SHA256 keyed with the shared secret before
+    sending any request.
+
+    Parameters
+    ----------
+    address : str or None
+        Path to the server's socket, or ``tcp://host:port``. Defaults to
+        the BROWSER_SERVER_ADDRESS setting.
+    session : str or None
+        Id of the browser session the requests are addressed to. The
+        server's default session is used if None.
+    timeout : float or None
+        Seconds the server may spend on each request before answering
+        with a timeout error. The server's default is used if None.
+    secret : str or None
+        Shared secret of the server's TCP clients. Defaults to the
+        BROWSER_SERVER_SECRET setting.
+    """
 
     START = "start"
     EXIT = "exit"
     GOTO = "go_to"
     GET = "get_url"
     CONTROL = "control"
+    BATCH = "batch"
+    JOB = "job"
+    SUBSCRIBE = "subscribe"
+    UNSUBSCRIBE = "unsubscribe"
+    STATUS = "status"
+    STATS = "stats"
+    PREFETCH = "prefetch"
+    STATE = "state"
+    QUEUE = "queue"
+
+    # Playback queue actions
+    QUEUE_GET = "get"
+    QUEUE_REPLACE = "replace"  # Value: urls and the position to start at
+    QUEUE_NEXT = "next"
+    QUEUE_PREVIOUS = "previous"
+    QUEUE_JUMP = "jump"  # Value: position
 
     # Media controller actions
+    PLAY = "play"
+    PAUSE = "pause"
     PLAY_PAUSE = "play_pause"
+    SEEK = "seek"  # Value: position in seconds
+    VOLUME = "volume"  # Value: between 0 and 1
+    RATE = "rate"  # Value: playback rate, 1 is normal speed
+    MUTE = "mute"  # Value: 1 to mute, 0 to unmute, toggle if omitted
     AUTOPLAY = "autoplay"
     FULLSCREEN = "fullscreen"
     SUBTITLES = "subtitles"
     HANDLE_COOKIE_POPUP = "cookie"
+    # Actions that take a value, the others take none
+    VALUE_ACTIONS = (SEEK, VOLUME, RATE, MUTE)
+
+    HEADER = struct.Struct("!I")
+    TCP_SCHEME = "tcp://"
 
-    def __init__(self, address=None):
+    def __init__(self, address=None, session=None, timeout=None, secret=None):
         self.address = address or settings.BROWSER_SERVER_ADDRESS
+        self.session = session
+        self.timeout = timeout
+        self.secret = secret
         self.socket = None
+        self._ids = itertools.count(1)
+        self._buffer = bytearray()
+        self._responses = defaultdict(deque)
 
     def __enter__(self):
-        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        self.socket.connect(self.address)
+        if self.address.startswith(self.TCP_SCHEME):
+            self._connect_tcp()
+        else:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(self.address)
         return self
 
+    def _connect_tcp(self):
+        """Connect to a TCP address and pass the server's handshake."""
+        host, _, port = self.address[len(self.TCP_SCHEME) :].rpartition(":")
+        self.socket = socket.create_connection((host.strip("[]"), int(port)))
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        try:
+            # Read here, so unix socket clients work without Django settings
+            secret = self.secret or getattr(settings, "BROWSER_SERVER_SECRET", None)
+            if not secret:
+                raise ConnectionError("No secret for the browser server")
+            challenge = self._read_message()["challenge"]
+            auth = hmac.new(
+                secret.encode(), challenge.encode(), hashlib.sha256
+            ).hexdigest()
+            response = self.send(dict(auth=auth))
+            if not response.get("ok"):
+                raise ConnectionError(response.get("error", "Authentication failed"))
+        except Exception:
+            self.__exit__(None, None, None)
+            raise
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.socket.close()
         self.socket = None
+        self._buffer.clear()
+        self._responses.clear()
 
     def send(self, value):
         """Send data to the connected server.
@@ -46,7 +138,201 @@ class BrowserClient:
         dict
             The received response.
         """
-        data = json.dumps(value)
-        self.socket.send(data.encode())
-        data = self.socket.recv(1024).decode()
-        return json.loads(data)
+        return self.receive(self.submit(value))
+
+    def batch(self, commands, stop_on_error=False):
+        """Run several commands in a single round trip.
+
+        Parameters
+        ----------
+        commands : list of dict
+            Commands in the form {'command': ..., 'value': ...}, executed
+            in order.
+        stop_on_error : bool
+            Skip the remaining commands once one fails.
+
+        Returns
+        -------
+        dict
+            The received response. 'results' holds each executed
+            command's response with its duration in seconds under
+            'time'.
+        """
+        value = dict(commands=list(commands), stop_on_error=stop_on_error)
+        return self.send(dict(command=self.BATCH, value=value))
+
+    def start_job(self, value):
+        """Run a command in the background on the server.
+
+        Parameters
+        ----------
+        value : dict
+            The command, in the form {'command': ..., 'value': ...}.
+
+        Returns
+        -------
+        dict
+            The received response, with the job's id under 'job'.
+        """
+        return self.send(dict(value, **{"async": True}))
+
+    def get_job(self, job_id, timeout=None):
+        """Check on a job started with `start_job`.
+
+        Parameters
+        ----------
+        job_id : int
+        timeout : float or None
+            Seconds to wait for the job to finish. If None, the current
+            status is returned immediately.
+
+        Returns
+        -------
+        dict
+            The received response. 'done' tells whether the job has
+            finished, in which case its response is under 'result'.
+        """
+        value = dict(id=job_id, timeout=timeout)
+        return self.send(dict(command=self.JOB, value=value))
+
+    def stats(self, reset=False):
+        """Get the server's latency metrics.
+
+        Parameters
+        ----------
+        reset : bool
+            Clear the metrics after they are reported.
+
+        Returns
+        -------
+        dict
+            The received response. 'histograms' maps metric names to
+            counts, latency statistics and buckets.
+        """
+        return self.send(dict(command=self.STATS, value=dict(reset=reset)))
+
+    def state(self):
+        """Get the state of the page and its player.
+
+        Returns
+        -------
+        dict
+            The received response. 'running' tells whether the browser
+            is running; if it is, 'url', 'title', 'media' (playback
+            position, duration, volume, ... or None without a media
+            element) and 'toggles' (e.g. subtitles, autoplay) follow.
+        """
+        return self.send(dict(command=self.STATE))
+
+    def queue(self, action=QUEUE_GET, **value):
+        """Change or get the playback queue. The server plays the queued
+        urls one after another, moving on when the media ends.
+
+        Parameters
+        ----------
+        action : str
+            One of the QUEUE_* actions.
+        value
+            ``urls`` and ``position`` for QUEUE_REPLACE, ``position``
+            for QUEUE_JUMP.
+
+        Returns
+        -------
+        dict
+            The received response, with the urls and the current
+            position under 'queue'.
+        """
+        return self.send(dict(command=self.QUEUE, value=dict(value, action=action)))
+
+    def subscribe(self, interval=1.0, types=None):
+        """Receive player events pushed by the server.
+
+        The connection should not be used for other requests while
+        iterating. Closing the client ends the subscription.
+
+        Parameters
+        ----------
+        interval : float
+            Minimal number of seconds between two time updates.
+        types : list of str or None
+            Event types to receive ('url', 'play', 'pause', 'ended',
+            'timeupdate'). All types are received if None.
+
+        Yields
+        ------
+        dict
+            Player events.
+        """
+        value = dict(interval=interval, types=types)
+        request_id = self.submit(dict(command=self.SUBSCRIBE, value=value))
+        response = self.receive(request_id)
+        if not response.get("ok"):
+            raise RuntimeError(response.get("error", "Subscription failed"))
+        while True:
+            message = self.receive(request_id)
+            if message.get("ended"):
+                return
+            yield message["event"]
+
+    def submit(self, value):
+        """Send a request without waiting for the response.
+
+        Parameters
+        ----------
+        value : dict
+            Data to be sent to the server.
+
+        Returns
+        -------
+        int
+            Id of the request, to be passed to `receive`.
+        """
+        request_id = next(self._ids)
+        message = dict(value, id=request_id)
+        if self.session is not None:
+            message.setdefault("session", self.session)
+        if self.timeout is not None:
+            message.setdefault("timeout", self.timeout)
+        payload = json.dumps(message).encode()
+        self.socket.sendall(self.HEADER.pack(len(payload)) + payload)
+        return request_id
+
+    def receive(self, request_id):
+        """Wait for the response to a submitted request.
+
+        Responses to other requests received in the meantime are kept
+        until they are asked for. Requests answered with several
+        messages (e.g. subscriptions) return the next one on each call.
+
+        Parameters
+        ----------
+        request_id : int
+
+        Returns
+        -------
+        dict
+            The received response.
+        """
+        while not self._responses.get(request_id):
+            response = self._read_message()
+            self._responses[response.pop("id", None)].append(response)
+        responses = self._responses[request_id]
+        response = responses.popleft()
+        if not responses:
+            del self._responses[request_id]
+        return response
+
+    def _read_message(self):
+        """Read a single message from the socket."""
+        (size,) = self.HEADER.unpack(self._read_exactly(self.HEADER.size))
+        return json.loads(self._read_exactly(size).decode())
+
+    def _read_exactly(self, size):
+        while len(self._buffer) < size:
+            data = self.socket.recv(max(size - len(self._buffer), 65536))
+            if not data:
+                raise ConnectionError("Connection closed by the browser server")
+            self._buffer += data
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
@@ -9,6 +9,8 @@ class CommandSerializer(serializers.Serializer):
 
     Fields:
         - Command: Command to be issued
+        - wait: Wait for the command to finish. If false, a job id is
+        returned instead.
     """
 
     # docstr-coverage:inherited
@@ -24,6 +26,7 @@ class CommandSerializer(serializers.Serializer):
         (BrowserClient.EXIT, "End"),
     ]
     command = serializers.ChoiceField(choices=COMMAND_CHOICES)
+    wait = serializers.BooleanField(default=True)
 
 
 class NavigateSerializer(serializers.Serializer):
@@ -31,6 +34,8 @@ class NavigateSerializer(serializers.Serializer):
 
     Fields:
         - url: The url the browser is to navigate to.
+        - wait: Wait for the page to load. If false, a job id is
+        returned instead.
     """
 
     # docstr-coverage:inherited
@@ -42,13 +47,15 @@ class NavigateSerializer(serializers.Serializer):
         pass
 
     url = serializers.CharField(max_length=128)
+    wait = serializers.BooleanField(default=True)
 
 
 class ControlSerializer(serializers.Serializer):
     """Serializer for media controller commands
 
     Fields:
-        - value: action to be performed by the controller.
+        - action: action to be performed by the controller.
+        - value: the action's argument, for seek, volume, rate and mute.
     """
 
     # docstr-coverage:inherited
@@ -60,13 +67,20 @@ class ControlSerializer(serializers.Serializer):
         pass
 
     ACTION_CHOICES = [
+        (BrowserClient.PLAY, "Play"),
+        (BrowserClient.PAUSE, "Pause"),
         (BrowserClient.PLAY_PAUSE, "Play / Pause"),
+        (BrowserClient.SEEK, "Seek"),
+        (BrowserClient.VOLUME, "Volume"),
+        (BrowserClient.RATE, "Playback rate"),
+        (BrowserClient.MUTE, "Mute"),
         (BrowserClient.AUTOPLAY, "Autoplay"),
         (BrowserClient.FULLSCREEN, "Fullscreen"),
         (BrowserClient.SUBTITLES, "Subtitles"),
         (BrowserClient.HANDLE_COOKIE_POPUP, "Accept cookies"),
     ]
     action = serializers.ChoiceField(choices=ACTION_CHOICES)
+    value = serializers.FloatField(required=False)
 
 
 # PlaylistElement model serializers
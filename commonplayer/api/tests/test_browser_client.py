@@ -1,4 +1,8 @@
 """Tests associated with browser client functionality."""
+import hashlib
+import hmac
+import json
+import struct
 import sys
 import unittest
 
@@ -10,6 +14,12 @@ sys.path.append("..")
 # TODO: Mock server
 
 
+def frame(data):
+    """Encode a message the way the browser server does."""
+    payload = json.dumps(data).encode()
+    return struct.pack("!I", len(payload)) + payload
+
+
 class ClientTests(unittest.TestCase):
     """Tests for BrowserClient class."""
 
@@ -23,18 +33,101 @@ class ClientTests(unittest.TestCase):
             self.client.socket.close()
 
     def test_client_send_called(self):
-        """send() method calls socket.send()"""
+        """send() method sends a length-prefixed message with an id"""
         data = {"msg": "test"}
         with mock.patch.object(self.client, "socket"):
-            self.client.socket.recv.return_value = b'{"msg": "test"}'
+            self.client.socket.recv.return_value = frame({"msg": "test", "id": 1})
             self.client.send(data)
-            self.client.socket.send.assert_called_with(b'{"msg": "test"}')
+            self.client.socket.sendall.assert_called_with(
+                frame({"msg": "test", "id": 1})
+            )
 
     def test_client_send_response(self):
         """send() method waits for and parses response"""
         data = {"msg": "test"}
         with mock.patch.object(self.client, "socket"):
-            self.client.socket.recv.return_value = b'{"msg": "test"}'
+            self.client.socket.recv.return_value = frame({"msg": "test", "id": 1})
             response = self.client.send(data)
             self.client.socket.recv.assert_called()
         self.assertEqual(response, data)
+
+    def test_client_response_split_across_reads(self):
+        """Responses split across several reads are reassembled"""
+        message = frame({"msg": "x" * 5000, "id": 1})
+        with mock.patch.object(self.client, "socket"):
+            self.client.socket.recv.side_effect = [
+                message[:3],
+                message[3:100],
+                message[100:],
+            ]
+            response = self.client.send({})
+        self.assertEqual(response, {"msg": "x" * 5000})
+
+    def test_client_out_of_order_responses(self):
+        """Pipelined responses are matched to requests by id"""
+        with mock.patch.object(self.client, "socket"):
+            first = self.client.submit({"msg": "first"})
+            second = self.client.submit({"msg": "second"})
+            self.client.socket.recv.return_value = frame(
+                {"msg": "second", "id": second}
+            ) + frame({"msg": "first", "id": first})
+            self.assertEqual(self.client.receive(first), {"msg": "first"})
+            self.assertEqual(self.client.receive(second), {"msg": "second"})
+            self.client.socket.recv.assert_called_once()
+
+    def test_client_connection_closed(self):
+        """Closed connection raises ConnectionError"""
+        with mock.patch.object(self.client, "socket"):
+            self.client.socket.recv.return_value = b""
+            with self.assertRaises(ConnectionError):
+                self.client.send({})
+
+    def test_client_session(self):
+        """Requests are addressed to the client's session"""
+        client = BrowserClient(address="./test.sock", session="room")
+        with mock.patch.object(client, "socket"):
+            client.socket.recv.return_value = frame({"id": 1})
+            client.send({"msg": "test"})
+            client.socket.sendall.assert_called_with(
+                frame({"msg": "test", "id": 1, "session": "room"})
+            )
+
+    def test_client_batch(self):
+        """batch() sends a single batch command"""
+        commands = [{"command": "start"}, {"command": "go_to", "value": "url"}]
+        with mock.patch.object(self.client, "send") as mock_send:
+            self.client.batch(commands, stop_on_error=True)
+        mock_send.assert_called_once_with(
+            {
+                "command": "batch",
+                "value": {"commands": commands, "stop_on_error": True},
+            }
+        )
+
+    def test_client_tcp_handshake(self):
+        """TCP clients answer the server's challenge with the secret"""
+        client = BrowserClient(address="tcp://example.com:8765", secret="secret")
+        auth = hmac.new(b"secret", b"nonce", hashlib.sha256).hexdigest()
+        with mock.patch("socket.create_connection") as create_connection:
+            sock = create_connection.return_value
+            sock.recv.side_effect = [
+                frame({"challenge": "nonce"}),
+                frame({"ok": True, "id": 1}),
+            ]
+            with client:
+                create_connection.assert_called_once_with(("example.com", 8765))
+                sock.sendall.assert_called_with(frame({"auth": auth, "id": 1}))
+
+    def test_client_tcp_authentication_failure(self):
+        """A rejected handshake raises ConnectionError"""
+        client = BrowserClient(address="tcp://example.com:8765", secret="wrong")
+        with mock.patch("socket.create_connection") as create_connection:
+            sock = create_connection.return_value
+            sock.recv.side_effect = [
+                frame({"challenge": "nonce"}),
+                frame({"ok": False, "error": "Authentication failed", "id": 1}),
+            ]
+            with self.assertRaises(ConnectionError):
+                client.__enter__()
+        sock.close.assert_called_once()
+        self.assertIsNone(client.socket)
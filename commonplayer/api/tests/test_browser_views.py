@@ -7,6 +7,9 @@ from rest_framework.test import APITestCase
 from rest_framework.reverse import reverse
 from rest_framework.response import Response
 
+from tests.util import create_test_user
+from main.models import Playlist, MediaLink
+
 
 sys.path.append("..")
 
@@ -15,9 +18,14 @@ EXIT = "exit"
 GOTO = "go_to"
 GET = "get_url"
 CONTROL = "control"
+JOB = "job"
+STATUS = "status"
+STATE = "state"
+QUEUE = "queue"
 
 # Media controller actions
 PLAY = "play"
+SEEK = "seek"
 AUTOPLAY = "autoplay"
 FULLSCREEN = "fullscreen"
 SUBTITLES = "subtitles"
@@ -54,6 +62,17 @@ class NavViewTests(APITestCase):
         self.client.post(self.url, data=dict(url="fake_url"))
         mock_send.assert_called_with({"command": GOTO, "value": "fake_url"})
 
+    def test_go_to_url_no_wait(self, mock_send):
+        """
+        POST request to NavigateView with wait set to false sends an
+        asynchronous command.
+        """
+        mock_send.return_value = Response()
+        self.client.post(self.url, data=dict(url="fake_url", wait=False))
+        mock_send.assert_called_with(
+            {"command": GOTO, "value": "fake_url", "async": True}
+        )
+
 
 @mock.patch("api.views.browser_views.BrowserClientView.send_to_browser_server")
 class LifecycleViewTests(APITestCase):
@@ -76,6 +95,24 @@ class LifecycleViewTests(APITestCase):
         q_dict.update(data)
         mock_send.assert_called_with(q_dict)
 
+    def test_get_status(self, mock_send):
+        """
+        GET request to LifecycleView sends status command to browser
+        server.
+        """
+        mock_send.return_value = Response()
+        self.client.get(self.url)
+        mock_send.assert_called_with({"command": STATUS})
+
+    def test_post_command_no_wait(self, mock_send):
+        """
+        POST request to LifecycleView with wait set to false sends an
+        asynchronous command.
+        """
+        mock_send.return_value = Response()
+        self.client.post(self.url, data=dict(command=START, wait="false"))
+        mock_send.assert_called_with({"command": START, "async": True})
+
 
 @mock.patch("api.views.browser_views.BrowserClientView.send_to_browser_server")
 class ControlViewTests(APITestCase):
@@ -96,3 +133,118 @@ class ControlViewTests(APITestCase):
         self.client.post(self.url, data=dict(action="test_action"))
         called_with = {"command": CONTROL, "value": "test_action"}
         mock_send.assert_called_with(called_with)
+
+    def test_post_media_action_with_value(self, mock_send):
+        """
+        POST request to ControlView with a value sends the action and
+        its numeric argument.
+        """
+        mock_send.return_value = Response()
+        self.client.post(self.url, data=dict(action=SEEK, value="12.5"))
+        called_with = {"command": CONTROL, "value": {"action": SEEK, "value": 12.5}}
+        mock_send.assert_called_with(called_with)
+
+    def test_post_media_action_invalid_value(self, mock_send):
+        """POST request to ControlView with a non-numeric value is rejected."""
+        response = self.client.post(self.url, data=dict(action=SEEK, value="x"))
+        self.assertEqual(response.status_code, 400)
+        mock_send.assert_not_called()
+
+    def test_post_media_action_unexpected_value(self, mock_send):
+        """
+        POST request to ControlView with a value for an action that
+        takes none is rejected.
+        """
+        response = self.client.post(self.url, data=dict(action=AUTOPLAY, value="1"))
+        self.assertEqual(response.status_code, 400)
+        mock_send.assert_not_called()
+
+
+@mock.patch("api.views.browser_views.BrowserClientView.send_to_browser_server")
+class StateViewTests(APITestCase):
+    """State view tests"""
+
+    def test_get_state(self, mock_send):
+        """GET request to StateView sends state command to browser server."""
+        mock_send.return_value = Response()
+        self.client.get(reverse("api-state"))
+        mock_send.assert_called_with({"command": STATE})
+
+
+@mock.patch("api.views.browser_views.BrowserClientView.send_to_browser_server")
+class QueueViewTests(APITestCase):
+    """Queue view tests"""
+
+    # docstr-coverage:inherited
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.url = reverse("api-queue")
+
+    def test_get_queue(self, mock_send):
+        """GET request to QueueView sends queue command with get action."""
+        mock_send.return_value = Response()
+        self.client.get(self.url)
+        mock_send.assert_called_with({"command": QUEUE, "value": {"action": "get"}})
+
+    def test_post_jump(self, mock_send):
+        """POST request to QueueView sends jump action with the position."""
+        mock_send.return_value = Response()
+        self.client.post(self.url, data=dict(action="jump", position="2"))
+        called_with = {"command": QUEUE, "value": {"action": "jump", "position": 2}}
+        mock_send.assert_called_with(called_with)
+
+    def test_post_invalid_action(self, mock_send):
+        """POST request to QueueView with an unknown action is rejected."""
+        response = self.client.post(self.url, data=dict(action="replace"))
+        self.assertEqual(response.status_code, 400)
+        mock_send.assert_not_called()
+
+
+@mock.patch("api.views.browser_views.BrowserClientView.send_to_browser_server")
+class PlaylistPlayViewTests(APITestCase):
+    """Playlist play view tests"""
+
+    # docstr-coverage:inherited
+    @classmethod
+    def setUpTestData(cls):
+        user = create_test_user()
+        cls.playlist = Playlist.objects.create(name="test_playlist", added_by=user)
+        for source in ("test.url", "test.url2"):
+            media_link = MediaLink.objects.create(source=source, added_by=user)
+            cls.playlist.add_media_at(media_link, 0)
+
+    def test_post_queues_playlist(self, mock_send):
+        """
+        POST request to PlaylistPlayView queues the playlist's sources in
+        order.
+        """
+        mock_send.return_value = Response()
+        url = reverse("api-playlist-play", args=[self.playlist.pk])
+        self.client.post(url, data=dict(position=1))
+        value = {"action": "replace", "urls": ["test.url2", "test.url"], "position": 1}
+        mock_send.assert_called_with({"command": QUEUE, "value": value})
+
+    def test_post_unknown_playlist(self, mock_send):
+        """POST request to PlaylistPlayView for a missing playlist is a 404."""
+        response = self.client.post(reverse("api-playlist-play", args=[999]))
+        self.assertEqual(response.status_code, 404)
+        mock_send.assert_not_called()
+
+
+@mock.patch("api.views.browser_views.BrowserClientView.send_to_browser_server")
+class JobViewTests(APITestCase):
+    """Job view tests"""
+
+    def test_get_job(self, mock_send):
+        """GET request to JobView sends job command with the timeout."""
+        mock_send.return_value = Response()
+        self.client.get(reverse("api-job", args=[3]), data=dict(timeout=1.5))
+        called_with = {"command": JOB, "value": {"id": 3, "timeout": 1.5}}
+        mock_send.assert_called_with(called_with)
+
+    def test_get_job_invalid_timeout(self, mock_send):
+        """GET request to JobView with an invalid timeout is rejected."""
+        response = self.client.get(reverse("api-job", args=[3]), data=dict(timeout="x"))
+        self.assertEqual(response.status_code, 400)
+        mock_send.assert_not_called()
@@ -8,6 +8,9 @@ urlpatterns = [
     path("nav/", browser_views.NavigateView.as_view(), name="api-nav"),
     path("window/", browser_views.LifecycleView.as_view(), name="api-lifecycle"),
     path("control/", browser_views.ControlView.as_view(), name="api-control"),
+    path("state/", browser_views.StateView.as_view(), name="api-state"),
+    path("queue/", browser_views.QueueView.as_view(), name="api-queue"),
+    path("jobs/<int:job_id>", browser_views.JobView.as_view(), name="api-job"),
     # Playlist views
     path("playlists/", playlist_views.PlaylistView.as_view(), name="api-playlist"),
     path(
@@ -15,6 +18,11 @@ urlpatterns = [
         playlist_views.PlaylistDetailView.as_view(),
         name="api-playlist-detail",
     ),
+    path(
+        "playlists/<int:pk>/play",
+        browser_views.PlaylistPlayView.as_view(),
+        name="api-playlist-play",
+    ),
     path("media_links/", playlist_views.MediaLinkView.as_view(), name="api-media_link"),
     path(
         "media_links/<int:pk>",
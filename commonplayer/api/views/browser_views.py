@@ -1,10 +1,13 @@
 """Views for controlling the browser."""
+from django.shortcuts import get_object_or_404
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.fields import BooleanField
 
 from api.client import BrowserClient
 from api import serializers
+from main.models import Playlist
 
 
 class BrowserClientView(APIView):
@@ -34,6 +37,23 @@ class BrowserClientView(APIView):
             return Response(browser_response, status.HTTP_500_INTERNAL_SERVER_ERROR)
         return Response(browser_response)
 
+    @staticmethod
+    def wait_requested(request):
+        """Whether the request asks to wait for the command to finish.
+
+        Commands sent with `wait` set to false run in the background
+        and the response contains a job id to be checked with JobView.
+
+        Parameters
+        ----------
+        request : Request
+
+        Returns
+        -------
+        bool
+        """
+        return request.data.get("wait", True) not in BooleanField.FALSE_VALUES
+
 
 class NavigateView(BrowserClientView):
     """Navigate to or get current url.
@@ -54,6 +74,8 @@ class NavigateView(BrowserClientView):
             "command": BrowserClient.GOTO,
             "value": request.data.get("url"),
         }
+        if not self.wait_requested(request):
+            data["async"] = True
         return self.send_to_browser_server(data)
 
 
@@ -62,6 +84,12 @@ class LifecycleView(BrowserClientView):
 
     serializer_class = serializers.CommandSerializer
 
+    def get(self, _):
+        """Get the browser's status: whether it is running and whether
+        a spare browser is warming up or ready.
+        """
+        return self.send_to_browser_server({"command": BrowserClient.STATUS})
+
     def post(self, request):
         """Send a command to the server.
 
@@ -69,10 +97,123 @@ class LifecycleView(BrowserClientView):
         - Start: start a browser
         - End: close a browser
         """
-
+        if not self.wait_requested(request):
+            data = {"command": request.data.get("command"), "async": True}
+            return self.send_to_browser_server(data)
         return self.send_to_browser_server(request.data)
 
 
+class StateView(BrowserClientView):
+    """Get the state of the browser's page and player."""
+
+    def get(self, _):
+        """Get the url and title of the page, the playback state of its
+        media and the state of player settings such as subtitles, all
+        collected at once.
+        """
+        return self.send_to_browser_server({"command": BrowserClient.STATE})
+
+
+class QueueView(BrowserClientView):
+    """Get or move through the browser's playback queue."""
+
+    ACTIONS = (
+        BrowserClient.QUEUE_NEXT,
+        BrowserClient.QUEUE_PREVIOUS,
+        BrowserClient.QUEUE_JUMP,
+    )
+
+    def get(self, _):
+        """Get the queued urls and the position of the current one."""
+        data = {
+            "command": BrowserClient.QUEUE,
+            "value": {"action": BrowserClient.QUEUE_GET},
+        }
+        return self.send_to_browser_server(data)
+
+    def post(self, request):
+        """Move through the queue.
+
+        Available actions:
+        - next: Play the next url
+        - previous: Play the previous url
+        - jump: Play the url at `position`
+        """
+        action = request.data.get("action")
+        if action not in self.ACTIONS:
+            return Response(
+                {"action": f"Must be one of: {', '.join(self.ACTIONS)}."},
+                status.HTTP_400_BAD_REQUEST,
+            )
+        value = {"action": action}
+        if action == BrowserClient.QUEUE_JUMP:
+            try:
+                value["position"] = int(request.data.get("position"))
+            except (TypeError, ValueError):
+                return Response(
+                    {"position": "A valid integer is required."},
+                    status.HTTP_400_BAD_REQUEST,
+                )
+        return self.send_to_browser_server(
+            {"command": BrowserClient.QUEUE, "value": value}
+        )
+
+
+class PlaylistPlayView(BrowserClientView):
+    """Play a playlist in the browser."""
+
+    def post(self, request, pk):
+        """Queue the playlist's media links in order and start playing
+        the one at `position` (the first one by default). The browser
+        moves on to the next one by itself.
+        """
+        playlist = get_object_or_404(Playlist, pk=pk)
+        try:
+            position = int(request.data.get("position", 0))
+        except (TypeError, ValueError):
+            return Response(
+                {"position": "A valid integer is required."},
+                status.HTTP_400_BAD_REQUEST,
+            )
+        urls = [
+            element.media_link.source
+            for element in playlist.elements.order_by("position").select_related(
+                "media_link"
+            )
+        ]
+        data = {
+            "command": BrowserClient.QUEUE,
+            "value": {
+                "action": BrowserClient.QUEUE_REPLACE,
+                "urls": urls,
+                "position": position,
+            },
+        }
+        return self.send_to_browser_server(data)
+
+
+class JobView(BrowserClientView):
+    """Check on a command started with `wait` set to false."""
+
+    def get(self, request, job_id):
+        """Get the status of a job and its result once it is done.
+
+        The `timeout` query parameter sets the number of seconds to wait
+        for the job to finish before responding.
+        """
+        try:
+            timeout = float(request.query_params.get("timeout", 0))
+        except ValueError:
+            return Response(
+                {"timeout": "A valid number is required."}, status.HTTP_400_BAD_REQUEST
+            )
+        data = {
+            "command": BrowserClient.JOB,
+            "value": {"id": job_id, "timeout": timeout},
+        }
+        return self.send_to_browser_server(data)
+
+
 class ControlView(BrowserClientView):
     """Issue commands to the media controller."""
 
@@ -82,7 +223,13 @@ class ControlView(BrowserClientView):
         """Send a media controller command to the server.
 
         Available commands:
+        - Play, Pause: Play or pause the media
         - Play / Pause: Toggle play / pause
+        - Seek: Jump to the position in seconds given as `value`
+        - Volume: Set the volume to `value`, between 0 and 1
+        - Playback rate: Set the playback rate to `value`
+        - Mute: Mute if `value` is 1, unmute if it is 0, toggle if
+        omitted
         - Fullscreen: Toggle fullscreen
         - Autoplay: Toggle autoplay
         - Subtitles: Toggle subtitles
@@ -90,5 +237,22 @@ class ControlView(BrowserClientView):
         case automatic closing fails.
         """
         data = dict(command=BrowserClient.CONTROL)
-        data["value"] = request.data.get("action")
+        action = request.data.get("action")
+        value = request.data.get("value")
+        if value in (None, ""):
+            data["value"] = action
+        elif action not in BrowserClient.VALUE_ACTIONS:
+            return Response(
+                {"value": "This action takes no value."},
+                status.HTTP_400_BAD_REQUEST,
+            )
+        else:
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                return Response(
+                    {"value": "A valid number is required."},
+                    status.HTTP_400_BAD_REQUEST,
+                )
+            data["value"] = {"action": action, "value": value}
         return self.send_to_browser_server(data)
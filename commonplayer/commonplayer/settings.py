@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -131,4 +132,7 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 AUTH_USER_MODEL = "main.User"
 
 # Browser server
+# Path to the unix socket, or tcp://host:port for a server on another machine
 BROWSER_SERVER_ADDRESS = "/tmp/browser.sock"
+# Shared secret of TCP connections to the browser server
+BROWSER_SERVER_SECRET = os.environ.get("BROWSER_SERVER_SECRET")